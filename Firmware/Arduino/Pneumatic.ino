@@ -21,6 +21,75 @@ int solenoidPins[12] = {13, 12, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2};
 // PCA9548A channels: Using all 8 channels (0 to 7)
 uint8_t sensor_channels[8] = {0, 1, 2, 3, 4, 5, 6, 7};
 
+// --------------------------------------- Binary protocol --------------------------------------
+// "B1" from the Pi switches to COBS framed binary frames, "B0" back to text lines (see arduino_frames.py):
+// type, sequence (u16), payload, CRC-16/CCITT-FALSE (u16), COBS encoded and terminated by a zero byte
+#define FRAME_SAMPLE  0x01
+#define FRAME_MESSAGE 0x02
+bool binaryProtocol = false;
+uint16_t frameSequence = 0;
+uint8_t frameBuffer[64];
+uint8_t frameLength = 0;
+
+uint16_t crc16(const uint8_t *data, uint8_t length) {
+  uint16_t crc = 0xFFFF;
+  for (uint8_t i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void frameStart(uint8_t type) {
+  frameBuffer[0] = type;
+  frameBuffer[1] = frameSequence & 0xFF;
+  frameBuffer[2] = frameSequence >> 8;
+  frameLength = 3;
+  frameSequence++;
+}
+
+void frameAppend(const void *data, uint8_t length) {
+  if (frameLength + length > sizeof(frameBuffer) - 2) return;  // Leave room for the CRC
+  memcpy(frameBuffer + frameLength, data, length);
+  frameLength += length;
+}
+
+void frameSend() {
+  uint16_t crc = crc16(frameBuffer, frameLength);
+  frameBuffer[frameLength++] = crc & 0xFF;
+  frameBuffer[frameLength++] = crc >> 8;
+
+  // COBS: every block of non-zero bytes is prefixed with its length + 1 (frames are shorter than 254 bytes)
+  uint8_t encoded[sizeof(frameBuffer) + 2];
+  uint8_t codeIndex = 0, out = 1, code = 1;
+  for (uint8_t i = 0; i < frameLength; i++) {
+    if (frameBuffer[i] == 0) {
+      encoded[codeIndex] = code;
+      codeIndex = out++;
+      code = 1;
+    } else {
+      encoded[out++] = frameBuffer[i];
+      code++;
+    }
+  }
+  encoded[codeIndex] = code;
+  encoded[out++] = 0;  // Frame delimiter
+  Serial.write(encoded, out);
+}
+
+// Status message, as a text line or as a binary frame
+void sendStatus(const String &message) {
+  if (binaryProtocol) {
+    frameStart(FRAME_MESSAGE);
+    frameAppend(message.c_str(), message.length());
+    frameSend();
+  } else {
+    Serial.println(message);
+  }
+}
+
 void pcaselect(uint8_t i) {
   if (i > 7) return;  // Ensure channel index is within range
   Wire.beginTransmission(PCAADDR);
@@ -71,8 +140,17 @@ void loop() {
       String input = Serial.readStringUntil('\n');
       input.trim();
 
+      // Latency probe from the Pi ("P<id>"): echo the id right away
+      if (input.startsWith("P")) {
+          sendStatus("Pong " + input.substring(1));
+      }
+      // Protocol switch from the Pi: "B1" binary frames, "B0" text lines
+      else if (input == "B1" || input == "B0") {
+          binaryProtocol = (input == "B1");
+          sendStatus(binaryProtocol ? "Binary protocol on." : "Binary protocol off.");
+      }
       // Process binary string for valve control
-      if (input.length() == 12) { // Expect a 12-bit binary string
+      else if (input.length() == 12) { // Expect a 12-bit binary string
           bool isValid = true;
 
           // Validate the binary string contains only '0' or '1'
@@ -89,12 +167,12 @@ void loop() {
                   bool state = (input[i] == '1');
                   digitalWrite(solenoidPins[i], state ? HIGH : LOW);
               }
-              Serial.println("Updated valve states from binary string.");
+              sendStatus("Updated valve states from binary string.");
           } else {
-              Serial.println("Invalid binary string received.");
+              sendStatus("Invalid binary string received.");
           }
       } else {
-          Serial.println("Invalid input length received.");
+          sendStatus("Invalid input length received.");
       }
     }
 
@@ -105,6 +183,21 @@ void loop() {
 
     unsigned long loopCurrentTime = millis() - startTime;
 
+    if (binaryProtocol) {
+      uint32_t timeMs = loopCurrentTime;
+      float veabValue = 0.0;  // Placeholder for VEAB sensor data
+      frameStart(FRAME_SAMPLE);
+      frameAppend(&timeMs, sizeof(timeMs));
+      frameAppend(&veabValue, sizeof(veabValue));
+      for (uint8_t t = 0; t < 8; t++) {
+        pcaselect(sensor_channels[t]);
+        float calibrated_pressure = (mpr_sensors[t].readPressure() - sensor_offsets[t]) * 100;
+        frameAppend(&calibrated_pressure, sizeof(calibrated_pressure));
+      }
+      frameSend();
+      return;
+    }
+
     Serial.print(loopCurrentTime);
     Serial.print(",");
 
@@ -1,16 +1,44 @@
 import multiprocessing
+import os
+import queue
+import select
+import signal
 import socket
 import struct
 import time
+from concurrent.futures import ThreadPoolExecutor
 from ctypes import c_bool
-from adafruit_extended_bus import ExtendedI2C as I2C
-import adafruit_mcp4725
-import adafruit_ads1x15.ads1015 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
-from adafruit_ads1x15.ads1x15 import Mode
-import serial
-from multiprocessing import Manager
-import RPi.GPIO as GPIO
+from multiprocessing import reduction
+from arduino_io import SerialMux
+from controller import ALL_ACTUATORS, PressureControl, TickBudget, CONTROL_GAINS_STRUCT, VEAB_FULL_SCALE, unpack_gains
+from hardware import load_backend
+from realtime import apply_schedule
+from protocol import CommandParser, PING_STRUCT, PING_ARDUINO, sequence_payload_size, unpack_sequence
+from recorder import Recorder, RECORD_SAMPLE, RECORD_VALVE, RECORD_DAC
+from sample_store import SampleRing, SampleStore, ValueStore
+from dac import build_dac_buses
+from scheduler import PeriodicScheduler, LoopStats, SKIP
+from sequencer import SequencePlayer
+from startup import StartupTimer
+from telemetry import (TELEMETRY_TEXT, TELEMETRY_BINARY, TELEMETRY_MODES, RATE_STRUCT, ECHO_ACKED, VEAB_BLOCK_SAMPLES,
+                       CLOCK_INTERVAL)
+from telemetry_server import TelemetryHub
+from waveform import WaveformBank, WaveformParameters, WAVEFORM_STRUCT, WAVE_OFF, table_payload_size, unpack_table, unpack_waveform
+
+# Bus workers start on a common tick grid anchored this long after the processes are created
+BUS_WORKER_START_NS = 200000000
+# Seconds of VEAB samples kept in the shared ring buffer
+VEAB_RING_SECONDS = 4
+# Arduino samples kept in the shared ring buffer send aggregates from (40 s at 100 Hz)
+SAMPLE_RING_SIZE = 4096
+# Outputs applied when the control client goes away: every valve closed, regulators at their default setpoint
+SAFE_VALVES = '0' * 16
+SAFE_ACTUATOR_VALUE = 0.5
+# TCP keepalive of the control client, so a peer that vanished without closing (cable pulled,
+# PC asleep) is detected within about KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT seconds
+KEEPALIVE_IDLE = 2
+KEEPALIVE_INTERVAL = 1
+KEEPALIVE_COUNT = 3
 
 class baseSensor:
     def __init__(self, sensorInstance):
@@ -21,12 +49,10 @@ class baseSensor:
         raise NotImplementedError("readSensor must be implemented in the child class")
 
 class VeabSensor(baseSensor):
-    def __init__(self, i2c, addr=(0x48), RATE=490):
-        ads = ADS.ADS1015(I2C(i2c), address=addr)
-        ads.mode = Mode.CONTINUOUS
-        ads.data_rate = RATE
-        ads.gain = 2
-        chan = AnalogIn(ads, ADS.P0)
+    def __init__(self, i2c, addr=(0x48), RATE=490, backend=None):
+        backend = backend if backend is not None else load_backend("pi")
+        # ADS1015 in continuous mode, channel P0
+        chan = backend.adc(backend.i2c_bus(i2c), addr, RATE, gain=2)
         super().__init__(chan)
         self._adjusted_voltage = 0.0  # Custom attribute for adjusted voltage
 
@@ -44,15 +70,20 @@ class VeabSensor(baseSensor):
 
 
 class VEABcontrolboard:
-    def __init__(self, i2c):
+    def __init__(self, i2c, backend=None, veabRate=490):
+        backend = backend if backend is not None else load_backend("pi")
         # Initialize two sensors and two actuators (DACs) on the same I2C bus
-        self.sensors = [VeabSensor(i2c, addr=0x48)]
-        self.actuators = [
-            adafruit_mcp4725.MCP4725(I2C(i2c), address=0x60)
-        ]
+        self.channel = i2c
+        self.bus = backend.i2c_bus(i2c)  # Shared by the DACs so their writes can be grouped per bus
+        self.dac_addresses = [0x60]
+        self.sensors = [VeabSensor(i2c, addr=0x48, RATE=veabRate, backend=backend)]
+        self.actuators = [backend.dac(self.bus, address) for address in self.dac_addresses]
 
 class SoftRobot:
-    def __init__(self, i2c=[1], sensorFreq=250, actuatorFreq=250, port=8888, arduino_port="/dev/ttyACM0"):
+    def __init__(self, i2c=[1], sensorFreq=250, actuatorFreq=250, port=8888, arduino_port="/dev/ttyACM0", dacDeadband=0.0, telemetryPort=None, backend="pi", recordDir=None, controlFeedback="adc", busWorkers=False, veabRate=490, arduinoProtocol="ascii", schedule=None, lockMemory=False, startup=None, exitOnDisconnect=False):
+        self.startup = startup if startup is not None else StartupTimer()  # Durations of the startup phases
+        # Hardware backend: "pi" for the real boards, "sim" (or a backend object) for simulated hardware
+        self.backend = load_backend(backend) if isinstance(backend, str) else backend
         self.stopFlag = multiprocessing.Value(c_bool, False)  # Shared flag to stop processes
 
         self.nSensors = 0  # Initialize the number of sensors
@@ -63,13 +94,55 @@ class SoftRobot:
         self.actuator_frequency = actuatorFreq  # Frequency for controlling actuators
         self.actuator_period = 1.0 / actuatorFreq  # Time period for actuator control
         
+        self.startup.since_last("backend")
+
         # Initialize VEAB control boards (each with sensors and actuators)
-        self.boards = [VEABcontrolboard(chan) for chan in self.channels]
+        with self.startup.phase("hardware init"):
+            self.boards = self.initBoards(veabRate)
         
         # Aggregate all sensors and actuators from the boards
+        self.sensors = [sensor for board in self.boards for sensor in board.sensors]  # Sensor i is the feedback of actuator i
         self.actuators = [actuator for board in self.boards for actuator in board.actuators]
+        # acquireVeab reads every VEAB ADC at its data rate into this ring buffer; the closed loop
+        # takes its feedback from it and send streams it to the clients that asked for it (b'V')
+        self.veab_rate = veabRate
+        self.veab_ring = SampleRing(VEAB_RING_SECONDS * veabRate, len(self.sensors))
+        self.veabStream = multiprocessing.Value(c_bool, False)
+        self.veab_cursor = 0  # Samples already streamed (send only)
+        self.clock_frame_due = 0.0  # Monotonic time of the next telemetry clock frame (send only)
         self.nActuators = len(self.actuators)  # Count total number of actuators
         self.actuatorsValues = multiprocessing.Array('d', [0.5] * self.nActuators)  # Initialize actuators to a default value
+        self.dac_buses = build_dac_buses(self.boards, deadband=dacDeadband)  # Change-only, per-bus burst writes
+        # Setpoint waveforms synthesized by controlActuators at the actuator rate ('G' and 'L' commands)
+        # and closed-loop pressure control ('K' command), both owned by the controlActuators loop
+        self.waveforms = WaveformBank(self.nActuators)
+        self.pressure_control = PressureControl(self.nActuators)
+        self.control_queue = multiprocessing.Queue()
+        if controlFeedback not in ("adc", "arduino"):
+            raise ValueError(f"Unknown control feedback: {controlFeedback}")
+        self.control_feedback = controlFeedback  # "adc": read the VEAB ADS1015 directly, "arduino": VEAB value of the samples
+
+        # Per-bus workers (multiprocess runtime only): controlActuators then only computes the
+        # setpoints, half a tick ahead, and publishes them in shared memory. Every I2C bus gets its
+        # own process that closes the loop of its actuators and writes its DACs, so the tick no
+        # longer grows with the number of boards. All loops share one tick grid, so the outputs
+        # of every board still update in phase.
+        self.bus_workers = busWorkers
+        self.setpoint_store = ValueStore(self.nActuators)
+        self.setpoint_store.write(*self.actuatorsValues[:])
+        self.bus_queues = [multiprocessing.Queue() for _ in self.dac_buses] if busWorkers else []  # 'K' commands
+
+        # Latency of every stage of the actuator tick, per loop that writes DACs
+        stages = ["setpoints", "feedback", "control"]
+        period_ns = round(1e9 / actuatorFreq)
+        self.control_budget = TickBudget("controlActuators latency",
+                                         stages + [f"dac {bus.stats.name}" for bus in self.dac_buses], period_ns)
+        self.bus_budgets = [TickBudget(f"{bus.stats.name} worker latency", stages + ["dac"], period_ns)
+                            for bus in self.dac_buses] if busWorkers else []
+        # Latest controller state for the telemetry, one store per loop that runs controllers: time,
+        # then per actuator enabled, setpoint, measurement, error, effort and integral
+        self.control_stores = [ValueStore(1 + 6 * self.nActuators) for _ in (self.dac_buses if busWorkers else [None])]
+        self.control_sequences_sent = [0] * len(self.control_stores)
         
         # Set up TCP server for communication
         self.buffersize = 8 * self.nActuators  # Buffer size based on number of actuators
@@ -77,255 +150,924 @@ class SoftRobot:
         self.socket_TCP.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server_address = ('', self.port)  # Bind to the provided port
         self.socket_TCP.bind(server_address)
-        self.clients = []  # List of connected clients
+        self.socket_TCP.listen(1)  # Clients connecting before receive runs wait in the backlog
+        self.clients = []  # Client accepted by waitForClient before the processes start (optional)
         self.clients_addresses = []  # List of client addresses
+        # receive accepts the control clients for as long as the server runs and hands each one to
+        # send through this pipe (a Unix socket pair, so the socket itself can be passed along)
+        self.client_handoff, self.client_adopt = multiprocessing.Pipe()
+        self.exit_on_disconnect = exitOnDisconnect  # Stop the robot when the client leaves instead of waiting for the next one
+        self.telemetryMode = multiprocessing.Value('c', TELEMETRY_TEXT)  # Selected by the client with b'M' + mode
+        self.telemetryRate = multiprocessing.Value('d', 0.0)  # b'R' + rate: aggregates per second, 0 for every sample
+        self.telemetry_port = telemetryPort if telemetryPort is not None else port + 1  # Extra telemetry subscribers
 
         # Arduino Communication
         self.arduino_port = arduino_port
         self.arduino_baud = 115200
-        self.arduino_queue = multiprocessing.Queue()  # Queue for Arduino sensor data
+        self.serial_mux = SerialMux(self.arduino_port, self.arduino_baud, self.backend.open_serial,
+                                    protocol=arduinoProtocol)  # Only read_arduino opens the port (see startSerialOwner)
         self.processes = []
 
-        # Shared dictionary for latest data
-        self.manager = Manager()
-        self.latest_data = self.manager.dict({
-            "timestamp": 0.0,
-            "veab_sensor": 0.0,
-            "mpr_sensors": [0.0] * 8
-        })
+        # Timed valve sequences: uploads go from receive to playSequences, which reports the
+        # actual execution time of every frame back through send. A manual valve command bumps
+        # the stop generation under its lock, which playSequences takes to apply each frame, so
+        # no frame of an older generation can be applied after the command (the queue is too slow)
+        self.sequence_queue = multiprocessing.Queue()
+        self.sequence_generation = multiprocessing.Value('L', 0)
+        self.sequence_reports = multiprocessing.Queue()
+
+        # Latency probes: receive (or read_arduino, for probes passed through the Arduino) queues
+        # the stage times of every probe, send echoes them to the control client
+        self.ping_replies = multiprocessing.Queue()
+
+        # On-device recording of samples, valve commands and DAC setpoints (disabled when recordDir is None).
+        # Every process opens its own recorders before its loop starts (openRecorders) and records to
+        # streams no other process writes (e.g. "valves" from receive, "valves-sequence" from
+        # playSequences), so each stream has a single writer.
+        self.record_dir = recordDir
+        self.recorders = {}
+
+        # CPU affinity, SCHED_FIFO/nice and mlockall per loop (see realtime.py), applied by every process
+        # to itself; the reports of what took effect come back through schedule_reports
+        self.schedule = schedule or {}
+        self.lock_memory = lockMemory
+        self.schedule_reports = multiprocessing.Queue()
+        self.schedule_applied = []
+
+        # Jitter/overrun statistics of the periodic loops, readable from any process
+        self.loop_stats = {
+            "controlActuators": LoopStats("controlActuators"),
+            "send": LoopStats("send"),
+            "acquireVeab": LoopStats("acquireVeab"),
+        }
+        for bus in self.dac_buses if busWorkers else []:
+            self.loop_stats[f"{bus.stats.name} worker"] = LoopStats(f"{bus.stats.name} worker")
+
+        # Lock-free shared memory store for the latest sample (written by read_arduino only), with
+        # its capture time on the Pi's monotonic clock and the state of the Arduino clock mapping:
+        # how much faster the Arduino's clock runs (ppm), the error of the mapped times and the points
+        self.sample_store = SampleStore()
+        self.clock_store = ValueStore(3)
+        # Every sample as well (capture time, VEAB, MPR1-8, time error), so the windowed aggregates
+        # send computes cover the samples between two of its ticks, peaks included
+        self.sample_ring = SampleRing(SAMPLE_RING_SIZE, 10)
+        self.sample_cursor = 0  # Samples already aggregated (send only)
 
 
         # GPIO setup with digitalio
         self.solenoid_pins = [17, 27, 22, 23]  # GPIO 17, 27, 22, 23
         
-        GPIO.setmode(GPIO.BCM)
+        self.gpio = self.backend.gpio
+        self.gpio.setmode(self.gpio.BCM)
         for pin in self.solenoid_pins:
-            GPIO.setup(pin, GPIO.OUT)
-            GPIO.output(pin, GPIO.LOW)
+            self.gpio.setup(pin, self.gpio.OUT)
+            self.gpio.output(pin, self.gpio.LOW)
+        self.startup.since_last("server setup")
+
 
 
 
+    def initBoards(self, veabRate):
+        """Initialize the control boards, one thread per I2C bus so that their transactions overlap."""
+        def init(channel):
+            return VEABcontrolboard(channel, backend=self.backend, veabRate=veabRate)
+        if len(self.channels) < 2:
+            return [init(channel) for channel in self.channels]
+        with ThreadPoolExecutor(max_workers=len(self.channels)) as executor:
+            return list(executor.map(init, self.channels))
 
     def waitForClient(self):
-        """Wait for a client to connect to the TCP server."""
-        self.socket_TCP.listen(1)
+        """Wait for a client to connect to the TCP server before the loops start (receive accepts the next ones)."""
         print("TCP server is running. Waiting for client...")
         client, client_address = self.socket_TCP.accept()  # Accept the client connection
         print("Client ", client_address, " connected. Comm's ready!")
-        client.settimeout(0.5)
+        self.configureClient(client)
         self.clients.append(client)
         self.clients_addresses.append(client_address)
 
+    def configureClient(self, client):
+        """Socket options of a control client: receive timeout, no Nagle delay and TCP keepalive."""
+        client.settimeout(0.5)
+        # Telemetry frames and echoes are small: send them at once instead of waiting for an ACK
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                              ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+            if hasattr(socket, option):  # Linux only
+                client.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
 
     def receive(self):
-        """Receive actuator values from clients via TCP and handle open-loop control."""
+        """
+        Serve the control clients: receive their commands and actuator values for as long as the robot runs.
+
+        One client is served at a time. When it closes the connection (or TCP keepalive finds it
+        gone) the outputs go to their safe state and the next client is accepted on the same
+        listening socket, while the boards, the serial link and every loop keep running. A client
+        connecting while another one is served takes over, so a restarted GUI never waits for the
+        previous connection to time out.
+        """
+        self.openRecorders("valves")
+        client = self.clients[0] if self.clients else None  # Already subscribed by send (waitForClient)
+        address = self.clients_addresses[0] if self.clients else None
+        parser = CommandParser(self.commandSizes())
         while not self.stopFlag.value:
             try:
-                # Receive 1 byte to check the data type
-                data_type = self.clients[0].recv(1)
-
-                if data_type == b'C':  # It's a command
-                    try:
-                        binary_string = self.clients[0].recv(16).decode('utf-8').strip()
-                        print(f"Received binary string: {binary_string}")
-
-                        # Ensure the binary string is valid
-                        if len(binary_string) != 16 or not all(c in '01' for c in binary_string):
-                            print(f"Invalid binary string received: {binary_string}")
-                            continue
-
-                        # Split the binary string
-                        arduino_binary = binary_string[:12]  # First 12 bits for Arduino
-                        gpio_binary = binary_string[12:]     # Last 4 bits for Pi GPIO
-
-                        # Send the first 12 bits to the Arduino
-                        self.send_to_arduino(arduino_binary)
-
-                        # Update GPIO states for the last 4 bits
-                        for i, state in enumerate(gpio_binary):
-                            pin_state = GPIO.HIGH if state == '1' else GPIO.LOW
-                            GPIO.output(self.solenoid_pins[i], pin_state)
-                            print(f"Set GPIO pin {self.solenoid_pins[i]} to {'HIGH' if state == '1' else 'LOW'}")
-
-                    except UnicodeDecodeError as e:
-                        print(f"Decoding error: {e}")
-                        continue
-                
-                elif data_type == b'W':  # It's an actuator (wave) value
-                    raw = self.clients[0].recv(self.buffersize)  # Receive the actuator data
-                    unpackedData = struct.unpack('d' * int(self.buffersize / 8), raw)
-                    # Store the received actuator values
-                    for i in range(int(self.buffersize / 8)):
-                        self.actuatorsValues[i] = unpackedData[i]
+                watched = [self.socket_TCP] if client is None else [self.socket_TCP, client]
+                readable, _, _ = select.select(watched, [], [], 0.5)
+                if self.socket_TCP in readable:
+                    new_client, new_address = self.socket_TCP.accept()
+                    if client is not None:
+                        self.releaseClient(client, address, "replaced by a new client")
+                    client, address = new_client, new_address
+                    self.configureClient(client)
+                    self.handOffClient(client, address)
+                    parser = CommandParser(self.commandSizes())  # No partial message from the previous client
+                    print(f"[INFO] Client {address} connected. Comm's ready!")
+                    continue
+                if client is None or client not in readable:
+                    continue
+
+                data = client.recv(4096)
+                if not data:
+                    client = self.releaseClient(client, address, "closed the connection")
+                    continue
+
+                for data_type, payload in parser.feed(data):
+                    self.handleCommand(data_type, payload)
+                if parser.error is not None:
+                    client = self.releaseClient(client, address, f"sent an {parser.error}")
 
             except socket.timeout:
                 continue
+            except OSError as e:  # Connection reset, keepalive timeout
+                if client is None:
+                    print('Error in receive:', e)
+                    self.stopFlag.value = True
+                    continue
+                client = self.releaseClient(client, address, f"lost ({e})")
             except Exception as e:
                 print('Error in receive:', e)
                 self.stopFlag.value = True  # Stop on failure
 
+        if client is not None:
+            client.close()
+        self.closeRecorders()
         self.socket_TCP.close()
 
+    def endSession(self, client, address, reason):
+        """
+        Close the connection of a control client and put the outputs in their safe state.
 
-
-    def send_to_arduino(self, binary_string):
-        """Send a 12-bit binary string to the Arduino."""
+        Returns:
+            None, the client served from now on.
+        """
+        print(f"[INFO] Client {address} {reason}.")
         try:
-            if not hasattr(self, 'ser') or self.ser is None or not self.ser.is_open:
-                self.ser = serial.Serial(self.arduino_port, self.arduino_baud, timeout=1)
-                time.sleep(2)  # Allow time for the Arduino to reset after reconnecting
+            client.shutdown(socket.SHUT_RDWR)  # Also closes the copy send writes the telemetry to
+        except OSError:
+            pass
+        client.close()
+        self.enterSafeState()
+        if self.exit_on_disconnect:
+            print("[INFO] Stopping: the server exits when its client disconnects.")
+            self.stopFlag.value = True
+        else:
+            print("[INFO] Waiting for the next client...")
+        return None
+
+    def enterSafeState(self):
+        """Stop everything the client started and bring the outputs and the telemetry settings back to their startup state."""
+        self.control_queue.put(("waveform", ALL_ACTUATORS, WaveformParameters(WAVE_OFF, 0.0, 0.0, 0.0, 0.0), True))
+        self.control_queue.put(("gains", ALL_ACTUATORS, False, 0.0, 0.0, 0.0, 1.0))
+        for i in range(self.nActuators):
+            self.actuatorsValues[i] = SAFE_ACTUATOR_VALUE
+        self.overrideValves(SAFE_VALVES)  # Synchronous stop: no sequence frame can reopen a valve after this
+        self.telemetryMode.value = TELEMETRY_TEXT
+        self.telemetryRate.value = 0.0
+        self.veabStream.value = False
+        print("[INFO] Safe state: valves closed, waveforms, sequences and pressure control stopped, "
+              f"actuators at {SAFE_ACTUATOR_VALUE}")
+
+    def releaseClient(self, client, address, reason):
+        """End the session of the client served by receive and tell send to drop its copy of the socket."""
+        self.client_handoff.send(("detach", address))
+        return self.endSession(client, address, reason)
+
+    def handOffClient(self, client, address):
+        """Pass a newly accepted control client to send, which subscribes it to the telemetry (see adoptClients)."""
+        self.client_handoff.send(("attach", address))
+        reduction.send_handle(self.client_handoff, client.fileno(), None)
+
+    def commandSizes(self):
+        """Payload size of every message type the client can send."""
+        return {
+            b'C': 16,               # 16-bit valve state as '0'/'1' characters
+            b'G': WAVEFORM_STRUCT.size,  # Waveform parameters
+            b'K': CONTROL_GAINS_STRUCT.size,  # Closed-loop controller gains
+            b'L': table_payload_size,  # Waveform sample table, sized by its header
+            b'M': 1,                # Telemetry mode
+            b'P': PING_STRUCT.size,  # Latency probe
+            b'R': RATE_STRUCT.size,  # Telemetry output rate (float32 Hz)
+            b'S': sequence_payload_size,  # Timed valve sequence, sized by its header
+            b'V': 1,                # VEAB stream on/off
+            b'W': self.buffersize,  # One double per actuator
+        }
+
+    def handleCommand(self, data_type, payload):
+        """Apply one message received from the client."""
+        if data_type == b'C':  # It's a command
+            try:
+                binary_string = payload.decode('utf-8').strip()
+                print(f"Received binary string: {binary_string}")
 
-            # Send the binary string directly
-            self.ser.write(f"{binary_string}\n".encode('utf-8'))
-            print(f"Sent to Arduino: {binary_string}")
+                # Ensure the binary string is valid
+                if len(binary_string) != 16 or not all(c in '01' for c in binary_string):
+                    print(f"Invalid binary string received: {binary_string}")
+                    return
 
-        except (serial.SerialException, serial.SerialTimeoutException) as e:
-            print(f"[ERROR] Arduino communication error: {e}")
-            self.ser = None  # Close the connection to trigger a reconnect next time
+                self.overrideValves(binary_string, verbose=True)  # Stops any sequence being played
 
+            except UnicodeDecodeError as e:
+                print(f"Decoding error: {e}")
 
+        elif data_type == b'S':  # Timed valve sequence
+            sequence_id, frames = unpack_sequence(payload)
+            self.sequence_queue.put((self.sequence_generation.value, sequence_id, frames))
+            duration = frames[-1][0] if frames else 0
+            print(f"Received valve sequence {sequence_id}: {len(frames)} frames over {duration} ms")
+
+        elif data_type == b'M':  # Telemetry mode selection
+            if payload in TELEMETRY_MODES:
+                self.telemetryMode.value = payload
+                print(f"Telemetry mode set to {'binary' if payload == TELEMETRY_BINARY else 'text'}")
+            else:
+                print(f"Invalid telemetry mode received: {payload}")
+
+        elif data_type == b'R':  # Telemetry output rate
+            rate = max(0.0, RATE_STRUCT.unpack(payload)[0])
+            self.telemetryRate.value = rate
+            print(f"Telemetry rate set to {f'{rate:g} Hz aggregates' if rate else 'every sample'}")
+
+        elif data_type == b'G':  # Waveform parameters
+            try:
+                actuator, parameters, immediate = unpack_waveform(payload)
+            except ValueError as e:
+                print(f"Invalid waveform received: {e}")
+                return
+            self.control_queue.put(("waveform", actuator, parameters, immediate))
+            if parameters.shape == WAVE_OFF:
+                print(f"Waveform stopped on actuator {actuator}")
+            else:
+                print(f"Waveform set on actuator {actuator}: {parameters}")
+
+        elif data_type == b'K':  # Closed-loop controller gains
+            command = unpack_gains(payload)
+            self.control_queue.put(command)
+            _, actuator, enabled, kp, ki, kd, kf = command
+            print(f"Pressure control on actuator {actuator} {'enabled' if enabled else 'disabled'}: "
+                  f"kp={kp:g}, ki={ki:g}, kd={kd:g}, kf={kf:g}")
+
+        elif data_type == b'L':  # Waveform sample table
+            try:
+                actuator, rate, samples = unpack_table(payload)
+            except ValueError as e:
+                print(f"Invalid waveform table received: {e}")
+                return
+            self.control_queue.put(("table", actuator, rate, samples))
+            print(f"Waveform table received for actuator {actuator}: {len(samples)} samples at {rate:g} Hz")
 
+        elif data_type == b'P':  # Latency probe
+            received_ns = time.monotonic_ns()
+            probe_id, flags = PING_STRUCT.unpack(payload)
+            if flags & PING_ARDUINO:
+                self.serial_mux.send_ping(probe_id, received_ns)  # Echoed once the Arduino answers
+            else:
+                self.ping_replies.put((probe_id, flags, received_ns, 0, 0))
 
-    def controlActuators(self):
-        """Control actuators periodically based on the received values."""
+        elif data_type == b'V':  # High-rate VEAB stream on/off
+            self.veabStream.value = payload != b'\x00'
+            print(f"VEAB stream {'enabled' if self.veabStream.value else 'disabled'} ({self.veab_rate} SPS)")
+
+        elif data_type == b'W':  # It's an actuator (wave) value
+            unpackedData = struct.unpack('d' * self.nActuators, payload)
+            # Store the received actuator values
+            for i in range(self.nActuators):
+                self.actuatorsValues[i] = unpackedData[i]
+
+
+
+    def overrideValves(self, binary_string, verbose=False):
+        """
+        Stop the valve sequence being played and apply binary_string.
+
+        The stop generation is bumped and the valves applied under the lock playDueFrames holds
+        to apply a frame, so no frame already due can overwrite binary_string.
+        """
+        with self.sequence_generation.get_lock():
+            self.sequence_generation.value += 1
+            self.applyValves(binary_string, verbose=verbose)
+        self.sequence_queue.put(None)  # Wake playSequences up to drop the stopped sequence
+
+    def applyValves(self, binary_string, verbose=False, stream="valves"):
+        """
+        Send the first 12 valve bits to the Arduino and drive the last 4 from the Pi GPIO.
+
+        Args:
+            binary_string (str): 16 '0'/'1' characters, valve 1 first.
+            verbose (bool): Print the command sent to the Arduino.
+            stream (str): Recording stream of the valve command, one per calling process.
+        """
+        # Split the binary string
+        arduino_binary = binary_string[:12]  # First 12 bits for Arduino
+        gpio_binary = binary_string[12:]     # Last 4 bits for Pi GPIO
+
+        # Send the first 12 bits to the Arduino
+        if verbose:
+            self.send_to_arduino(arduino_binary)
+        else:
+            self.serial_mux.send_command(arduino_binary)
+        self.record(stream, RECORD_VALVE, int(arduino_binary, 2), int(gpio_binary, 2), int(binary_string, 2))
+
+        # Update GPIO states for the last 4 bits
+        for i, state in enumerate(gpio_binary):
+            pin_state = self.gpio.HIGH if state == '1' else self.gpio.LOW
+            self.gpio.output(self.solenoid_pins[i], pin_state)
+            if verbose:
+                print(f"Set GPIO pin {self.solenoid_pins[i]} to {'HIGH' if state == '1' else 'LOW'}")
+
+    def send_to_arduino(self, binary_string):
+        """Queue a 12-bit binary string for the serial owner process to write to the Arduino."""
+        self.serial_mux.send_command(binary_string)
+        print(f"Sent to Arduino: {binary_string}")
+
+
+
+
+    def controlActuators(self, anchor_ns=None):
+        """
+        Control actuators periodically based on the received values.
+
+        Args:
+            anchor_ns (int): Start of the common tick grid shared with the bus workers
+                (busWorkers only), now by default.
+        """
+        if not self.bus_workers:
+            self.openRecorders("dac")  # Written by updateActuators
+        scheduler = PeriodicScheduler(self.actuator_frequency, policy=SKIP, stats=self.loop_stats["controlActuators"])
+        lead_ns = scheduler.period_ns // 2 if self.bus_workers else 0  # Setpoints are ready before the workers tick
+        if anchor_ns is None:
+            scheduler.start()
+        else:
+            scheduler.start(anchor_ns - lead_ns - scheduler.period_ns)
+            scheduler.wait()  # First tick on the common grid
         while not self.stopFlag.value:
             try:
-                # Update the actuators with the current actuator values
-                for i, p in enumerate(range(self.nActuators)):
-                    self.actuators[p].normalized_value = max(0, min(1, self.actuatorsValues[i]))
-                time.sleep(self.actuator_period - time.time() * self.actuator_frequency % 1 / self.actuator_frequency)
+                if self.bus_workers:
+                    self.updateSetpoints(scheduler.next_deadline + lead_ns)
+                else:
+                    self.updateActuators(scheduler.next_deadline)
+                scheduler.wait()  # Sleep until the next absolute deadline
             except Exception as e:
                 print('Error in control Actuators:', e)
                 self.stopFlag.value = True  # Stop on failure
-        self.resetActuators()  # Reset actuators to default when stopping
+        if not self.bus_workers:
+            self.resetActuators()  # Reset actuators to default when stopping (the bus workers reset their own bus)
+        self.closeRecorders()
+
+    def nextSetpoints(self, now_ns):
+        """Setpoints of the tick at now_ns: the 'W' values, or the generated ones while a waveform runs."""
+        values = self.actuatorsValues[:]
+        self.pollControlCommands()
+        if self.waveforms.active:
+            self.waveforms.apply(values, now_ns)
+        return values
+
+    def updateActuators(self, now_ns=None):
+        """
+        Update the actuators whose values changed, one I2C burst per bus.
+
+        Args:
+            now_ns (int): Scheduled (monotonic) time of this tick, now by default.
+        """
+        start_ns = time.monotonic_ns()
+        if now_ns is None:
+            now_ns = start_ns
+        values = self.nextSetpoints(now_ns)
+        self.driveBuses(self.dac_buses, values, self.pressure_control, now_ns, start_ns,
+                        self.control_budget, self.control_stores[0], "dac")
+
+    def updateSetpoints(self, target_ns):
+        """Publish the setpoints the bus workers write at target_ns (busWorkers only)."""
+        self.setpoint_store.write(*self.nextSetpoints(target_ns))
+
+    def controlBus(self, index, anchor_ns):
+        """
+        Bus worker: close the loop of the actuators on one I2C bus and write its DACs on the common tick.
+
+        Args:
+            index (int): Index of the bus in dac_buses.
+            anchor_ns (int): Start of the common tick grid.
+        """
+        bus = self.dac_buses[index]
+        self.openRecorders(f"dac-{bus.stats.name}")
+        pressure_control = PressureControl(self.nActuators, [actuator for actuator, _ in bus.channels])
+        scheduler = PeriodicScheduler(self.actuator_frequency, policy=SKIP,
+                                      stats=self.loop_stats[f"{bus.stats.name} worker"])
+        scheduler.start(anchor_ns - scheduler.period_ns)
+        scheduler.wait()  # First tick on the common grid
+        while not self.stopFlag.value:
+            try:
+                self.updateBus(index, pressure_control, scheduler.next_deadline)
+                scheduler.wait()
+            except Exception as e:
+                print(f"[ERROR] Error in {bus.stats.name} worker: {e}")
+                self.stopFlag.value = True
+        bus.write([0.5] * self.nActuators, force=True)
+        self.closeRecorders()
+
+    def updateBus(self, index, pressure_control, now_ns):
+        """One tick of a bus worker: latest setpoints from shared memory, closed loop, DAC writes."""
+        start_ns = time.monotonic_ns()
+        while True:
+            try:
+                pressure_control.handle(self.bus_queues[index].get_nowait())
+            except queue.Empty:
+                break
+            except ValueError as e:
+                print(f"[ERROR] Invalid control command: {e}")
+        _, values = self.setpoint_store.read()
+        bus = self.dac_buses[index]
+        self.driveBuses([bus], list(values), pressure_control, now_ns, start_ns,
+                        self.bus_budgets[index], self.control_stores[index], f"dac-{bus.stats.name}")
+
+    def driveBuses(self, buses, values, pressure_control, now_ns, start_ns, budget, control_store, stream):
+        """
+        Close the pressure loop and write the DACs of `buses` for one tick.
+
+        Args:
+            buses (list of DacBus): Buses written by the calling loop.
+            values (list): Setpoints of every actuator, replaced by the controller effort
+                where the loop is closed.
+            pressure_control (PressureControl): Controllers owned by the calling loop.
+            now_ns (int): Scheduled (monotonic) time of this tick.
+            start_ns (int): When the tick started, for the latency budget.
+            budget (TickBudget): Where to record the stage latencies.
+            control_store (ValueStore): Where to publish the controller state.
+            stream (str): Recording stream of the DAC setpoints.
+        """
+        setpoints_ns = feedback_ns = control_ns = time.monotonic_ns()
+
+        # Closed loop: the setpoints become pressure targets and the controller effort goes to the DACs
+        if pressure_control.active:
+            measurements = self.readFeedback(pressure_control.actuators)
+            feedback_ns = time.monotonic_ns()
+            rows = pressure_control.update(values, measurements, now_ns)
+            self.storeControlState(rows, control_store)
+            control_ns = time.monotonic_ns()
+
+        stages = [setpoints_ns - start_ns, feedback_ns - setpoints_ns, control_ns - feedback_ns]
+        writes = 0
+        written_ns = control_ns
+        for bus in buses:
+            writes += bus.write(values)
+            done_ns = time.monotonic_ns()
+            stages.append(done_ns - written_ns)
+            written_ns = done_ns
+        if writes:
+            self.record(stream, RECORD_DAC, *values)
+        budget.record(stages, written_ns - now_ns)
+
+    def readFeedback(self, actuators):
+        """Measured normalized pressure of `actuators` (0 for the other ones)."""
+        if self.control_feedback == "arduino":
+            _, timestamp, veab_sensor, mpr_sensors, _ = self.sample_store.read()
+            self.applyVeabData((timestamp, veab_sensor, mpr_sensors))
+            return [veab_sensor / VEAB_FULL_SCALE] * self.nActuators
+        measurements = [0.0] * self.nActuators
+        latest = self.veab_ring.latest()  # Newest conversion of acquireVeab, without touching the bus
+        for i in actuators:
+            voltage = latest[1][i] if latest is not None else self.sensors[i].readSensor()
+            measurements[i] = voltage / VEAB_FULL_SCALE
+        return measurements
+
+    def storeControlState(self, rows, control_store):
+        """Publish the controller state of this tick for the telemetry."""
+        state = [0.0] * (6 * self.nActuators)
+        for actuator, *row in rows:
+            state[6 * actuator:6 * actuator + 6] = [1.0] + row
+        control_store.write(time.monotonic(), *state)
+
+    def pollControlCommands(self):
+        """Apply the waveform and controller commands received since the previous tick."""
+        while True:
+            try:
+                command = self.control_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if command[0] == "gains" and self.bus_workers:
+                    for bus_queue in self.bus_queues:  # The controllers run in the bus workers
+                        bus_queue.put(command)
+                elif command[0] == "gains":
+                    self.pressure_control.handle(command)
+                else:
+                    self.waveforms.handle(command)
+            except ValueError as e:
+                print(f"[ERROR] Invalid control command: {e}")
 
     def resetActuators(self):
         """Reset all actuators to a default value."""
-        for i in range(self.nActuators):
-            self.actuators[i].normalized_value = 0.5
+        for bus in self.dac_buses:
+            bus.write([0.5] * self.nActuators, force=True)
             
-    # ------------------------- sensors -------------------------------------------
-    def read_arduino(self):
-        """Read data from Arduino and update the latest_data dictionary, with reconnection logic."""
+    # ------------------------- valve sequences -----------------------------------
+    def playSequences(self):
+        """Play uploaded valve sequences on the Pi's own clock and report when each frame was applied."""
+        self.openRecorders("valves-sequence")
+        player = SequencePlayer()
         while not self.stopFlag.value:
             try:
-                if not hasattr(self, 'ser') or self.ser is None or not self.ser.is_open:
-                    print(f"[INFO] Attempting to reconnect to Arduino on {self.arduino_port}")
-                    self.ser = serial.Serial(self.arduino_port, self.arduino_baud, timeout=1)
-                    time.sleep(2)  # Allow time for the Arduino to reset
-                    print(f"[INFO] Reconnected to Arduino on {self.arduino_port}")
-
-                if self.ser.in_waiting > 0:
-                    data = self.ser.readline().decode('utf-8').strip()
-                    if "Calibration complete" in data:
-                        print("[INFO] Arduino calibration complete.")
-                    elif data.count(',') == 9:  # Expecting 10 values: timestamp + VEAB + 8 sensor readings
-                        sensor_data = data.split(",")
-                        if len(sensor_data) == 10:
-                            try:
-                                # Parse sensor data
-                                timestamp = float(sensor_data[0]) * 0.001  # Convert ms to seconds
-                                veab_sensor = float(sensor_data[1])
-                                mpr1 = float(sensor_data[2])
-                                mpr2 = float(sensor_data[3])
-                                mpr3 = float(sensor_data[4])
-                                mpr4 = float(sensor_data[5])
-                                mpr5 = float(sensor_data[6])
-                                mpr6 = float(sensor_data[7])
-                                mpr7 = float(sensor_data[8])
-                                mpr8 = float(sensor_data[9])
-
-                                # Update the shared dictionary
-                                self.latest_data["timestamp"] = timestamp
-                                self.latest_data["veab_sensor"] = veab_sensor
-                                self.latest_data["mpr_sensors"] = [mpr1, mpr2, mpr3, mpr4, mpr5, mpr6, mpr7, mpr8]
-
-                            except ValueError:
-                                print("[ERROR] Failed to parse Arduino data:", data)
-
-            except (serial.SerialException, serial.SerialTimeoutException) as e:
-                print(f"[ERROR] Arduino communication error: {e}")
-                self.ser = None  # Reset the connection to trigger a reconnect next time
-
+                # Sleep until the next frame, waking up early for a new upload or a stop
+                deadline = player.next_deadline()
+                timeout = 0.1 if deadline is None else max(0.0, (deadline - time.monotonic_ns()) / 1e9)
+                try:
+                    self.loadSequence(player, self.sequence_queue.get(timeout=timeout))
+                    continue
+                except queue.Empty:
+                    pass
+                self.playDueFrames(player)
             except Exception as e:
-                print(f"[ERROR] Unexpected error in read_arduino: {e}")
-                self.ser = None  # Reset the connection to trigger a reconnect
+                print(f"[ERROR] Error in sequence playback: {e}")
+        self.closeRecorders()
+
+    def loadSequence(self, player, upload):
+        """Start an uploaded (stop generation, sequence id, frames) sequence, or wake up for a stop when upload is None."""
+        if upload is None:
+            self.stopStaleSequence(player)
+            return
+        generation, sequence_id, frames = upload
+        if generation != self.sequence_generation.value:
+            print(f"[INFO] Valve sequence {sequence_id} not played, stopped by a later valve command")
+            return
+        if player.playing:
+            print(f"[INFO] Valve sequence {player.sequence_id} replaced by sequence {sequence_id}")
+        player.load(sequence_id, frames, generation=generation)
+
+    def stopStaleSequence(self, player, taken=0):
+        """
+        Drop the sequence being played if a valve command stopped it (see overrideValves).
+
+        Args:
+            player (SequencePlayer): Player of the sequence.
+            taken (int): Frames already taken from the player but not applied.
+
+        Returns:
+            bool: True if the sequence was stopped.
+        """
+        if player.generation == self.sequence_generation.value:
+            return False
+        dropped = taken + player.stop()
+        player.generation = self.sequence_generation.value
+        if dropped:
+            print(f"[INFO] Valve sequence {player.sequence_id} stopped, {dropped} frames not played")
+        return True
 
+    def playDueFrames(self, player):
+        """Apply every frame whose deadline has passed and queue its execution report."""
+        due = player.take_due(time.monotonic_ns())
+        for n, (index, offset_ms, mask) in enumerate(due):
+            with self.sequence_generation.get_lock():
+                if self.stopStaleSequence(player, len(due) - n):
+                    return
+                self.applyValves(format(mask, '016b'), stream="valves-sequence")  # Not receive's "valves"
+            executed_ns = time.monotonic_ns()
+            self.sequence_reports.put((player.sequence_id, index, mask, offset_ms / 1000,
+                                       (executed_ns - player.start_ns) / 1e9, executed_ns / 1e9))
 
-    def update_veab_sensor(self):
-        """Update VEAB sensor values from the Arduino data."""
+    def publishReports(self, hub, epoch):
+        """Send the pending frame reports to every subscriber, timestamped like the telemetry."""
+        try:
+            while True:
+                sequence_id, index, mask, scheduled, actual, executed_at = self.sequence_reports.get_nowait()
+                hub.publish_report(sequence_id, index, mask, scheduled, actual, executed_at - epoch)
+        except queue.Empty:
+            pass
+
+    # ------------------------- sensors -------------------------------------------
+    def acquireVeab(self):
+        """Read every VEAB ADC at its data rate into the shared ring buffer."""
+        # The ADS1015 converts continuously at veab_rate, reading once per conversion period
+        # gets every conversion without re-triggering it (the ALERT/RDY pin is not wired)
+        scheduler = PeriodicScheduler(self.veab_rate, policy=SKIP, stats=self.loop_stats["acquireVeab"])
+        scheduler.start()
         while not self.stopFlag.value:
             try:
-                if not self.arduino_queue.empty():
-                    data = self.arduino_queue.get()
-                    _, veab_sensor, *_ = data  # Now expecting 8 sensor values
-                    # Update the VEAB sensor adjusted voltage
-                    for board in self.boards:
-                        board.sensors[0].setAdjustedVoltage(veab_sensor / 5)
+                self.sampleVeab()
+                scheduler.wait()
             except Exception as e:
-                print("[ERROR] Updating VEAB sensor failed:", e)
+                print(f"[ERROR] Error in VEAB acquisition: {e}")
+                self.stopFlag.value = True
+
+    def sampleVeab(self):
+        """Read the latest conversion of every VEAB ADC into the ring buffer."""
+        voltages = [sensor.readSensor() for sensor in self.sensors]
+        self.veab_ring.write(time.monotonic_ns(), *voltages)
+
+    def read_arduino(self):
+        """Own the Arduino serial port: write queued valve commands and publish parsed sensor data."""
+        self.openRecorders("samples")
+        self.serial_mux.run(self.stopFlag, self.publishSamples, self.handleArduinoMessage, on_ping=self.handlePingReply)
+        self.closeRecorders()
+
+    def publishSamples(self, samples):
+        """
+        Record every sample of a parsed batch and add it to the shared sample ring, then publish the
+        newest one to the shared sample store, each with its capture time on the Pi's clock.
+        """
+        clock = self.serial_mux.clock
+        for timestamp, veab_sensor, mpr_sensors in samples:
+            self.sample_ring.write(round(clock.to_monotonic(timestamp) * 1e9), veab_sensor, *mpr_sensors[:8], clock.error)
+            if self.record_dir:
+                self.record("samples", RECORD_SAMPLE, timestamp, veab_sensor, *mpr_sensors)
+        timestamp, veab_sensor, mpr_sensors = samples[-1]
+        self.sample_store.write(clock.to_monotonic(timestamp), veab_sensor, mpr_sensors, clock.error)
+        self.clock_store.write(clock.drift_ppm, clock.error, len(clock.points))
+
+    def openRecorders(self, *streams):
+        """Open the recordings the calling process writes, before its loop starts (if recording is enabled)."""
+        if not self.record_dir:
+            return
+        for stream in streams:
+            if stream not in self.recorders:
+                self.recorders[stream] = Recorder(os.path.join(self.record_dir, stream))
+
+    def record(self, stream, record_type, *values):
+        """Append a record to one of the on-device recordings, if recording is enabled."""
+        if not self.record_dir:
+            return
+        recorder = self.recorders.get(stream)
+        if recorder is None:  # Not opened by openRecorders: opened here, in the loop
+            self.openRecorders(stream)
+            recorder = self.recorders[stream]
+        recorder.record(record_type, *values)
+
+    def closeRecorders(self):
+        """Flush and close the recordings opened by this process."""
+        for recorder in self.recorders.values():
+            recorder.close()
+        self.recorders.clear()
+
+    def handleArduinoMessage(self, message):
+        """Handle a status line printed by the Arduino firmware."""
+        if "Calibration complete" in message:
+            print("[INFO] Arduino calibration complete.")
+
+
+    def handlePingReply(self, probe_id, received_ns, written_ns, acked_ns):
+        """Queue the echo of a latency probe that went through the Arduino."""
+        flags = PING_ARDUINO | (ECHO_ACKED if acked_ns else 0)
+        self.ping_replies.put((probe_id, flags, received_ns, written_ns, acked_ns))
+
+
+    def applyVeabData(self, data):
+        """Store the VEAB reading of one Arduino sample in the VEAB sensors."""
+        _, veab_sensor, *_ = data  # Now expecting 8 sensor values
+        # Update the VEAB sensor adjusted voltage
+        for board in self.boards:
+            board.sensors[0].setAdjustedVoltage(veab_sensor / 5)
 
 
     def send(self):
-        """Send the latest sensor data to the PC in a formatted text string with relative time starting at 0."""
-        start_time = time.time()  # Record the start time
+        """Publish the latest sensor data to the control client and every telemetry subscriber, timestamped from a telemetry epoch."""
+        epoch_ns = time.monotonic_ns()  # Telemetry time 0
+        epoch = epoch_ns / 1e9
+        sequence = 0  # Frame counter so the clients can detect dropped samples
+        scheduler = PeriodicScheduler(self.sensor_frequency, policy=SKIP, stats=self.loop_stats["send"])
+        scheduler.start()
+
+        # The control client gets the telemetry format it selected through receive();
+        # any number of additional subscribers can connect to the telemetry port.
+        hub = self.createTelemetryHub()
 
         while not self.stopFlag.value:
             try:
-                if self.clients:  # Ensure there is at least one connected client
-                    # Calculate relative time
-                    relative_time = time.time() - start_time
-
-                    # Get the latest data from the shared dictionary
-                    veab_sensor = self.latest_data["veab_sensor"]
-                    mpr_sensors = self.latest_data["mpr_sensors"]
-
-                    # Format the data as a single string
-                    formatted_data = (
-                        f"Time: {relative_time:.3f}s, VEAB: {veab_sensor:.2f}, "
-                        f"MPR1: {mpr_sensors[0]:.2f}, MPR2: {mpr_sensors[1]:.2f}, "
-                        f"MPR3: {mpr_sensors[2]:.2f}, MPR4: {mpr_sensors[3]:.2f}, "
-                        f"MPR5: {mpr_sensors[4]:.2f}, MPR6: {mpr_sensors[5]:.2f}, "
-                        f"MPR7: {mpr_sensors[6]:.2f}, MPR8: {mpr_sensors[7]:.2f}\n"
-                    )
-                    # print(f"[send to PC] {formatted_data.strip()}")  # Print the formatted data for debugging
-
-                    # Send the formatted string to the first client
-                    self.clients[0].sendall(formatted_data.encode('utf-8'))
-
-                    # Delay to match the desired frequency (e.g., 250 Hz)
-                    time.sleep(self.sensor_period)
-            except BrokenPipeError:
-                print("[ERROR] Client disconnected. Stopping send function.")
-                self.stopFlag.value = True
+                self.adoptClients(hub)
+                if self.publishLatest(hub, sequence, epoch):
+                    sequence += 1
+                self.publishReports(hub, epoch)
+                self.publishControl(hub, epoch)
+                self.publishPings(hub)
+                self.publishVeab(hub, epoch)
+                self.publishClock(hub, epoch_ns)
+
+                # Wait for the next deadline to match the desired frequency (e.g., 250 Hz)
+                scheduler.wait()
             except Exception as e:
                 print(f"[ERROR] Error in send function: {e}")
                 self.stopFlag.value = True
 
+        hub.close()
+
+    def createTelemetryHub(self):
+        """Create the telemetry server and subscribe the control client accepted by waitForClient, if any."""
+        hub = TelemetryHub(self.telemetry_port, on_disconnect=self.controlClientDisconnected)
+        for client, address in zip(self.clients, self.clients_addresses):
+            self.subscribeControlClient(hub, client, address)
+        return hub
+
+    def subscribeControlClient(self, hub, client, address):
+        """Publish to the control client in the telemetry format it selects through receive()."""
+        return hub.add_subscriber(client, address, mode_source=self.telemetryMode, rate_source=self.telemetryRate,
+                                  veab_source=self.veabStream, essential=True)
+
+    def adoptClients(self, hub):
+        """Subscribe the control clients receive accepted since the previous call and drop the ones that left."""
+        while self.client_adopt.poll():
+            action, address = self.client_adopt.recv()
+            if action == "attach":
+                client = socket.socket(fileno=reduction.recv_handle(self.client_adopt))
+                self.subscribeControlClient(hub, client, address)
+                continue
+            for subscriber in list(hub.essential):
+                if subscriber.address == address:
+                    hub.remove_subscriber(subscriber, "(session ended) ")
+
+    def publishLatest(self, hub, sequence, epoch):
+        """
+        Queue the latest sample for the raw subscribers and every sample since the previous call for
+        the aggregating ones, then send without blocking. Returns True if the latest sample was new.
+        """
+        if all(subscriber.window_aggregator() is None for subscriber in hub.subscribers):
+            self.sample_cursor = self.sample_ring.count()  # Nobody aggregates, start from the newest sample later
+        else:
+            self.sample_cursor, samples, _ = self.sample_ring.read_since(self.sample_cursor)
+            hub.aggregate([(time_ns / 1e9 - epoch, values[0], values[1:9]) for _, time_ns, values in samples])
+        # Get a consistent snapshot of the latest data from the shared store
+        sample_id, capture_time, veab_sensor, mpr_sensors, time_error = self.sample_store.read()
+        new_sample = False
+        if sample_id:  # Nothing to publish before the first Arduino sample
+            new_sample = hub.publish(sequence, capture_time - epoch, veab_sensor, mpr_sensors, sample_id=sample_id,
+                                     time_error=time_error)
+        hub.poll(0)
+        return new_sample
+
+    def publishControl(self, hub, epoch):
+        """Send the controller state of the latest control tick, if there is a new one."""
+        rows = []
+        for index, store in enumerate(self.control_stores):  # One store per bus worker
+            sequence, values = store.read()
+            if sequence == self.control_sequences_sent[index]:
+                continue
+            self.control_sequences_sent[index] = sequence
+            timestamp = values[0]
+            rows += [(i, *values[2 + 6 * i:7 + 6 * i]) for i in range(self.nActuators) if values[1 + 6 * i]]
+        if rows:
+            hub.publish_control(sequence // 2, timestamp - epoch, rows)
+
+    def publishPings(self, hub):
+        """Echo the answered latency probes with the time of every stage they passed."""
+        try:
+            while True:
+                hub.publish_echo(*self.ping_replies.get_nowait(), time.monotonic_ns())
+        except queue.Empty:
+            pass
+
+    def publishVeab(self, hub, epoch):
+        """Stream the VEAB samples acquired since the previous call to the clients that enabled it."""
+        if not any(subscriber.veab for subscriber in hub.subscribers):
+            self.veab_cursor = self.veab_ring.count()  # Nobody listens, start from the newest sample later
+            return
+        self.veab_cursor, samples, _ = self.veab_ring.read_since(self.veab_cursor)  # Lost samples show up as index gaps
+        if not samples:
+            return
+        samples = [(time_ns / 1e9 - epoch, values) for _, time_ns, values in samples]
+        first_index = self.veab_cursor - len(samples)
+        for start in range(0, len(samples), VEAB_BLOCK_SAMPLES):
+            block = samples[start:start + VEAB_BLOCK_SAMPLES]
+            hub.publish_veab(first_index + start, block[0][0], block)
+
+    def publishClock(self, hub, epoch_ns):
+        """Send the telemetry epoch and the state of the Arduino clock mapping, once every CLOCK_INTERVAL."""
+        now = time.monotonic()
+        if now < self.clock_frame_due:
+            return
+        self.clock_frame_due = now + CLOCK_INTERVAL
+        _, (arduino_ppm, arduino_error, arduino_points) = self.clock_store.read()
+        hub.publish_clock(epoch_ns, arduino_ppm, arduino_error, int(arduino_points))
 
+    def controlClientDisconnected(self, subscriber):
+        """Close send's copy of a control client that went away; receive ends the session and accepts the next one."""
+        subscriber.sock.close()
+
+
+
+    def startSerialOwner(self):
+        """
+        Start the process that owns the Arduino port before a client connects.
+
+        The port is then open and the firmware answering by the time the client sends its
+        first command. createProcesses does not create it a second time.
+        """
+        process = self.loopProcess("read_arduino", self.read_arduino)
+        process.start()
+        self.processes.append(process)
 
     def createProcesses(self):
         """Create multiprocessing processes for Arduino communication and actuator control."""
-        # Create process for reading Arduino data
-        self.processes.append(multiprocessing.Process(target=self.read_arduino))
-        # Create process for updating VEAB sensor values
-        self.processes.append(multiprocessing.Process(target=self.update_veab_sensor))
-        # Create actuator control process
-        self.processes.append(multiprocessing.Process(target=self.controlActuators))
+        # Create the process that owns the Arduino serial port (sensor data in, valve commands out)
+        if not any(p.name == "read_arduino" for p in self.processes):
+            self.processes.append(self.loopProcess("read_arduino", self.read_arduino))
+        # Create actuator control process (and the bus workers)
+        self.processes += self.actuatorProcesses()
+        # Create the process that samples the VEAB ADCs at their data rate
+        self.processes.append(self.loopProcess("acquireVeab", self.acquireVeab))
+        # Create process for playing uploaded valve sequences
+        self.processes.append(self.loopProcess("playSequences", self.playSequences))
         # Create communication processes for sending and receiving data
-        self.processes.append(multiprocessing.Process(target=self.receive))
+        self.processes.append(self.loopProcess("receive", self.receive))
         # Create process for sending data to PC
-        self.processes.append(multiprocessing.Process(target=self.send))
+        self.processes.append(self.loopProcess("send", self.send))
+
+
+    def actuatorProcesses(self):
+        """Processes that drive the DACs: controlActuators, plus one worker per I2C bus with busWorkers."""
+        if not self.bus_workers:
+            return [self.loopProcess("controlActuators", self.controlActuators)]
+        anchor_ns = time.monotonic_ns() + BUS_WORKER_START_NS  # Common tick grid of every loop
+        processes = [self.loopProcess("controlActuators", self.controlActuators, anchor_ns)]
+        processes += [self.loopProcess("controlBus", self.controlBus, index, anchor_ns)
+                      for index in range(len(self.dac_buses))]
+        return processes
+
+    def loopProcess(self, name, target, *args):
+        """Process running target(*args) with the scheduling settings of loop `name`."""
+        return multiprocessing.Process(target=self.runScheduled, args=(name, target) + args, name=name)
+
+    def runScheduled(self, name, target, *args):
+        self.applySchedule(name)
+        target(*args)
 
+    def applySchedule(self, name):
+        """Apply the scheduling settings of loop `name` to the calling process and report what took effect."""
+        if name not in self.schedule and not self.lock_memory:
+            return
+        report = apply_schedule(name, self.schedule.get(name), self.lock_memory)
+        print(f"[INFO] Scheduling {report}")
+        self.schedule_reports.put(report)
 
     def run(self):
         """Start all created processes and print sensor values for debugging."""
         for p in self.processes:
-            p.start()
+            if p.pid is None:  # The serial owner may already run
+                p.start()
+        self.applySchedule("main")  # After the fork, so the loops do not inherit it
 
 
-    def waitForProcesses(self):
-        """Wait for all processes to complete."""
+    def installSignalHandlers(self):
+        """
+        Stop the robot cleanly on SIGINT (Ctrl+C) and SIGTERM (systemctl stop).
+
+        The handler only sets stopFlag, so every loop finishes its iteration, the actuators are
+        reset and the shared memory is released. The processes forked afterwards inherit it.
+        """
+        parent = os.getpid()
+
+        def stop(signum, frame):
+            if os.getpid() == parent:
+                print(f"[INFO] {signal.Signals(signum).name} received, stopping.")
+            self.stopFlag.value = True
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+    def waitForProcesses(self, reportInterval=None):
+        """Wait for all processes to complete, printing the loop statistics every reportInterval seconds."""
         for p in self.processes:
+            while p.is_alive():
+                p.join(reportInterval)
+                if reportInterval and p.is_alive():
+                    print(self.loopReport())
+
+    def collectScheduleReports(self):
+        """Return the scheduling reports of every process that applied its settings so far."""
+        while True:
+            try:
+                self.schedule_applied.append(self.schedule_reports.get_nowait())
+            except queue.Empty:
+                break
+        return self.schedule_applied
+
+    def loopReport(self):
+        """Return the jitter and overrun statistics of the periodic loops and the I2C statistics of the DAC buses."""
+        lines = [f"Scheduling {report}" for report in self.collectScheduleReports()]
+        lines += [stats.summary() for stats in self.loop_stats.values()]
+        lines += [budget.summary() for budget in self.bus_budgets or [self.control_budget]]
+        lines += [bus.stats.summary() for bus in self.dac_buses]
+        return "\n".join(lines)
 
-            p.join()
\ No newline at end of file
+    def releaseSharedMemory(self):
+        """Release the shared memory blocks once every process has finished."""
+        for store in [self.sample_store, self.sample_ring, self.clock_store, self.setpoint_store,
+                      self.veab_ring] + self.control_stores:
+            store.close()
+            store.unlink()
\ No newline at end of file
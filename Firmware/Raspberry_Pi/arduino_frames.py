@@ -0,0 +1,150 @@
+import binascii
+import struct
+
+# Binary Arduino protocol, selected by writing "B1" to the firmware ("B0" goes back to ASCII lines).
+# Every frame is COBS encoded and terminated by a zero byte, so a lost or corrupted byte costs at
+# most the frame it falls in and the reader resynchronizes on the next zero. Before encoding a frame is
+#   type (u8), sequence (u16), payload, CRC-16/CCITT-FALSE of everything before it (u16)
+# and the sequence number counts every frame the firmware sends, so gaps reveal dropped frames.
+FRAME_DELIMITER = b'\x00'
+FRAME_HEADER = struct.Struct('<BH')
+FRAME_CRC = struct.Struct('<H')
+FRAME_SAMPLE = 0x01   # Payload: SAMPLE_PAYLOAD
+FRAME_MESSAGE = 0x02  # Payload: status message text (UTF-8), like the ASCII status lines
+# Sample payload: Arduino time (ms), VEAB, MPR1-8 (Pa)
+SAMPLE_PAYLOAD = struct.Struct('<If8f')
+SAMPLE_FRAME_SIZE = FRAME_HEADER.size + SAMPLE_PAYLOAD.size + FRAME_CRC.size
+BINARY_PROTOCOL_ON = b'B1'
+BINARY_PROTOCOL_OFF = b'B0'
+# Sequence jumps larger than this are a firmware restart, not dropped frames
+SEQUENCE_RESTART_GAP = 0x8000
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF) of `data`."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def cobs_encode(data):
+    """
+    Consistent Overhead Byte Stuffing: encode `data` without any zero byte.
+
+    Adds one byte, plus one per 254 bytes without a zero. The frame delimiter is not included.
+    """
+    encoded = bytearray()
+    for block in bytes(data).split(b'\x00'):
+        while len(block) >= 254:
+            encoded.append(255)
+            encoded += block[:254]
+            block = block[254:]
+        encoded.append(len(block) + 1)
+        encoded += block
+    return bytes(encoded)
+
+
+def cobs_decode(data):
+    """
+    Decode one COBS encoded frame (without its delimiter).
+
+    Raises:
+        ValueError: If a code byte is zero or points past the end of the frame.
+    """
+    decoded = bytearray()
+    offset = 0
+    end = len(data)
+    while offset < end:
+        code = data[offset]
+        if code == 0 or offset + code > end:
+            raise ValueError("Invalid COBS code byte")
+        decoded += data[offset + 1:offset + code]
+        offset += code
+        if code < 255 and offset < end:
+            decoded.append(0)
+    return bytes(decoded)
+
+
+def encode_frame(frame_type, sequence, payload):
+    """Build one delimited frame: header, payload and CRC, COBS encoded and terminated by a zero."""
+    body = FRAME_HEADER.pack(frame_type, sequence & 0xFFFF) + payload
+    return cobs_encode(body + FRAME_CRC.pack(crc16(body))) + FRAME_DELIMITER
+
+
+class ArduinoFrameEncoder:
+    def __init__(self):
+        """
+        Encoder side of the binary protocol, as implemented by Pneumatic.ino.
+
+        Used by the simulated Arduino and by the benchmark, so the decoder can be tested
+        without the hardware. Keeps the sequence number across frames.
+        """
+        self.sequence = 0
+
+    def _next_sequence(self):
+        sequence = self.sequence
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        return sequence
+
+    def sample(self, time_ms, veab_sensor, mpr_sensors):
+        """Encode one sample: Arduino time (ms), VEAB and the 8 MPR pressures."""
+        return encode_frame(FRAME_SAMPLE, self._next_sequence(),
+                            SAMPLE_PAYLOAD.pack(int(time_ms) & 0xFFFFFFFF, veab_sensor, *mpr_sensors[:8]))
+
+    def message(self, text):
+        """Encode one status message."""
+        return encode_frame(FRAME_MESSAGE, self._next_sequence(), text.encode('utf-8'))
+
+
+class ArduinoFrameDecoder:
+    def __init__(self, stats):
+        """
+        Decoder side of the binary protocol.
+
+        Args:
+            stats (IngestStats): Counters to update: frames, corrupt and dropped frames.
+        """
+        self.stats = stats
+        self.next_sequence = None
+
+    def decode(self, frames):
+        """
+        Decode complete frames (COBS encoded, delimiters removed).
+
+        Frames failing the COBS, length or CRC checks are counted as corrupt and skipped.
+
+        Returns:
+            tuple: (samples, status_messages) like ArduinoLineReader.parse_chunk.
+        """
+        stats = self.stats
+        samples = []
+        messages = []
+        for encoded in frames:
+            if not encoded:
+                continue
+            try:
+                frame = cobs_decode(encoded)
+            except ValueError:
+                stats.corrupt_frames += 1
+                continue
+            if len(frame) < FRAME_HEADER.size + FRAME_CRC.size or \
+                    crc16(frame[:-FRAME_CRC.size]) != FRAME_CRC.unpack_from(frame, len(frame) - FRAME_CRC.size)[0]:
+                stats.corrupt_frames += 1
+                continue
+
+            frame_type, sequence = FRAME_HEADER.unpack_from(frame)
+            if self.next_sequence is not None:
+                gap = (sequence - self.next_sequence) & 0xFFFF
+                if gap < SEQUENCE_RESTART_GAP:
+                    stats.dropped_frames += gap
+            self.next_sequence = (sequence + 1) & 0xFFFF
+            stats.frames += 1
+
+            if frame_type == FRAME_SAMPLE and len(frame) == SAMPLE_FRAME_SIZE:
+                values = SAMPLE_PAYLOAD.unpack_from(frame, FRAME_HEADER.size)
+                samples.append((values[0] * 0.001, values[1], list(values[2:])))  # Arduino time is in ms
+            elif frame_type == FRAME_MESSAGE:
+                messages.append(frame[FRAME_HEADER.size:-FRAME_CRC.size].decode('utf-8', 'replace').strip())
+            else:
+                stats.parse_errors += 1  # Valid frame of an unknown type or size
+        stats.samples += len(samples)
+        stats.status_lines += len(messages)
+        return samples, messages
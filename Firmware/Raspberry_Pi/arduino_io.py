@@ -0,0 +1,406 @@
+import multiprocessing
+import re
+import select
+import struct
+import threading
+import time
+
+from arduino_frames import BINARY_PROTOCOL_ON, FRAME_DELIMITER, SAMPLE_FRAME_SIZE, ArduinoFrameDecoder
+from clock_sync import ArduinoClock
+from hardware import SERIAL_ERRORS
+
+# One Arduino sample line: "ms,veab,mpr1,...,mpr8"
+_NUMBER = rb'(-?\d+(?:\.\d+)?)'
+SAMPLE_LINE = re.compile(rb'^' + rb','.join([_NUMBER] * 10) + rb'\r?$', re.MULTILINE)
+# Status messages from the firmware start with a letter ("Calibration complete.", "Updated valve states ...")
+STATUS_LINE = re.compile(rb'^[A-Za-z][^\r\n]*', re.MULTILINE)
+NON_BLANK_LINE = re.compile(rb'^\r?[^\r\n]', re.MULTILINE)
+# Latency probe: the Pi writes "P<id>", the firmware answers "Pong <id>"
+PONG_LINE = re.compile(r'^Pong (\d+)$')
+PING_TIMEOUT_NS = 1000000000  # Pings not answered within 1 s are reported without an ack
+# Bytes received without a single frame delimiter after asking for binary frames before
+# concluding that the firmware only speaks ASCII
+ASCII_FALLBACK_BYTES = 2048
+ARDUINO_PROTOCOLS = ("ascii", "binary")
+# Commands are held after opening the port until the firmware sends its first byte (it ignores
+# them while the bootloader runs after a reset), or until this many seconds have passed
+FIRMWARE_READY_TIMEOUT = 5.0
+# Bytes the firmware sends after its last sensor read of a sample: the last pressure and the line end
+# of a sample line ("-1234.56\r\n"), or the whole frame (COBS code byte and delimiter included)
+ASCII_SAMPLE_TAIL_BYTES = 10
+BINARY_SAMPLE_TAIL_BYTES = SAMPLE_FRAME_SIZE + 2
+BITS_PER_BYTE = 10  # 8N1: start and stop bit
+
+
+def parse_sample_fields(fields):
+    """Convert the 10 captured fields of a sample line to (timestamp_s, veab, [mpr1..mpr8])."""
+    values = [float(field) for field in fields]
+    return values[0] * 0.001, values[1], values[2:]  # Arduino time is in ms
+
+
+class IngestStats:
+    def __init__(self, report_interval=5.0):
+        """
+        Throughput and error counters for the Arduino serial ingestion.
+
+        Args:
+            report_interval (float): Seconds between printed reports (0 disables them).
+        """
+        self.report_interval = report_interval
+        self.lines = 0
+        self.samples = 0
+        self.status_lines = 0
+        self.parse_errors = 0
+        self.bytes = 0
+        self.frames = 0  # Binary protocol only: valid frames, frames failing COBS/CRC, sequence gaps
+        self.corrupt_frames = 0
+        self.dropped_frames = 0
+        self._window_start = time.monotonic()
+        self._window_lines = 0
+
+    def lines_per_second(self):
+        """Line (or binary frame) rate since the last report."""
+        elapsed = time.monotonic() - self._window_start
+        return (self.lines + self.frames - self._window_lines) / elapsed if elapsed > 0 else 0.0
+
+    def maybe_report(self, extra=""):
+        """Print the line rate and error counts once per report interval."""
+        if not self.report_interval or time.monotonic() - self._window_start < self.report_interval:
+            return
+        frames = (f", {self.frames} frames, {self.corrupt_frames} corrupt, {self.dropped_frames} dropped"
+                  if self.frames or self.corrupt_frames else "")
+        print(f"[INFO] Arduino ingest: {self.lines_per_second():.1f} {'frames' if self.frames else 'lines'}/s, "
+              f"{self.samples} samples, {self.parse_errors} parse errors, {self.status_lines} status lines, "
+              f"{self.bytes} bytes{frames}" + (f"; {extra}" if extra else ""))
+        self._window_start = time.monotonic()
+        self._window_lines = self.lines + self.frames
+
+
+class ArduinoLineReader:
+    delimiter = b'\n'
+
+    def __init__(self, ser, stats=None):
+        """
+        Bulk reader for the Arduino sensor stream.
+
+        Blocks on the port until data arrives, drains everything that is buffered in one
+        read, and parses every complete line of the batch with precompiled expressions.
+        Partial lines stay in a persistent buffer until the rest arrives.
+
+        Args:
+            ser: Open serial.Serial (or compatible) port.
+            stats (IngestStats): Counters to update, a new one is created if None.
+        """
+        self.ser = ser
+        self.stats = stats if stats is not None else IngestStats()
+        self.buffer = bytearray()
+
+    def wait_readable(self, timeout):
+        """Block until the port has data or the timeout expires."""
+        try:
+            fileno = self.ser.fileno()
+        except (AttributeError, OSError):
+            return True  # No selectable handle, rely on the port's own read timeout
+        readable, _, _ = select.select([fileno], [], [], timeout)
+        return bool(readable)
+
+    def read_batch(self, timeout=0.1):
+        """
+        Wait for data, drain the port and parse every complete line.
+
+        Args:
+            timeout (float): Maximum time to block waiting for data, in seconds.
+
+        Returns:
+            tuple: (samples, status_messages) where samples is a list of
+            (timestamp_s, veab, [mpr1..mpr8]) and status_messages a list of str.
+        """
+        if not self.wait_readable(timeout):
+            return [], []
+
+        waiting = self.ser.in_waiting
+        if not waiting and not timeout:
+            return [], []
+        data = self.ser.read(waiting or 1)
+        if not data:
+            return [], []
+        self.stats.bytes += len(data)
+        self.buffer += data
+
+        end = self.buffer.rfind(self.delimiter)
+        if end < 0:
+            return [], []
+        chunk = bytes(self.buffer[:end + 1])
+        del self.buffer[:end + 1]
+
+        return self.parse_chunk(chunk)
+
+    def parse_chunk(self, chunk):
+        """Parse a block of complete lines in one pass."""
+        fields = SAMPLE_LINE.findall(chunk)
+        status = STATUS_LINE.findall(chunk)
+        lines = len(NON_BLANK_LINE.findall(chunk))
+
+        samples = [parse_sample_fields(sample_fields) for sample_fields in fields]
+
+        self.stats.lines += lines
+        self.stats.samples += len(samples)
+        self.stats.status_lines += len(status)
+        self.stats.parse_errors += max(0, lines - len(samples) - len(status))
+        return samples, [message.decode('utf-8', 'replace').strip() for message in status]
+
+
+class ArduinoFrameReader(ArduinoLineReader):
+    delimiter = FRAME_DELIMITER
+
+    def __init__(self, ser, stats=None):
+        """
+        Bulk reader for the binary (COBS framed) Arduino stream, see arduino_frames.py.
+
+        Reads like ArduinoLineReader, but splits the batch on frame delimiters and checks
+        the CRC and sequence number of every frame. Complete lines that arrived before the
+        first delimiter (sent before the firmware switched) are parsed as ASCII. If no
+        delimiter arrives at all the firmware predates the binary protocol, and
+        `ascii_fallback` is set so the owner can go back to the line reader.
+        """
+        super().__init__(ser, stats)
+        self.decoder = ArduinoFrameDecoder(self.stats)
+        self.synchronized = False
+        self.ascii_fallback = False
+
+    def read_batch(self, timeout=0.1):
+        batch = super().read_batch(timeout)
+        if not self.synchronized and len(self.buffer) > ASCII_FALLBACK_BYTES:
+            self.ascii_fallback = True
+        return batch
+
+    def parse_chunk(self, chunk):
+        """Decode a block of complete frames in one pass."""
+        frames = chunk.split(FRAME_DELIMITER)
+        if not self.synchronized:
+            self.synchronized = True
+            end = frames[0].rfind(b'\n') + 1
+            samples, messages = super().parse_chunk(frames[0][:end])
+            corrupt_frames = self.stats.corrupt_frames
+            first_samples, first_messages = self.decoder.decode([frames[0][end:]])
+            self.stats.corrupt_frames = corrupt_frames  # The rest of a partial line, not a corrupted frame
+            more_samples, more_messages = self.decoder.decode(frames[1:])
+            return samples + first_samples + more_samples, messages + first_messages + more_messages
+        return self.decoder.decode(frames)
+
+
+class LatencyStats:
+    def __init__(self, name):
+        """Running count/mean/max of a latency measured in nanoseconds."""
+        self.name = name
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.last_ns = 0
+
+    def add(self, latency_ns):
+        self.count += 1
+        self.total_ns += latency_ns
+        self.max_ns = max(self.max_ns, latency_ns)
+        self.last_ns = latency_ns
+
+    def summary(self):
+        mean_us = self.total_ns / self.count / 1000 if self.count else 0.0
+        return (f"{self.name}: n={self.count}, mean={mean_us:.0f} us, "
+                f"max={self.max_ns / 1000:.0f} us, last={self.last_ns / 1000:.0f} us")
+
+
+class SerialMux:
+    _COMMAND_HEADER = struct.Struct('<q')  # monotonic_ns at which the command was queued
+
+    def __init__(self, port, baud, opener, report_interval=5.0, protocol="ascii"):
+        """
+        Single owner of the Arduino serial port.
+
+        Only the process running `run` ever opens the port, so the Arduino is reset once
+        and never sees two competing handles. Other processes queue valve commands through
+        a pipe with `send_command`; the owner waits on the port and the pipe at the same
+        time, writes commands as soon as they arrive and measures the command-to-write
+        latency, and hands parsed sensor lines to a callback. Latency probes queued with
+        `send_ping` are written the same way and matched with the firmware's answer.
+        The Arduino time stamps of the samples are mapped to the Pi's monotonic clock by
+        `clock` (an ArduinoClock fed with the time at which every batch was read).
+
+        The port is opened without waiting for a reset: commands are held until the
+        firmware sends its first byte, which is immediate when the board was not reset
+        (see PiBackend.open_serial). With the binary protocol the owner then asks the
+        firmware for COBS framed samples, and goes back to ASCII lines if it never sends any.
+
+        Args:
+            port (str): Serial device, e.g. "/dev/ttyACM0".
+            baud (int): Baud rate.
+            opener (callable): opener(port, baud) returns an open port (see hardware.py).
+            report_interval (float): Seconds between printed statistics (0 disables them).
+            protocol (str): "ascii" for sample lines, "binary" for COBS/CRC frames.
+        """
+        if protocol not in ARDUINO_PROTOCOLS:
+            raise ValueError(f"Unknown Arduino protocol: {protocol}")
+        self.port = port
+        self.baud = baud
+        self.opener = opener
+        self.protocol = protocol
+        self.command_reader, self.command_writer = multiprocessing.Pipe(duplex=False)
+        self._send_lock = threading.Lock()
+        self.ingest_stats = IngestStats(report_interval)
+        self.write_latency = LatencyStats("command-to-write")
+        self.pending_pings = {}  # probe id -> (received_ns, written_ns), owner process only
+        self.held_commands = []  # (queued_ns, command) waiting for the firmware, owner process only
+        self.firmware_ready = False
+        self.opened_at = None
+        self.ser = None
+        self.reader = None
+        self.clock = ArduinoClock(latency_s=self.sample_latency(protocol))  # Owner process only
+
+    def sample_latency(self, protocol):
+        """Seconds between the firmware's last sensor read of a sample and the arrival of the sample's last byte."""
+        tail = BINARY_SAMPLE_TAIL_BYTES if protocol == "binary" else ASCII_SAMPLE_TAIL_BYTES
+        return tail * BITS_PER_BYTE / self.baud
+
+    def send_command(self, binary_string):
+        """Queue a 12-bit valve command for the serial owner (callable from any process)."""
+        message = self._COMMAND_HEADER.pack(time.monotonic_ns()) + binary_string.encode('utf-8')
+        with self._send_lock:
+            self.command_writer.send_bytes(message)
+
+    def send_ping(self, probe_id, received_ns):
+        """
+        Queue a latency probe for the Arduino (callable from any process).
+
+        Args:
+            probe_id (int): Id chosen by the client.
+            received_ns (int): Monotonic time at which the Pi received the probe.
+        """
+        message = self._COMMAND_HEADER.pack(received_ns) + b'P%d' % probe_id
+        with self._send_lock:
+            self.command_writer.send_bytes(message)
+
+    def open(self):
+        """Open the port (owner process only) and return its line reader."""
+        print(f"[INFO] Attempting to reconnect to Arduino on {self.port}")
+        self.ser = self.opener(self.port, self.baud)
+        print(f"[INFO] Reconnected to Arduino on {self.port}")
+        self.firmware_ready = False
+        self.opened_at = time.monotonic()
+        self._bytes_at_open = self.ingest_stats.bytes
+        if self.protocol == "binary":
+            self.reader = ArduinoFrameReader(self.ser, self.ingest_stats)
+        else:
+            self.reader = ArduinoLineReader(self.ser, self.ingest_stats)
+        return self.reader
+
+    def check_firmware_ready(self):
+        """Release the held commands once the firmware has sent something since the port was opened."""
+        if self.firmware_ready:
+            return
+        waited = time.monotonic() - self.opened_at
+        if self.ingest_stats.bytes > self._bytes_at_open:
+            print(f"[INFO] Arduino on {self.port} answering {waited * 1000:.0f} ms after opening the port")
+        elif waited > FIRMWARE_READY_TIMEOUT:
+            print(f"[ERROR] No data from the Arduino on {self.port} after {FIRMWARE_READY_TIMEOUT:.0f} s, "
+                  f"writing commands anyway")
+        else:
+            return
+        self.firmware_ready = True
+        if self.protocol == "binary":
+            self.ser.write(BINARY_PROTOCOL_ON + b'\n')
+        self.write_pending_commands()
+
+    def write_pending_commands(self):
+        """Write every queued command to the port (or hold them while the firmware is not ready)."""
+        while self.command_reader.poll():
+            message = self.command_reader.recv_bytes()
+            queued_ns = self._COMMAND_HEADER.unpack_from(message)[0]
+            self.held_commands.append((queued_ns, message[self._COMMAND_HEADER.size:]))
+        if not self.firmware_ready:
+            return
+        commands, self.held_commands = self.held_commands, []
+        for queued_ns, command in commands:
+            self.ser.write(command + b'\n')
+            written_ns = time.monotonic_ns()
+            self.write_latency.add(written_ns - queued_ns)
+            if command[:1] == b'P':
+                self.pending_pings[int(command[1:])] = (queued_ns, written_ns)
+
+    def service_port(self, on_samples, on_message=None, on_ping=None):
+        """Parse whatever the port has buffered, without blocking."""
+        samples, messages = self.reader.read_batch(timeout=0)
+        acked_ns = time.monotonic_ns()  # Read time of the batch, and ack time of the pongs it contains
+        self.check_firmware_ready()
+        if getattr(self.reader, "ascii_fallback", False):
+            print(f"[ERROR] No binary frames from the Arduino on {self.port}, falling back to ASCII lines")
+            buffered = self.reader.buffer
+            self.reader = ArduinoLineReader(self.ser, self.ingest_stats)
+            self.reader.buffer = buffered
+            self.clock.latency_s = self.sample_latency("ascii")
+        if samples:
+            self.clock.add(samples[-1][0], acked_ns)  # The last sample of the batch arrived last
+            on_samples(samples)
+        for message in messages:
+            pong = PONG_LINE.match(message)
+            if pong:
+                self.complete_ping(int(pong.group(1)), acked_ns, on_ping)
+            elif on_message is not None:
+                on_message(message)
+        self.expire_pings(acked_ns, on_ping)
+        self.ingest_stats.maybe_report(extra=f"{self.write_latency.summary()}; {self.clock.summary()}")
+
+    def complete_ping(self, probe_id, acked_ns, on_ping):
+        """Report a probe answered by the firmware: on_ping(probe id, received, written, acked)."""
+        times = self.pending_pings.pop(probe_id, None)
+        if times is not None and on_ping is not None:
+            on_ping(probe_id, *times, acked_ns)
+
+    def expire_pings(self, now_ns, on_ping):
+        """Report the probes the firmware did not answer in time, with an ack time of 0."""
+        for probe_id, (received_ns, written_ns) in list(self.pending_pings.items()):
+            if now_ns - written_ns > PING_TIMEOUT_NS:
+                del self.pending_pings[probe_id]
+                if on_ping is not None:
+                    on_ping(probe_id, received_ns, written_ns, 0)
+
+    def run(self, stop_flag, on_samples, on_message=None, timeout=0.1, on_ping=None):
+        """
+        Serve the port until stop_flag is set.
+
+        Args:
+            stop_flag: Shared boolean value, the loop exits when it becomes True.
+            on_samples (callable): Called with the list of parsed samples of each batch.
+            on_message (callable): Called with every status message from the firmware.
+            timeout (float): Maximum time to block waiting for the port or a command.
+            on_ping (callable): Called with (probe id, received_ns, written_ns, acked_ns)
+                of every latency probe, acked_ns is 0 if the firmware did not answer.
+        """
+        while not stop_flag.value:
+            try:
+                if self.ser is None or not self.ser.is_open:
+                    self.open()
+
+                # Wait for either a valve command or sensor data
+                watched = [self.command_reader]
+                try:
+                    watched.append(self.ser.fileno())
+                    wait = timeout
+                except (AttributeError, OSError):
+                    wait = 0.001  # Port is not selectable, poll it at a short interval
+                ready, _, _ = select.select(watched, [], [], wait)
+
+                if self.command_reader in ready:
+                    self.write_pending_commands()
+
+                self.service_port(on_samples, on_message, on_ping)
+
+            except SERIAL_ERRORS as e:
+                print(f"[ERROR] Arduino communication error: {e}")
+                self.ser = None  # Reset the connection to trigger a reconnect next time
+
+            except Exception as e:
+                print(f"[ERROR] Unexpected error in serial I/O: {e}")
+                self.ser = None  # Reset the connection to trigger a reconnect
+
+        if self.ser is not None:
+            self.ser.close()
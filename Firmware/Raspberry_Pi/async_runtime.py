@@ -0,0 +1,230 @@
+import asyncio
+import queue
+import time
+
+from hardware import SERIAL_ERRORS
+from protocol import CommandParser
+from scheduler import PeriodicScheduler, SKIP
+from sequencer import SequencePlayer
+
+
+class AsyncRuntime:
+    def __init__(self, robot):
+        """
+        Run the SoftRobot loops as coroutines of a single asyncio event loop.
+
+        This is an alternative to SoftRobot.createProcesses()/run(): the serial port, the
+        control socket and the telemetry sockets are all non-blocking and served by the
+        event loop, and the periodic loops use the same deadline scheduler and statistics
+        as the multiprocess runtime. Nothing is forked, so there is no IPC between loops.
+
+        Args:
+            robot (SoftRobot): Initialized robot. Its control clients are accepted by receive,
+                as in the multiprocess runtime.
+        """
+        self.robot = robot
+        self.hub = None  # Telemetry hub, shared by send and receive (which subscribes the control clients)
+
+    def run(self):
+        """Run every loop until the robot's stopFlag is set."""
+        self.robot.applySchedule("main")  # Every loop runs in this process
+        asyncio.run(self.main())
+
+    async def main(self):
+        self.hub = self.robot.createTelemetryHub()
+        self.robot.openRecorders("samples", "valves", "valves-sequence", "dac")  # Every loop records from here
+        self.hub.on_disconnect = None  # The control client socket is receive's, which notices the disconnection itself
+        loops = [
+            self.serial_io(),
+            self.control_actuators(),
+            self.acquire_veab(),
+            self.play_sequences(),
+            self.receive(),
+            self.send(),
+        ]
+        try:
+            await asyncio.gather(*loops)
+        finally:
+            self.robot.stopFlag.value = True
+            self.hub.close()
+            self.robot.resetActuators()  # Reset actuators to default when stopping
+            self.robot.closeRecorders()
+            self.robot.socket_TCP.close()
+
+    async def serial_io(self):
+        """Own the Arduino port: write queued valve commands and publish parsed sensor data."""
+        loop = asyncio.get_running_loop()
+        mux = self.robot.serial_mux
+        wake = asyncio.Event()
+        watched = []
+        timeout = 0.1
+        while not self.robot.stopFlag.value:
+            try:
+                if mux.ser is None or not mux.ser.is_open:
+                    await loop.run_in_executor(None, mux.open)  # Keep the loop responsive during the reset delay
+                    watched = [mux.command_reader.fileno()]
+                    try:
+                        watched.append(mux.ser.fileno())
+                    except (AttributeError, OSError):
+                        pass  # Port is not selectable, poll it at a short interval below
+                    for fd in watched:
+                        loop.add_reader(fd, wake.set)
+                    timeout = 0.1 if len(watched) == 2 else 0.001
+
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+
+                mux.write_pending_commands()
+                mux.service_port(self.robot.publishSamples, self.robot.handleArduinoMessage, self.robot.handlePingReply)
+
+            except SERIAL_ERRORS as e:
+                print(f"[ERROR] Arduino communication error: {e}")
+                self._remove_readers(loop, watched)
+                mux.ser = None  # Reset the connection to trigger a reconnect next time
+
+            except Exception as e:
+                print(f"[ERROR] Unexpected error in serial I/O: {e}")
+                self._remove_readers(loop, watched)
+                mux.ser = None  # Reset the connection to trigger a reconnect
+
+        self._remove_readers(loop, watched)
+        if mux.ser is not None:
+            mux.ser.close()
+
+    @staticmethod
+    def _remove_readers(loop, watched):
+        for fd in watched:
+            loop.remove_reader(fd)
+        watched.clear()
+
+    async def control_actuators(self):
+        """Control actuators periodically based on the received values."""
+        scheduler = PeriodicScheduler(self.robot.actuator_frequency, policy=SKIP,
+                                      stats=self.robot.loop_stats["controlActuators"])
+        scheduler.start()
+        while not self.robot.stopFlag.value:
+            try:
+                self.robot.updateActuators(scheduler.next_deadline)
+            except Exception as e:
+                print('Error in control Actuators:', e)
+                self.robot.stopFlag.value = True  # Stop on failure
+            await scheduler.wait_async()
+
+    async def acquire_veab(self):
+        """Read every VEAB ADC at its data rate into the shared ring buffer."""
+        scheduler = PeriodicScheduler(self.robot.veab_rate, policy=SKIP, stats=self.robot.loop_stats["acquireVeab"])
+        scheduler.start()
+        while not self.robot.stopFlag.value:
+            try:
+                self.robot.sampleVeab()
+            except Exception as e:
+                print(f"[ERROR] Error in VEAB acquisition: {e}")
+                self.robot.stopFlag.value = True
+            await scheduler.wait_async()
+
+    async def play_sequences(self):
+        """Play uploaded valve sequences on absolute deadlines, checking for uploads every 10 ms."""
+        player = SequencePlayer()
+        while not self.robot.stopFlag.value:
+            try:
+                while True:
+                    self.robot.loadSequence(player, self.robot.sequence_queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.robot.playDueFrames(player)
+            except Exception as e:
+                print(f"[ERROR] Error in sequence playback: {e}")
+            deadline = player.next_deadline()
+            delay = 0.01 if deadline is None else (deadline - time.monotonic_ns()) / 1e9
+            await asyncio.sleep(min(max(delay, 0.0), 0.01))
+
+    async def receive(self):
+        """Serve the control clients one at a time without blocking the loop (see SoftRobot.receive)."""
+        loop = asyncio.get_running_loop()
+        robot = self.robot
+        listener = robot.socket_TCP
+        listener.setblocking(False)
+        wake = asyncio.Event()
+        loop.add_reader(listener, wake.set)
+        client = address = None
+        if robot.clients:  # Accepted by waitForClient and already subscribed to the telemetry
+            client, address = robot.clients[0], robot.clients_addresses[0]
+            client.setblocking(False)
+            loop.add_reader(client, wake.set)
+        parser = CommandParser(robot.commandSizes())
+        try:
+            while not robot.stopFlag.value:
+                try:
+                    await asyncio.wait_for(wake.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    continue
+                wake.clear()
+
+                try:
+                    new_client, new_address = listener.accept()
+                except BlockingIOError:
+                    pass
+                else:
+                    if client is not None:
+                        self._end_session(loop, client, address, "replaced by a new client")
+                    client, address = new_client, new_address
+                    robot.configureClient(client)
+                    robot.subscribeControlClient(self.hub, client, address)  # Also makes it non-blocking
+                    loop.add_reader(client, wake.set)
+                    parser = CommandParser(robot.commandSizes())
+                    print(f"[INFO] Client {address} connected. Comm's ready!")
+
+                if client is None:
+                    continue
+                try:
+                    data = client.recv(4096)
+                except BlockingIOError:
+                    continue
+                except OSError as e:  # Connection reset, keepalive timeout
+                    client = self._end_session(loop, client, address, f"lost ({e})")
+                    continue
+                if not data:
+                    client = self._end_session(loop, client, address, "closed the connection")
+                    continue
+                for data_type, payload in parser.feed(data):
+                    robot.handleCommand(data_type, payload)
+                if parser.error is not None:
+                    client = self._end_session(loop, client, address, f"sent an {parser.error}")
+        finally:
+            loop.remove_reader(listener)
+            if client is not None:
+                loop.remove_reader(client)
+                client.close()
+
+    def _end_session(self, loop, client, address, reason):
+        loop.remove_reader(client)
+        for subscriber in list(self.hub.essential):
+            if subscriber.sock is client:
+                self.hub.remove_subscriber(subscriber, "(session ended) ")
+        return self.robot.endSession(client, address, reason)
+
+    async def send(self):
+        """Publish the latest sensor data to every subscriber at the sensor frequency."""
+        epoch_ns = time.monotonic_ns()  # Telemetry time 0
+        epoch = epoch_ns / 1e9
+        sequence = 0
+        scheduler = PeriodicScheduler(self.robot.sensor_frequency, policy=SKIP, stats=self.robot.loop_stats["send"])
+        scheduler.start()
+        hub = self.hub
+        while not self.robot.stopFlag.value:
+            try:
+                if self.robot.publishLatest(hub, sequence, epoch):
+                    sequence += 1
+                self.robot.publishReports(hub, epoch)
+                self.robot.publishControl(hub, epoch)
+                self.robot.publishPings(hub)
+                self.robot.publishVeab(hub, epoch)
+                self.robot.publishClock(hub, epoch_ns)
+            except Exception as e:
+                print(f"[ERROR] Error in send function: {e}")
+                self.robot.stopFlag.value = True
+            await scheduler.wait_async()
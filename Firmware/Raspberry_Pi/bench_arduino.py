@@ -0,0 +1,115 @@
+"""
+Compare the ASCII and binary (COBS/CRC) Arduino sample protocols without an Arduino.
+
+The script encodes the same synthetic samples as firmware lines and as binary frames
+(with ArduinoFrameEncoder) and prints, for each protocol:
+
+- bytes per sample and the share of the 115200 baud link used at --rate samples/s,
+- decode throughput of the Pi-side reader (parse_chunk on batches of --batch samples),
+- with --error-rate of the lines/frames having one bit flipped: the samples delivered,
+  the errors detected, and the corrupted samples that went through undetected.
+
+    python bench_arduino.py --samples 20000 --error-rate 0.01
+"""
+import argparse
+import random
+import time
+
+from arduino_frames import ArduinoFrameEncoder
+from arduino_io import ArduinoFrameReader, ArduinoLineReader, IngestStats
+
+BAUD = 115200
+BITS_PER_BYTE = 10  # 8N1: start and stop bit
+
+
+def make_samples(count):
+    """Synthetic samples as the firmware sends them: ms, VEAB (0.00) and 8 MPR pressures rounded to 0.01 Pa."""
+    return [(i * 10, 0.0, [round(random.uniform(-2000.0, 2000.0), 2) for _ in range(8)]) for i in range(count)]
+
+
+def encode_ascii(samples):
+    return [f"{ms},{veab:.2f},{','.join(f'{p:.2f}' for p in mpr)}\r\n".encode('ascii') for ms, veab, mpr in samples]
+
+
+def encode_binary(samples):
+    encoder = ArduinoFrameEncoder()
+    return [encoder.sample(ms, veab, mpr) for ms, veab, mpr in samples]
+
+
+def corrupt(messages, error_rate, seed):
+    """Flip one bit (never in the terminator) of a random `error_rate` share of the messages."""
+    rng = random.Random(seed)
+    damaged = []
+    for message in messages:
+        if rng.random() < error_rate:
+            message = bytearray(message)
+            message[rng.randrange(len(message) - 1)] ^= 1 << rng.randrange(8)
+            message = bytes(message)
+        damaged.append(message)
+    return damaged
+
+
+def decode(reader_class, messages, batch, prime=b''):
+    """Feed the messages to a reader in batches and return (decoded samples, stats, seconds)."""
+    stats = IngestStats(report_interval=0)
+    reader = reader_class(None, stats)
+    chunks = [b''.join(messages[i:i + batch]) for i in range(0, len(messages), batch)]
+    decoded = []
+    start = time.perf_counter()
+    if prime:
+        reader.parse_chunk(prime)
+    for chunk in chunks:
+        samples, _ = reader.parse_chunk(chunk)
+        decoded += samples
+    return decoded, stats, time.perf_counter() - start
+
+
+def undetected(samples, decoded, binary):
+    """Count decoded samples whose values differ from the sample sent with the same timestamp."""
+    sent = {ms: (veab, mpr) for ms, veab, mpr in samples}
+    wrong = 0
+    for timestamp, veab, mpr in decoded:
+        original = sent.get(int(round(timestamp * 1000)))
+        if original is None:
+            wrong += 1
+            continue
+        tolerance = 1e-3 if binary else 0.0  # float32 rounding of the binary payload
+        if abs(original[0] - veab) > tolerance or any(abs(a - b) > max(tolerance, abs(a) * 1e-6)
+                                                      for a, b in zip(original[1], mpr)):
+            wrong += 1
+    return wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=20000, help="number of samples to encode")
+    parser.add_argument("--rate", type=float, default=100.0, help="Arduino sample rate used for the link budget")
+    parser.add_argument("--batch", type=int, default=10, help="samples per parsed batch (serial read)")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="share of lines/frames with a flipped bit")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    samples = make_samples(args.samples)
+    link_bytes_per_second = BAUD / BITS_PER_BYTE
+
+    print(f"{'protocol':<8}{'bytes/sample':>13}{'link use %':>11}{'decode samples/s':>17}"
+          f"{'delivered':>10}{'detected':>9}{'dropped':>8}{'undetected':>11}")
+    for name, encode, reader_class, binary in (("ascii", encode_ascii, ArduinoLineReader, False),
+                                               ("binary", encode_binary, ArduinoFrameReader, True)):
+        messages = encode(samples)
+        size = sum(len(message) for message in messages) / len(messages)
+        # The frame reader discards what precedes the first delimiter, as after the switch from ASCII
+        prime = b'\x00' if binary else b''
+        decoded, _, seconds = decode(reader_class, messages, args.batch, prime)
+        assert len(decoded) == len(samples)
+
+        damaged, stats, _ = decode(reader_class, corrupt(messages, args.error_rate, args.seed), args.batch, prime)
+        detected = stats.corrupt_frames + stats.parse_errors if binary else stats.parse_errors
+        print(f"{name:<8}{size:>13.1f}{100 * size * args.rate / link_bytes_per_second:>11.1f}"
+              f"{len(samples) / seconds:>17.0f}{len(damaged):>10}{detected:>9}"
+              f"{stats.dropped_frames if binary else '-':>8}{undetected(samples, damaged, binary):>11}")
+
+
+if __name__ == "__main__":
+    main()
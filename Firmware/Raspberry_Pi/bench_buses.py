@@ -0,0 +1,92 @@
+"""
+Scaling of the actuator tick with the number of VEAB boards, on simulated I2C buses.
+
+For 1 to --max-boards boards (one I2C bus each) the script runs the actuator loops of
+SoftRobot twice: once as the single controlActuators loop that writes every bus in turn,
+and once with a worker process per bus (busWorkers). Every actuator plays a sine
+waveform in closed loop, so each tick reads every ADC and writes every DAC. Each simulated
+I2C transaction keeps its bus busy for --i2c-time seconds.
+
+For every run it prints the tick latency (from the scheduled tick to the last DAC
+written), the ticks over budget and the phase spread: how far apart in time the DACs of
+the different boards are written within one tick.
+
+    python bench_buses.py --duration 5 --max-boards 4
+"""
+import argparse
+import time
+
+from controller import ALL_ACTUATORS
+from hardware import SimBackend
+from SoftRobo import SoftRobot
+from waveform import WaveformParameters, WAVE_SINE
+
+
+def run_config(boards, bus_workers, duration, i2c_time, port):
+    """Run the actuator loops of a `boards`-board robot for `duration` seconds and return its statistics."""
+    robot = SoftRobot(i2c=list(range(1, boards + 1)), port=port, backend=SimBackend(i2c_transaction_time=i2c_time),
+                      busWorkers=bus_workers)
+    robot.control_queue.put(("waveform", ALL_ACTUATORS, WaveformParameters(WAVE_SINE, 0.3, 5.0, 0.5, 0.0), False))
+    robot.control_queue.put(("gains", ALL_ACTUATORS, True, 0.5, 5.0, 0.0, 1.0))
+
+    processes = robot.actuatorProcesses()
+    for process in processes:
+        process.start()
+    time.sleep(duration)
+    robot.stopFlag.value = True
+    for process in processes:
+        process.join()
+
+    if bus_workers:
+        budgets = [budget.snapshot() for budget in robot.bus_budgets]
+        # Every bus is written at the end of its own tick
+        completions = [budget["mean_tick_us"] for budget in budgets]
+        loops = [name for name in robot.loop_stats if name.endswith(" worker")]
+    else:
+        budget = robot.control_budget.snapshot()
+        budgets = [budget]
+        # The buses are written one after the other, bus k completes once the later ones are subtracted
+        dac_means = [mean for name, (mean, _) in budget["stages"].items() if name.startswith("dac ")]
+        completions = [budget["mean_tick_us"] - sum(dac_means[k + 1:]) for k in range(len(dac_means))]
+        loops = ["controlActuators"]
+
+    ticks = sum(budget["ticks"] for budget in budgets)
+    result = {
+        "boards": boards,
+        "mode": "per-bus workers" if bus_workers else "single loop",
+        "mean_tick_us": max(budget["mean_tick_us"] for budget in budgets),
+        "p99_tick_us": max((budget["p99_tick_us"] or float("inf")) for budget in budgets),
+        "max_tick_us": max(budget["max_tick_us"] for budget in budgets),
+        "over_budget_percent": 100.0 * sum(budget["over_budget"] for budget in budgets) / ticks if ticks else 0.0,
+        "overruns": sum(robot.loop_stats[name].snapshot()["overruns"] for name in loops),
+        "phase_spread_us": max(completions) - min(completions),
+    }
+    robot.socket_TCP.close()
+    robot.releaseSharedMemory()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per configuration")
+    parser.add_argument("--max-boards", type=int, default=4, help="largest number of boards (one I2C bus each)")
+    parser.add_argument("--i2c-time", type=float, default=0.0005,
+                        help="simulated duration of every I2C transaction, in seconds")
+    parser.add_argument("--port", type=int, default=12500, help="TCP port bound by the robot (no client is needed)")
+    args = parser.parse_args()
+
+    results = []
+    for boards in range(1, args.max_boards + 1):
+        for bus_workers in (False, True):
+            results.append(run_config(boards, bus_workers, args.duration, args.i2c_time, args.port))
+
+    print(f"{'boards':>6}  {'mode':<16}{'mean tick us':>13}{'p99 tick us':>12}{'max tick us':>12}"
+          f"{'over budget %':>14}{'overruns':>9}{'phase spread us':>16}")
+    for result in results:
+        print(f"{result['boards']:>6}  {result['mode']:<16}{result['mean_tick_us']:>13.0f}{result['p99_tick_us']:>12.0f}"
+              f"{result['max_tick_us']:>12.0f}{result['over_budget_percent']:>14.1f}{result['overruns']:>9}"
+              f"{result['phase_spread_us']:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Compare the multiprocess and asyncio runtimes of SoftRobot.
+
+Each runtime is started in a fresh Python process with a loopback client that selects
+binary telemetry and reads it continuously. After the run the script prints CPU time,
+peak resident memory (summed over every process of the runtime) and the jitter of the
+actuator and send loops.
+
+With --schedule every runtime is also run with that scheduling (CPU affinity, SCHED_FIFO,
+nice, see realtime.py), so the jitter with and without it can be compared; --load adds
+busy processes competing for the CPUs, like other services on the Pi.
+
+    python bench_runtime.py --duration 30
+    python bench_runtime.py --backend sim   # on any Linux machine
+    python bench_runtime.py --runtime multiprocess --schedule pi4 --mlockall --load 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from realtime import parse_schedule
+from SoftRobo import SoftRobot
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _loopback_client(port, stop):
+    """Connect like the GUI does, select binary telemetry and discard everything received."""
+    while True:
+        try:
+            client = socket.create_connection(("127.0.0.1", port))
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)  # Server is not listening yet
+    client.sendall(b'MB')
+    client.settimeout(0.5)
+    while not stop.is_set():
+        try:
+            if not client.recv(65536):
+                break
+        except socket.timeout:
+            continue
+        except OSError:
+            break
+    client.close()
+
+
+def _busy_loop(stop):
+    while not stop.is_set():
+        pass
+
+
+def run_child(runtime, duration, port, backend, schedule=None, lock_memory=False):
+    """Run one runtime for `duration` seconds and print its measurements as JSON."""
+    robot = SoftRobot(port=port, backend=backend, schedule=parse_schedule(schedule) if schedule else None,
+                      lockMemory=lock_memory)
+    stop_client = threading.Event()
+    client = threading.Thread(target=_loopback_client, args=(port, stop_client), daemon=True)
+    client.start()
+    robot.waitForClient()
+
+    peak_rss = [0]
+
+    def sample_memory():
+        while not robot.stopFlag.value:
+            pids = [os.getpid()] + [p.pid for p in multiprocessing.active_children()]
+            peak_rss[0] = max(peak_rss[0], sum(_rss_kb(pid) for pid in pids))
+            time.sleep(0.5)
+
+    def stop_after_duration():
+        time.sleep(duration)
+        robot.stopFlag.value = True
+
+    threading.Thread(target=sample_memory, daemon=True).start()
+    threading.Thread(target=stop_after_duration, daemon=True).start()
+
+    if runtime == "asyncio":
+        from async_runtime import AsyncRuntime
+        AsyncRuntime(robot).run()
+    else:
+        robot.createProcesses()
+        robot.run()
+        robot.waitForProcesses()
+    stop_client.set()
+
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = usage_self.ru_utime + usage_self.ru_stime + usage_children.ru_utime + usage_children.ru_stime
+    result = {
+        "runtime": runtime + ("+schedule" if schedule or lock_memory else ""),
+        "scheduling": robot.collectScheduleReports(),
+        "cpu_percent": 100.0 * cpu / duration,
+        "peak_rss_mb": peak_rss[0] / 1024,
+        "loops": {name: stats.snapshot() for name, stats in robot.loop_stats.items()},
+    }
+    robot.releaseSharedMemory()
+    print("RESULT " + json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per runtime")
+    parser.add_argument("--port", type=int, default=12400, help="TCP port used by the benchmark server")
+    parser.add_argument("--runtime", choices=["multiprocess", "asyncio", "both"], default="both")
+    parser.add_argument("--backend", choices=["pi", "sim"], default="pi", help="hardware backend")
+    parser.add_argument("--schedule", default=None,
+                        help="also run every runtime with this schedule (see run_robot.py --schedule)")
+    parser.add_argument("--mlockall", action="store_true", help="lock the memory of the scheduled runs")
+    parser.add_argument("--load", type=int, default=0, help="busy processes running during every measurement")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.runtime, args.duration, args.port, args.backend, args.schedule, args.mlockall)
+        return
+
+    if args.schedule:
+        parse_schedule(args.schedule)  # Fail before running anything
+    runtimes = ["multiprocess", "asyncio"] if args.runtime == "both" else [args.runtime]
+    runs = [(runtime, None) for runtime in runtimes]
+    if args.schedule or args.mlockall:
+        runs += [(runtime, args.schedule or "") for runtime in runtimes]
+
+    stop_load = multiprocessing.Event()
+    load = [multiprocessing.Process(target=_busy_loop, args=(stop_load,), daemon=True) for _ in range(args.load)]
+    for process in load:
+        process.start()
+
+    results = []
+    for i, (runtime, schedule) in enumerate(runs):
+        command = [sys.executable, __file__, "--child", "--runtime", runtime,
+                   "--duration", str(args.duration), "--port", str(args.port + 2 * i), "--backend", args.backend]
+        if schedule is not None:
+            command += ["--schedule", schedule] + (["--mlockall"] if args.mlockall else [])
+        output = subprocess.run(command, capture_output=True, text=True).stdout
+        lines = [line for line in output.splitlines() if line.startswith("RESULT ")]
+        if not lines:
+            print(f"{runtime}: no result\n{output}")
+            continue
+        results.append(json.loads(lines[-1][len("RESULT "):]))
+    stop_load.set()
+    for process in load:
+        process.join()
+
+    for result in results:
+        for report in result["scheduling"]:
+            print(f"{result['runtime']}: {report}")
+    print(f"{'runtime':<22}{'CPU %':>8}{'RSS MB':>9}  {'loop':<18}{'mean jitter us':>15}{'max jitter us':>15}{'overruns':>10}")
+    for result in results:
+        for name, loop in result["loops"].items():
+            print(f"{result['runtime']:<22}{result['cpu_percent']:>8.1f}{result['peak_rss_mb']:>9.1f}  {name:<18}"
+                  f"{loop['mean_jitter_us']:>15.0f}{loop['max_jitter_us']:>15.0f}{loop['overruns']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+from collections import deque
+
+# Arduino millis() wraps around after 2^32 ms (49.7 days)
+ARDUINO_WRAP_S = 2 ** 32 / 1000
+# millis() truncates: a sample stamped m ms was taken during [m, m + 1) ms
+MILLIS_RESOLUTION_S = 0.001
+# Points further than this from the fitted line are outliers (a time stamp corrupted on an ASCII line)...
+OUTLIER_S = 0.1
+# ...unless this many come in a row: the firmware restarted (or the mapping was wrong), start over
+RESTART_POINTS = 10
+# Error reported until the fit has enough points to measure the spread of the serial delay
+INITIAL_ERROR_S = 0.005
+MIN_FIT_POINTS = 3
+
+
+class ArduinoClock:
+    def __init__(self, latency_s=0.0, window_s=60.0, bucket_s=1.0):
+        """
+        Linear mapping of the Arduino's millis() time stamps to the Pi's monotonic clock.
+
+        Each batch read from the serial port gives one point: the Arduino time of its last
+        sample and the Pi time at which the read returned. The difference is the clock
+        offset plus a serial delay that is never negative, so only the point with the
+        lowest delay of every `bucket_s` is kept and the mapping is the line under them
+        (lower envelope): its slope is the drift of the Arduino's resonator (often hundreds
+        of ppm), its height the offset. The spread of the kept points above the line is the
+        delay jitter, which bounds the error of a mapped time stamp.
+
+        Args:
+            latency_s (float): Fixed part of the delay that the points cannot reveal, e.g.
+                the time a sample takes on the wire, subtracted from every mapped time.
+            window_s (float): Seconds of Arduino time the fit covers, so it follows a
+                drift that changes with temperature.
+            bucket_s (float): Seconds of Arduino time per kept point.
+        """
+        self.latency_s = latency_s
+        self.window_s = window_s
+        self.bucket_s = bucket_s
+        self.points = deque()  # (bucket, Arduino time, Pi time - Arduino time) of the lowest delay per bucket
+        self.unwrap_s = 0.0
+        self.last_remote_s = None
+        self.rejected = 0  # Consecutive outliers
+        self.outliers = 0
+        self.restarts = 0
+        self._reset()
+
+    def _reset(self):
+        self.points.clear()
+        self.reference_s = 0.0  # The fitted difference is offset_s + drift * (Arduino time - reference_s)
+        self.offset_s = None
+        self.drift = 0.0
+        self.error = INITIAL_ERROR_S
+
+    @property
+    def synchronized(self):
+        return len(self.points) >= MIN_FIT_POINTS
+
+    @property
+    def drift_ppm(self):
+        """How much faster than the Pi's clock the Arduino's runs, in ppm."""
+        return -self.drift * 1e6
+
+    def add(self, remote_s, local_ns):
+        """
+        Add one point: a sample stamped `remote_s` (Arduino seconds) was read at `local_ns`.
+
+        The point must be the sample that arrived last among those read at local_ns.
+        """
+        remote_s = self._unwrap(remote_s)
+        difference = local_ns / 1e9 - remote_s
+        if self.offset_s is not None and abs(difference - self._difference(remote_s)) > OUTLIER_S:
+            self.rejected += 1
+            self.outliers += 1
+            if self.rejected < RESTART_POINTS:
+                return
+            self._reset()
+            self.restarts += 1
+        self.rejected = 0
+        self.last_remote_s = remote_s
+        bucket = int(remote_s // self.bucket_s)
+        if self.points and bucket <= self.points[-1][0]:
+            if bucket < self.points[-1][0] or difference >= self.points[-1][2]:
+                return  # Not a lower delay than the one already kept for this bucket
+            self.points[-1] = (bucket, remote_s, difference)
+        else:
+            self.points.append((bucket, remote_s, difference))
+            while bucket - self.points[0][0] >= self.window_s / self.bucket_s:
+                self.points.popleft()
+        self._fit()
+
+    def _unwrap(self, remote_s):
+        """Arduino time plus the millis() wraps seen so far."""
+        remote_s += self.unwrap_s
+        if self.last_remote_s is not None and self.last_remote_s - remote_s > ARDUINO_WRAP_S / 2:
+            self.unwrap_s += ARDUINO_WRAP_S
+            remote_s += ARDUINO_WRAP_S
+        return remote_s
+
+    def _difference(self, remote_s):
+        return self.offset_s + self.drift * (remote_s - self.reference_s)
+
+    def _fit(self):
+        points = self.points
+        n = len(points)
+        mean_remote = sum(p[1] for p in points) / n
+        if n >= MIN_FIT_POINTS:
+            mean_difference = sum(p[2] for p in points) / n
+            spread = sum((p[1] - mean_remote) ** 2 for p in points)
+            self.drift = sum((p[1] - mean_remote) * (p[2] - mean_difference) for p in points) / spread
+        residuals = [p[2] - self.drift * (p[1] - mean_remote) for p in points]
+        self.reference_s = mean_remote
+        self.offset_s = min(residuals)  # Through the point with the lowest delay, under every other one
+        if n >= MIN_FIT_POINTS:
+            above = sorted(residual - self.offset_s for residual in residuals)
+            self.error = MILLIS_RESOLUTION_S / 2 + above[n // 2]  # Median delay jitter
+
+    def to_monotonic(self, remote_s):
+        """Pi monotonic time (s) at which the sample stamped `remote_s` was taken, None before the first point."""
+        if self.offset_s is None:
+            return None
+        remote_s += self.unwrap_s
+        if remote_s - self.last_remote_s > ARDUINO_WRAP_S / 2:
+            remote_s -= ARDUINO_WRAP_S  # Sample from before the last wrap
+        remote_s += MILLIS_RESOLUTION_S / 2
+        return remote_s + self._difference(remote_s) - self.latency_s
+
+    def summary(self):
+        if self.offset_s is None:
+            return "Arduino clock: no samples yet"
+        return (f"Arduino clock: {self.drift_ppm:+.0f} ppm, error {self.error * 1000:.2f} ms, "
+                f"{len(self.points)} points, {self.outliers} outliers, {self.restarts} restarts")
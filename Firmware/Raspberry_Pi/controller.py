@@ -0,0 +1,238 @@
+import multiprocessing
+import struct
+
+from scheduler import HISTOGRAM_EDGES_US
+
+# b'K' + actuator (-1 = all), enable (0 = open loop, 1 = closed loop), kp, ki (1/s), kd (s), kf
+CONTROL_GAINS_STRUCT = struct.Struct('<bB2xffff')
+ALL_ACTUATORS = -1
+
+# Full-scale VEAB feedback voltage, as returned by VeabSensor.readSensor(); dividing by it
+# gives the normalized pressure in the same units as the DAC setpoints
+VEAB_FULL_SCALE = 5.0
+
+
+def unpack_gains(payload):
+    """
+    Decode a b'K' payload.
+
+    Returns:
+        tuple: ("gains", actuator, enabled, kp, ki, kd, kf), ready for PressureControl.handle.
+    """
+    actuator, enabled, kp, ki, kd, kf = CONTROL_GAINS_STRUCT.unpack(payload)
+    return ("gains", actuator, bool(enabled), kp, ki, kd, kf)
+
+
+class PIDController:
+    def __init__(self, kp=0.0, ki=0.0, kd=0.0, kf=1.0, output_min=0.0, output_max=1.0, derivative_tau=0.01):
+        """
+        PID controller with feedforward and clamping anti-windup.
+
+        effort = kf * setpoint + kp * error + integral + kd * d(-measurement)/dt
+
+        The derivative acts on the measurement (no kick on setpoint steps) and is low-pass
+        filtered. The integral stops accumulating while the output is saturated in the
+        direction the error pushes it, so it never winds up against the DAC limits.
+
+        Args:
+            kp, ki, kd (float): PID gains, ki in 1/s and kd in s.
+            kf (float): Feedforward gain on the setpoint (1.0 = the open-loop setpoint).
+            output_min, output_max (float): Effort limits (normalized DAC range).
+            derivative_tau (float): Time constant of the derivative filter in seconds.
+        """
+        self.kp, self.ki, self.kd, self.kf = kp, ki, kd, kf
+        self.output_min = output_min
+        self.output_max = output_max
+        self.derivative_tau = derivative_tau
+        self.reset()
+
+    def reset(self):
+        """Forget the integral and derivative state."""
+        self.integral = 0.0
+        self.derivative = 0.0
+        self.last_measurement = None
+        self.error = 0.0
+        self.effort = 0.0
+
+    def set_gains(self, kp, ki, kd, kf):
+        self.kp, self.ki, self.kd, self.kf = kp, ki, kd, kf
+
+    def update(self, setpoint, measurement, dt):
+        """
+        Compute the effort for one tick.
+
+        Args:
+            setpoint (float): Desired normalized pressure.
+            measurement (float): Measured normalized pressure.
+            dt (float): Seconds since the previous update.
+
+        Returns:
+            float: Effort, clamped to the output limits.
+        """
+        error = setpoint - measurement
+        if self.last_measurement is not None and dt > 0:
+            rate = -(measurement - self.last_measurement) / dt
+            self.derivative += (rate - self.derivative) * dt / (self.derivative_tau + dt)
+        self.last_measurement = measurement
+
+        unclamped = self.kf * setpoint + self.kp * error + self.integral + self.kd * self.derivative
+        effort = min(self.output_max, max(self.output_min, unclamped))
+
+        step = self.ki * error * dt
+        if not ((unclamped >= self.output_max and step > 0) or (unclamped <= self.output_min and step < 0)):
+            self.integral += step
+
+        self.error = error
+        self.effort = effort
+        return effort
+
+
+class PressureControl:
+    def __init__(self, n_actuators, actuators=None):
+        """
+        Closed-loop pressure controllers of every actuator, owned by the actuator control loop.
+
+        Actuators start in open loop: the setpoint goes to the DAC unchanged until the client
+        enables the controller with b'K'.
+
+        Args:
+            n_actuators (int): Number of actuators.
+            actuators (list of int): Actuators controlled by this instance (e.g. the ones on
+                the bus of a bus worker), all of them if None. Commands for the others are ignored.
+        """
+        self.controllers = [PIDController() for _ in range(n_actuators)]
+        self.enabled = [False] * n_actuators
+        self.actuators = list(range(n_actuators)) if actuators is None else list(actuators)
+        self.last_ns = None
+
+    @property
+    def active(self):
+        return any(self.enabled)
+
+    def handle(self, command):
+        """Apply a ("gains", actuator, enabled, kp, ki, kd, kf) command."""
+        _, actuator, enabled, kp, ki, kd, kf = command
+        if actuator == ALL_ACTUATORS:
+            targets = range(len(self.controllers))
+        elif 0 <= actuator < len(self.controllers):
+            targets = [actuator]
+        else:
+            raise ValueError(f"Unknown actuator: {actuator}")
+        for i in targets:
+            if i not in self.actuators:
+                continue
+            self.controllers[i].set_gains(kp, ki, kd, kf)
+            if enabled and not self.enabled[i]:
+                self.controllers[i].reset()  # Start from the feedforward, without old integral
+            self.enabled[i] = enabled
+
+    def update(self, setpoints, measurements, now_ns):
+        """
+        Replace the setpoints of the closed-loop actuators with the controller effort.
+
+        Args:
+            setpoints (list): Normalized pressure setpoints, modified in place.
+            measurements (list): Normalized measured pressure of every actuator.
+            now_ns (int): Monotonic time of this tick.
+
+        Returns:
+            list: (actuator, setpoint, measurement, error, effort, integral) of every
+            closed-loop actuator, for telemetry.
+        """
+        dt = 0.0 if self.last_ns is None else (now_ns - self.last_ns) / 1e9
+        self.last_ns = now_ns
+        rows = []
+        for i, controller in enumerate(self.controllers):
+            if not self.enabled[i]:
+                continue
+            setpoint = setpoints[i]
+            setpoints[i] = controller.update(setpoint, measurements[i], dt)
+            rows.append((i, setpoint, measurements[i], controller.error, controller.effort, controller.integral))
+        return rows
+
+
+class TickBudget:
+    def __init__(self, name, stages, budget_ns, edges_us=HISTOGRAM_EDGES_US):
+        """
+        Per-stage latency of a periodic tick, compared against its budget (the period).
+
+        Like LoopStats the counters live in shared memory, so the loop records them in its
+        own process and any other process can print them.
+
+        Args:
+            name (str): Name used in reports.
+            stages (list of str): Stage names, in tick order.
+            budget_ns (int): Time available per tick.
+            edges_us (tuple): Upper bucket edges of the total latency histogram.
+        """
+        self.name = name
+        self.stages = list(stages)
+        self.budget_ns = budget_ns
+        self.edges_ns = [edge * 1000 for edge in edges_us]
+        # per stage: total (ns), max (ns); then ticks, ticks over budget, total/max of the whole tick
+        self.counters = multiprocessing.Array('Q', 2 * len(self.stages) + 4, lock=False)
+        self.histogram = multiprocessing.Array('Q', len(edges_us) + 1, lock=False)
+
+    def record(self, stage_ns, total_ns):
+        """
+        Record one tick (single writer: the loop itself).
+
+        Args:
+            stage_ns (list of int): Duration of every stage.
+            total_ns (int): From the tick deadline to the end of the last stage.
+        """
+        counters = self.counters
+        for i, duration in enumerate(stage_ns):
+            counters[2 * i] += duration
+            counters[2 * i + 1] = max(counters[2 * i + 1], duration)
+        base = 2 * len(self.stages)
+        counters[base] += 1
+        if total_ns > self.budget_ns:
+            counters[base + 1] += 1
+        counters[base + 2] += max(0, total_ns)
+        counters[base + 3] = max(counters[base + 3], total_ns)
+        for i, edge in enumerate(self.edges_ns):
+            if total_ns < edge:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[len(self.edges_ns)] += 1
+
+    def percentile_us(self, fraction):
+        """Upper bucket edge (us) below which `fraction` of the ticks finished, None if unknown."""
+        counts = self.histogram[:]
+        target = fraction * sum(counts)
+        seen = 0
+        for edge, count in zip(self.edges_ns + [None], counts):
+            seen += count
+            if count and seen >= target:
+                return None if edge is None else edge / 1000
+        return None
+
+    def snapshot(self):
+        """Return the current statistics as a dictionary (times in microseconds)."""
+        counters = self.counters[:]
+        base = 2 * len(self.stages)
+        ticks, over, total, maximum = counters[base:base + 4]
+        return {
+            "name": self.name,
+            "ticks": ticks,
+            "over_budget": over,
+            "mean_tick_us": total / ticks / 1000 if ticks else 0.0,
+            "max_tick_us": maximum / 1000,
+            "p99_tick_us": self.percentile_us(0.99),
+            "stages": {name: (counters[2 * i] / ticks / 1000 if ticks else 0.0, counters[2 * i + 1] / 1000)
+                       for i, name in enumerate(self.stages)},
+        }
+
+    def summary(self):
+        """One-line human readable report."""
+        stats = self.snapshot()
+        if not stats["ticks"]:
+            return f"{self.name}: no ticks"
+        stages = ", ".join(f"{name} {mean:.0f}/{maximum:.0f}" for name, (mean, maximum) in stats["stages"].items())
+        p99 = stats["p99_tick_us"]
+        p99 = f"<{p99:.0f}" if p99 is not None else f">={self.edges_ns[-1] / 1000:.0f}"
+        return (f"{self.name}: budget {self.budget_ns / 1000:.0f} us, mean/max us [{stages}], "
+                f"tick {stats['mean_tick_us']:.0f}/{stats['max_tick_us']:.0f} us, p99 {p99} us, "
+                f"{stats['over_budget']} of {stats['ticks']} ticks over budget")
@@ -0,0 +1,125 @@
+import multiprocessing
+import time
+
+_MCP4725_WRITE_FAST_MODE = 0x00  # 2-byte "fast mode" write: only updates the 12-bit DAC register
+_MCP4725_MAX_CODE = 4095
+
+
+def normalized_to_code(value):
+    """Convert a 0..1 setpoint to a 12-bit DAC code (same rounding as adafruit_mcp4725)."""
+    return int(max(0.0, min(1.0, value)) * 4095.0)
+
+
+class DacBusStats:
+    def __init__(self, name):
+        """
+        I2C transaction counters of one bus, kept in shared memory so they can be read
+        from another process while the actuator loop updates them.
+        """
+        self.name = name
+        # transactions, bursts, suppressed writes, total burst latency (ns), max burst latency (ns)
+        self.counters = multiprocessing.Array('Q', 5, lock=False)
+
+    def record_burst(self, transactions, latency_ns):
+        self.counters[0] += transactions
+        self.counters[1] += 1
+        self.counters[3] += latency_ns
+        self.counters[4] = max(self.counters[4], latency_ns)
+
+    def record_suppressed(self, count):
+        self.counters[2] += count
+
+    def snapshot(self):
+        transactions, bursts, suppressed, total_ns, max_ns = self.counters[:]
+        return {
+            "name": self.name,
+            "transactions": transactions,
+            "bursts": bursts,
+            "suppressed": suppressed,
+            "mean_burst_latency_us": total_ns / bursts / 1000 if bursts else 0.0,
+            "max_burst_latency_us": max_ns / 1000,
+        }
+
+    def summary(self):
+        stats = self.snapshot()
+        return (f"{self.name}: {stats['transactions']} I2C writes in {stats['bursts']} bursts, "
+                f"{stats['suppressed']} suppressed, burst latency mean {stats['mean_burst_latency_us']:.0f} us / "
+                f"max {stats['max_burst_latency_us']:.0f} us")
+
+
+class DacBus:
+    def __init__(self, i2c, name="i2c", deadband=0.0):
+        """
+        MCP4725 DACs sharing one I2C bus, written with change-only fast-mode bursts.
+
+        A DAC is only written when its 12-bit code moved by more than the deadband since the
+        last write. All pending writes of the bus are sent back to back while holding the
+        bus lock once, using the 2-byte fast-mode command.
+
+        Args:
+            i2c: busio/ExtendedI2C bus object shared by the DACs.
+            name (str): Name used in reports.
+            deadband (float): Minimum change (normalized 0..1 units) that triggers a write.
+        """
+        self.i2c = i2c
+        self.deadband_codes = int(deadband * _MCP4725_MAX_CODE)
+        self.channels = []  # (actuator index, I2C address)
+        self.last_codes = []
+        self.stats = DacBusStats(name)
+        self._buffer = bytearray(2)
+
+    def add(self, actuator_index, address):
+        """Attach the DAC at `address` that drives actuator `actuator_index`."""
+        self.channels.append((actuator_index, address))
+        self.last_codes.append(None)  # Unknown output, the first write always goes through
+
+    def write(self, values, force=False):
+        """
+        Write the setpoints of this bus' DACs.
+
+        Args:
+            values: Sequence of normalized setpoints indexed by actuator index.
+            force (bool): Write every DAC regardless of the deadband.
+
+        Returns:
+            int: Number of I2C transactions performed.
+        """
+        pending = []
+        for slot, (actuator_index, address) in enumerate(self.channels):
+            code = normalized_to_code(values[actuator_index])
+            last = self.last_codes[slot]
+            if force or last is None or (code != last and abs(code - last) > self.deadband_codes):
+                pending.append((slot, address, code))
+
+        suppressed = len(self.channels) - len(pending)
+        if suppressed:
+            self.stats.record_suppressed(suppressed)
+        if not pending:
+            return 0
+
+        start = time.monotonic_ns()
+        while not self.i2c.try_lock():
+            pass
+        try:
+            for slot, address, code in pending:
+                self._buffer[0] = _MCP4725_WRITE_FAST_MODE | (code >> 8)
+                self._buffer[1] = code & 0xFF
+                self.i2c.writeto(address, self._buffer)
+                self.last_codes[slot] = code
+        finally:
+            self.i2c.unlock()
+        self.stats.record_burst(len(pending), time.monotonic_ns() - start)
+        return len(pending)
+
+
+def build_dac_buses(boards, deadband=0.0):
+    """Group the DACs of all boards by I2C bus, in actuator order."""
+    buses = {}
+    actuator_index = 0
+    for board in boards:
+        if board.channel not in buses:
+            buses[board.channel] = DacBus(board.bus, name=f"i2c-{board.channel}", deadband=deadband)
+        for address in board.dac_addresses:
+            buses[board.channel].add(actuator_index, address)
+            actuator_index += 1
+    return list(buses.values())
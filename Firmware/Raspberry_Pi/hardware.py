@@ -0,0 +1,329 @@
+import fcntl
+import math
+import os
+import random
+import struct
+import termios
+import threading
+import time
+
+from arduino_frames import BINARY_PROTOCOL_OFF, BINARY_PROTOCOL_ON, ArduinoFrameEncoder
+
+try:
+    import serial
+    SERIAL_ERRORS = (serial.SerialException, serial.SerialTimeoutException)
+except ImportError:  # Only the simulated backend is usable without pyserial
+    serial = None
+    SERIAL_ERRORS = ()
+
+
+class PiBackend:
+    """Real hardware: I2C buses, ADS1015, MCP4725, RPi.GPIO and the Arduino on a serial port."""
+    name = "pi"
+
+    def __init__(self):
+        # Imported here so that the simulated backend works on machines without these libraries
+        import RPi.GPIO as GPIO
+        self.gpio = GPIO
+        self._buses = {}
+
+    def i2c_bus(self, channel):
+        """One bus object per I2C channel, shared by every device on it."""
+        if channel not in self._buses:
+            from adafruit_extended_bus import ExtendedI2C as I2C
+            self._buses[channel] = I2C(channel)
+        return self._buses[channel]
+
+    def adc(self, bus, address, rate, gain):
+        """ADS1015 in continuous mode, returns the analog input of channel P0."""
+        import adafruit_ads1x15.ads1015 as ADS
+        from adafruit_ads1x15.analog_in import AnalogIn
+        from adafruit_ads1x15.ads1x15 import Mode
+        ads = ADS.ADS1015(bus, address=address)
+        ads.mode = Mode.CONTINUOUS
+        ads.data_rate = rate
+        ads.gain = gain
+        return AnalogIn(ads, ADS.P0)
+
+    def dac(self, bus, address):
+        import adafruit_mcp4725
+        return adafruit_mcp4725.MCP4725(bus, address=address)
+
+    def open_serial(self, port, baud):
+        """
+        Open the Arduino port without resetting the board on later opens.
+
+        The Arduino resets when DTR goes up, which happens when a port that dropped DTR on
+        close is opened again. Clearing HUPCL keeps DTR up when the port is closed, so only
+        the first open after boot (or after plugging the board in) resets it; a restarted
+        server finds the firmware running and calibrated.
+        """
+        ser = serial.Serial(port, baud, timeout=0.1)
+        attributes = termios.tcgetattr(ser.fd)
+        attributes[2] &= ~termios.HUPCL
+        termios.tcsetattr(ser.fd, termios.TCSANOW, attributes)
+        return ser
+
+
+# --------------------------------- simulation ---------------------------------------
+
+class SimI2CBus:
+    def __init__(self, channel, transaction_time=0.0):
+        """
+        Simulated I2C bus. DAC fast-mode writes are decoded and remembered so that the
+        simulated ADC on the same bus can read the pressure they command.
+
+        Args:
+            channel (int): Bus number, for reports.
+            transaction_time (float): Seconds every write keeps the bus busy.
+        """
+        self.channel = channel
+        self.transaction_time = transaction_time
+        self.dac_codes = {}
+        self.transactions = 0
+        self._lock = threading.Lock()
+
+    def try_lock(self):
+        return self._lock.acquire(blocking=False)
+
+    def unlock(self):
+        self._lock.release()
+
+    def writeto(self, address, buffer, *, start=0, end=None):
+        data = bytes(buffer[start:end])
+        if len(data) >= 2:
+            self.dac_codes[address] = ((data[0] & 0x0F) << 8) | data[1]
+        self.transactions += 1
+        if self.transaction_time:
+            time.sleep(self.transaction_time)
+
+    def pressure(self):
+        """Normalized pressure commanded by the DACs of this bus (0..1)."""
+        if not self.dac_codes:
+            return 0.5
+        return sum(self.dac_codes.values()) / len(self.dac_codes) / 4095.0
+
+
+class SimAnalogIn:
+    def __init__(self, bus, noise=0.002):
+        """Simulated ADS1015 input following the DAC setpoint of its bus, with some noise."""
+        self.bus = bus
+        self.noise = noise
+
+    @property
+    def voltage(self):
+        if self.bus.transaction_time:
+            time.sleep(self.bus.transaction_time)  # The conversion result is read over the bus
+        # readSensor() multiplies by 5, so 0..1 V maps to the 0..5 V regulator range
+        return max(0.0, self.bus.pressure() + random.gauss(0.0, self.noise))
+
+
+class SimMCP4725:
+    def __init__(self, bus, address):
+        self.bus = bus
+        self.address = address
+        self._buffer = bytearray(2)
+
+    @property
+    def normalized_value(self):
+        return self.bus.dac_codes.get(self.address, 0) / 4095.0
+
+    @normalized_value.setter
+    def normalized_value(self, value):
+        code = int(value * 4095.0)
+        self._buffer[0] = code >> 8
+        self._buffer[1] = code & 0xFF
+        while not self.bus.try_lock():
+            pass
+        try:
+            self.bus.writeto(self.address, self._buffer)
+        finally:
+            self.bus.unlock()
+
+
+class SimGPIO:
+    """Stand-in for the RPi.GPIO module that only records pin states."""
+    BCM = "BCM"
+    OUT = "OUT"
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self):
+        self.mode = None
+        self.pins = {}
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction):
+        self.pins[pin] = self.LOW
+
+    def output(self, pin, state):
+        self.pins[pin] = state
+
+    def cleanup(self):
+        self.pins.clear()
+
+
+class SimArduinoSerial:
+    def __init__(self, port, baud, rate=100.0, calibration_time=0.0, error_rate=0.0, clock_drift_ppm=0.0):
+        """
+        Simulated Arduino running Pneumatic.ino.
+
+        A background thread writes "ms,veab,mpr1..mpr8" lines at `rate` Hz into a pipe,
+        so the port is selectable like a real tty. The MPR channels follow the state of
+        the 12 Arduino valves (set with 12-bit binary string commands) with a first-order
+        response and noise, and every command is acknowledged like the firmware does.
+        "B1" switches to COBS framed binary samples and messages, "B0" back to lines.
+
+        Args:
+            port (str): Ignored, kept for signature compatibility with serial.Serial.
+            baud (int): Ignored.
+            rate (float): Sample lines per second.
+            calibration_time (float): Delay before "Calibration complete." and the first sample.
+            error_rate (float): Probability that a line or frame has one byte corrupted.
+            clock_drift_ppm (float): How much faster than the host's clock the simulated
+                millis() runs, like the ceramic resonator of an Arduino Uno.
+        """
+        self.port = port
+        self.baudrate = baud
+        self.rate = rate
+        self.calibration_time = calibration_time
+        self.error_rate = error_rate
+        self.clock_scale = 1.0 + clock_drift_ppm * 1e-6
+        self.binary = False
+        self.encoder = ArduinoFrameEncoder()
+        self.valves = [0] * 12
+        self.pressures = [0.0] * 8
+        self._read_fd, self._write_fd = os.pipe()
+        os.set_blocking(self._write_fd, False)
+        self._write_lock = threading.Lock()
+        self.dropped_lines = 0
+        self.is_open = True
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _emit(self, line):
+        if self.error_rate and random.random() < self.error_rate:
+            line = bytearray(line)
+            line[random.randrange(len(line) - 1)] ^= 1 << random.randrange(8)  # Keep the terminator intact
+            line = bytes(line)
+        try:
+            with self._write_lock:
+                os.write(self._write_fd, line)
+        except BlockingIOError:
+            self.dropped_lines += 1  # Nobody is reading, like a UART overflow
+        except OSError:
+            pass
+
+    def _produce(self):
+        time.sleep(self.calibration_time)
+        self._message("Calibration complete.")
+        start = time.monotonic()
+        period = 1.0 / self.rate
+        tick = 0
+        while self.is_open:
+            tick += 1
+            deadline = start + tick * period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elapsed = time.monotonic() - start
+            for i in range(8):
+                target = 1500.0 if self.valves[i] else 0.0
+                self.pressures[i] += (target - self.pressures[i]) * 0.2
+            values = [p + 5.0 * math.sin(2 * math.pi * 0.5 * elapsed + i) + random.gauss(0.0, 1.0)
+                      for i, p in enumerate(self.pressures)]
+            millis = int(elapsed * self.clock_scale * 1000)
+            if self.binary:
+                self._emit(self.encoder.sample(millis, 0.0, values))
+            else:
+                self._emit(f"{millis},0.00,{','.join(f'{value:.2f}' for value in values)}\r\n".encode('ascii'))
+
+    def _message(self, text):
+        """Emit a status message, as a line or as a binary frame."""
+        self._emit(self.encoder.message(text) if self.binary else text.encode('ascii') + b"\r\n")
+
+    def fileno(self):
+        return self._read_fd
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('i', fcntl.ioctl(self._read_fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, size=1):
+        return os.read(self._read_fd, size)
+
+    def write(self, data):
+        for command in data.decode('ascii', 'replace').split('\n'):
+            command = command.strip()
+            if not command:
+                continue
+            if len(command) == 12 and all(c in '01' for c in command):
+                self.valves = [int(c) for c in command]
+                self._message("Updated valve states from binary string.")
+            elif command.startswith('P'):
+                self._message("Pong " + command[1:])  # Latency probe echo
+            elif command in (BINARY_PROTOCOL_ON.decode(), BINARY_PROTOCOL_OFF.decode()):
+                self.binary = command == BINARY_PROTOCOL_ON.decode()
+                self._message("Binary protocol on." if self.binary else "Binary protocol off.")
+            else:
+                self._message("Invalid input length received.")
+        return len(data)
+
+    def close(self):
+        if not self.is_open:
+            return
+        self.is_open = False
+        self._thread.join(timeout=1.0)
+        os.close(self._read_fd)
+        os.close(self._write_fd)
+
+
+class SimBackend:
+    name = "sim"
+
+    def __init__(self, sample_rate=100.0, i2c_transaction_time=0.0, serial_error_rate=0.0, arduino_boot_time=0.0,
+                 arduino_clock_drift_ppm=0.0):
+        """
+        Simulated hardware so the full server runs on any Linux machine.
+
+        Args:
+            sample_rate (float): Rate of the synthetic Arduino sensor lines, in Hz.
+            i2c_transaction_time (float): Simulated duration of each I2C write, in seconds.
+            serial_error_rate (float): Probability that an Arduino line or frame is corrupted.
+            arduino_boot_time (float): Seconds before the simulated firmware sends anything,
+                like a board that was reset when its port was opened.
+            arduino_clock_drift_ppm (float): Drift of the simulated firmware's millis() clock.
+        """
+        self.arduino_boot_time = arduino_boot_time
+        self.arduino_clock_drift_ppm = arduino_clock_drift_ppm
+        self.sample_rate = sample_rate
+        self.serial_error_rate = serial_error_rate
+        self.i2c_transaction_time = i2c_transaction_time
+        self.gpio = SimGPIO()
+        self._buses = {}
+
+    def i2c_bus(self, channel):
+        if channel not in self._buses:
+            self._buses[channel] = SimI2CBus(channel, self.i2c_transaction_time)
+        return self._buses[channel]
+
+    def adc(self, bus, address, rate, gain):
+        return SimAnalogIn(bus)
+
+    def dac(self, bus, address):
+        return SimMCP4725(bus, address)
+
+    def open_serial(self, port, baud):
+        return SimArduinoSerial(port, baud, rate=self.sample_rate, calibration_time=self.arduino_boot_time,
+                                error_rate=self.serial_error_rate, clock_drift_ppm=self.arduino_clock_drift_ppm)
+
+
+def load_backend(name="pi", **options):
+    """Return the hardware backend called `name` ("pi" or "sim")."""
+    if name == "pi":
+        return PiBackend(**options)
+    if name == "sim":
+        return SimBackend(**options)
+    raise ValueError(f"Unknown hardware backend: {name}")
@@ -0,0 +1,104 @@
+import struct
+
+# Valve sequence upload: b'S' + header + count frames, played back on the Pi's own clock
+SEQUENCE_HEADER = struct.Struct('<IH')  # sequence id, frame count
+SEQUENCE_FRAME = struct.Struct('<IH')   # offset from the sequence start (ms), 16-bit valve mask (valve 1 = MSB)
+MAX_SEQUENCE_FRAMES = 4096
+
+# Latency probe: b'P' + probe id, flags. The Pi echoes it with the time of every stage it passed.
+PING_STRUCT = struct.Struct('<IB')
+PING_ARDUINO = 0x01  # Flag: pass the probe through the serial port and wait for the firmware's answer
+PING_CLOCK = 0x04    # Flag: clock synchronization probe, echoed like the others (the client tells them apart)
+
+
+def sequence_payload_size(data):
+    """
+    Payload size of a b'S' message, from its header.
+
+    Args:
+        data (bytes-like): Bytes received after the type byte (possibly incomplete).
+
+    Returns:
+        int: Payload size in bytes, or None while the header is incomplete.
+
+    Raises:
+        ValueError: If the header announces more than MAX_SEQUENCE_FRAMES frames.
+    """
+    if len(data) < SEQUENCE_HEADER.size:
+        return None
+    _, count = SEQUENCE_HEADER.unpack_from(data)
+    if count > MAX_SEQUENCE_FRAMES:
+        raise ValueError(f"Sequence of {count} frames exceeds {MAX_SEQUENCE_FRAMES}")
+    return SEQUENCE_HEADER.size + count * SEQUENCE_FRAME.size
+
+
+def unpack_sequence(payload):
+    """
+    Decode a b'S' payload.
+
+    Returns:
+        tuple: (sequence id, [(offset_ms, mask), ...]) with the frames sorted by offset.
+    """
+    sequence_id, count = SEQUENCE_HEADER.unpack_from(payload)
+    frames = [SEQUENCE_FRAME.unpack_from(payload, SEQUENCE_HEADER.size + i * SEQUENCE_FRAME.size)
+              for i in range(count)]
+    return sequence_id, sorted(frames, key=lambda frame: frame[0])
+
+
+class CommandParser:
+    def __init__(self, payload_sizes):
+        """
+        Incremental parser for the client-to-Pi command stream.
+
+        Every message is one type byte followed by a payload whose size depends on the
+        type. Bytes that do not start a known message (e.g. the '\\n' some clients append)
+        are skipped, as the original byte-by-byte receive loop did. An invalid header of a
+        variable-length message is different: its payload cannot be told apart from commands,
+        so the parser stops there for good and sets `error`, and the session must be ended.
+
+        Args:
+            payload_sizes (dict): Maps a type byte (e.g. b'C') to its payload size in bytes,
+                or to a function that reads the size from the start of a variable-length
+                payload (see sequence_payload_size).
+        """
+        self.payload_sizes = payload_sizes
+        self.buffer = bytearray()
+        self.skipped_bytes = 0
+        self.error = None  # Why the stream can no longer be parsed, see feed
+
+    def feed(self, data):
+        """
+        Add received bytes and return every complete message.
+
+        Returns:
+            list of tuple: (type byte, payload bytes) in arrival order, up to the invalid
+            message if there is one (`error` is then set and nothing is parsed any more).
+        """
+        if self.error is not None:
+            return []
+        self.buffer += data
+        messages = []
+        offset = 0
+        while offset < len(self.buffer):
+            data_type = bytes(self.buffer[offset:offset + 1])
+            size = self.payload_sizes.get(data_type)
+            if callable(size):
+                try:
+                    size = size(memoryview(self.buffer)[offset + 1:])
+                except ValueError as e:
+                    # The declared payload would be parsed as commands: give up on the stream
+                    self.error = f"invalid {data_type} message: {e}"
+                    self.buffer = bytearray()
+                    return messages
+                if size is None:
+                    break  # Wait for the rest of the header
+            if size is None:
+                self.skipped_bytes += 1
+                offset += 1
+                continue
+            if len(self.buffer) - offset - 1 < size:
+                break  # Wait for the rest of the payload
+            messages.append((data_type, bytes(self.buffer[offset + 1:offset + 1 + size])))
+            offset += 1 + size
+        del self.buffer[:offset]
+        return messages
@@ -0,0 +1,138 @@
+import ctypes
+import os
+from collections import namedtuple
+
+# Scheduling of one loop: allowed CPUs (set, None = unchanged), SCHED_FIFO priority (1-99,
+# None = normal scheduling) and nice level (None = unchanged)
+LoopSchedule = namedtuple("LoopSchedule", "cpus fifo nice")
+
+# Loop names of a schedule: the processes created by SoftRobot.createProcesses (every bus
+# worker is "controlBus") and "main", the process that starts them or runs the asyncio runtime
+LOOP_NAMES = ("read_arduino", "controlActuators", "controlBus", "acquireVeab", "playSequences",
+              "receive", "send", "main")
+
+# 4-core Raspberry Pi: the DAC loops own core 3 and the ADC/serial loops core 2, both at SCHED_FIFO,
+# while the network loops, the parent process, sshd and the rest of the system share cores 0-1
+SCHEDULE_PRESETS = {
+    "pi4": "controlActuators:cpu=3,fifo=80;controlBus:cpu=3,fifo=80;acquireVeab:cpu=2,fifo=70;"
+           "read_arduino:cpu=2,fifo=60;playSequences:cpu=2,fifo=60;receive:cpu=0-1,nice=-5;"
+           "send:cpu=0-1,nice=-5;main:cpu=0-1",
+}
+
+# Nice level tried when SCHED_FIFO is not permitted and the loop has no nice level of its own
+FALLBACK_NICE = -10
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+def parse_cpus(text):
+    """Parse a CPU list such as "3", "0-1" or "0+2-3" into a set of CPU numbers."""
+    cpus = set()
+    for part in text.split("+"):
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def parse_schedule(spec):
+    """
+    Parse a schedule specification.
+
+    The specification is a preset name (see SCHEDULE_PRESETS) or a ';' separated list of
+    "loop:setting,setting" entries, the settings being cpu=<list> (e.g. 3, 0-1 or 0+2),
+    fifo=<1-99> and nice=<-20..19>, e.g. "controlActuators:cpu=3,fifo=80;send:cpu=0-1,nice=5".
+
+    Returns:
+        dict: Loop name -> LoopSchedule.
+
+    Raises:
+        ValueError: If the specification is malformed or names an unknown loop.
+    """
+    spec = SCHEDULE_PRESETS.get(spec, spec)
+    schedule = {}
+    for entry in filter(None, (entry.strip() for entry in spec.split(";"))):
+        name, _, settings = entry.partition(":")
+        if name not in LOOP_NAMES:
+            raise ValueError(f"Unknown loop in schedule: {name} (expected one of {', '.join(LOOP_NAMES)})")
+        values = {"cpus": None, "fifo": None, "nice": None}
+        for setting in filter(None, settings.split(",")):
+            key, _, value = setting.partition("=")
+            if key == "cpu":
+                values["cpus"] = parse_cpus(value)
+            elif key == "fifo":
+                values["fifo"] = int(value)
+                if not 1 <= values["fifo"] <= 99:
+                    raise ValueError(f"SCHED_FIFO priority of {name} must be 1-99")
+            elif key == "nice":
+                values["nice"] = int(value)
+            else:
+                raise ValueError(f"Unknown scheduling setting of {name}: {key}")
+        schedule[name] = LoopSchedule(**values)
+    return schedule
+
+
+def lock_memory():
+    """mlockall(MCL_CURRENT | MCL_FUTURE): keep every page of this process in RAM. Raises OSError."""
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def apply_schedule(name, schedule, lock=False):
+    """
+    Apply the scheduling settings of one loop to the calling process.
+
+    Every setting is tried on its own and a failure (missing privileges, a CPU that does
+    not exist) leaves that setting at its default: the loop still runs, with normal
+    scheduling. When SCHED_FIFO is refused the loop falls back to its nice level, or to
+    FALLBACK_NICE if it has none.
+
+    Args:
+        name (str): Loop name, used in the report.
+        schedule (LoopSchedule): Settings to apply, None for none.
+        lock (bool): Also lock the process memory with mlockall.
+
+    Returns:
+        str: One-line report of the settings that took effect and the ones that did not.
+    """
+    applied = []
+    failed = []
+    if schedule is not None and schedule.cpus:
+        cpus = schedule.cpus & set(range(os.cpu_count() or 1))
+        try:
+            if not cpus:
+                raise OSError(f"CPU {','.join(map(str, sorted(schedule.cpus)))} not present")
+            os.sched_setaffinity(0, cpus)
+            applied.append(f"cpu {','.join(map(str, sorted(os.sched_getaffinity(0))))}")
+        except OSError as e:
+            failed.append(f"cpu ({e.strerror or e})")
+
+    nice = schedule.nice if schedule is not None else None
+    if schedule is not None and schedule.fifo is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(schedule.fifo))
+            applied.append(f"SCHED_FIFO {schedule.fifo}")
+            nice = None  # Meaningless for real-time threads
+        except OSError as e:
+            failed.append(f"SCHED_FIFO {schedule.fifo} ({e.strerror})")
+            if nice is None:
+                nice = FALLBACK_NICE
+    if nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+            applied.append(f"nice {os.getpriority(os.PRIO_PROCESS, 0)}")
+        except OSError as e:
+            failed.append(f"nice {nice} ({e.strerror})")
+
+    if lock:
+        try:
+            lock_memory()
+            applied.append("mlockall")
+        except OSError as e:
+            failed.append(f"mlockall ({e.strerror})")
+
+    report = f"{name} (pid {os.getpid()}): " + (", ".join(applied) or "default scheduling")
+    if failed:
+        report += "; not applied: " + ", ".join(failed)
+    return report
@@ -0,0 +1,208 @@
+import argparse
+import glob
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+# Record types
+RECORD_SAMPLE = 1  # values: Arduino time (s), VEAB, MPR1-8
+RECORD_VALVE = 2   # values: 12 Arduino valve bits, 4 GPIO valve bits, full 16-bit mask
+RECORD_DAC = 3     # values: normalized DAC setpoint of each actuator (up to 10)
+RECORD_NAMES = {RECORD_SAMPLE: "sample", RECORD_VALVE: "valve", RECORD_DAC: "dac"}
+
+N_VALUES = 10
+_HEADER = struct.Struct('<8sIIQ')  # magic, record size, capacity, records written
+_RECORD_COUNT = struct.Struct('<Q')  # records written, at offset 16 of the header
+HEADER_SIZE = 64
+MAGIC = b'SHDREC1\0'
+# type, sequence number, monotonic capture time (ns), values
+RECORD = struct.Struct(f'<B3xIq{N_VALUES}d')
+RECORD_SIZE = RECORD.size
+# RECORD with only its first n values, for records with fewer: the rest stays zero, as preallocated
+_RECORD_PREFIXES = [struct.Struct(f'<B3xIq{n}d') for n in range(N_VALUES + 1)]
+
+
+class Recorder:
+    def __init__(self, base_path, capacity=500000, max_files=10):
+        """
+        Append-only recorder of fixed-size binary records in a memory-mapped file.
+
+        The file is preallocated and mapped once; recording a record is a single
+        struct.pack_into into the mapping, so nothing is allocated or written through a
+        system call per sample and the kernel flushes the pages in the background. When a
+        file is full the recorder rotates to a new one and keeps at most `max_files` (plus
+        the next one, preallocated but still empty).
+
+        Rotation stays off the recording loop: a helper thread always holds the next file
+        preallocated and mapped, so rotating only swaps mappings. The helper also syncs and
+        closes the full file and deletes the oldest ones. It runs little Python between those
+        blocking calls, which release the GIL (mmap.flush, i.e. msync, does not, so a full
+        file is synced with os.fsync instead).
+
+        Files are named "<base_path>.<index>.rec".
+
+        Args:
+            base_path (str): Path prefix of the files, e.g. "/home/pi/records/samples".
+            capacity (int): Records per file.
+            max_files (int): Number of files kept, the oldest is deleted on rotation.
+        """
+        self.base_path = base_path
+        self.capacity = capacity
+        self.max_files = max_files
+        self.sequence = 0
+        self.count = 0
+        directory = os.path.dirname(base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        existing = self.files(base_path)
+        self.index = self._file_index(existing[-1]) + 1 if existing else 0
+        self.file, self.mm = self._prepare(self.index)
+        self.jobs = queue.Queue()  # For the helper thread: ("prepare", index), ("retire", file, index) or None
+        self.spares = queue.Queue()  # (index, file, mmap) prepared by the helper thread
+        self.helper = threading.Thread(target=self._housekeeping, name=f"recorder {os.path.basename(base_path)}",
+                                       daemon=True)
+        self.helper.start()
+        self.jobs.put(("prepare", self.index + 1))
+        self.jobs.put(("retire", None, self.index))  # Retention of the files found at start
+
+    @staticmethod
+    def files(base_path):
+        """Recorded files of a stream, oldest first."""
+        return sorted(glob.glob(f"{glob.escape(base_path)}.*.rec"), key=Recorder._file_index)
+
+    @staticmethod
+    def _file_index(path):
+        return int(path.rsplit('.', 2)[-2])
+
+    def _path(self, index):
+        return f"{self.base_path}.{index:06d}.rec"
+
+    def _prepare(self, index):
+        """Create, preallocate (zero-filled) and map file `index`."""
+        file = open(self._path(index), 'w+b')
+        size = HEADER_SIZE + self.capacity * RECORD_SIZE
+        try:
+            os.posix_fallocate(file.fileno(), 0, size)  # Blocks allocated now rather than at writeback
+        except (AttributeError, OSError):  # Not on this OS or file system
+            file.truncate(size)
+        mm = mmap.mmap(file.fileno(), 0)
+        _HEADER.pack_into(mm, 0, MAGIC, RECORD_SIZE, self.capacity, 0)
+        return file, mm
+
+    def _housekeeping(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                if job[0] == "prepare":
+                    self.spares.put((job[1],) + self._prepare(job[1]))
+                else:
+                    _, file, index = job
+                    if file is not None:
+                        os.fsync(file.fileno())  # The pages written through the closed mapping
+                        file.close()
+                    # Apply the retention policy to the files before `index` (the current one)
+                    for old in self.files(self.base_path):
+                        if self._file_index(old) <= index - self.max_files:
+                            os.remove(old)
+            except Exception as e:
+                print(f"[ERROR] Recorder {self.base_path}: {e}")
+
+    def _rotate(self):
+        # The helper prepares the next file as soon as the previous rotation is done, so it is
+        # only waited for when a whole file was filled in less time than it takes to create one
+        index, file, mm = self.spares.get()
+        self.mm.close()  # Unmapped without msync, the kernel writes the pages back (see _housekeeping)
+        self.jobs.put(("retire", self.file, index))
+        self.jobs.put(("prepare", index + 1))
+        self.index, self.file, self.mm = index, file, mm
+        self.count = 0
+
+    def record(self, record_type, *values):
+        """
+        Append one record. Missing values are stored as 0, at most N_VALUES are kept.
+
+        Returns:
+            int: Sequence number of the record.
+        """
+        if self.count == self.capacity:
+            self._rotate()
+        if len(values) > N_VALUES:
+            values = values[:N_VALUES]
+        sequence = self.sequence
+        _RECORD_PREFIXES[len(values)].pack_into(self.mm, HEADER_SIZE + self.count * RECORD_SIZE,
+                                                record_type, sequence & 0xFFFFFFFF, time.monotonic_ns(), *values)
+        self.count += 1
+        self.sequence += 1
+        _RECORD_COUNT.pack_into(self.mm, 16, self.count)
+        return sequence
+
+    def close(self):
+        """Stop the helper thread, flush and close the current file and delete the unused spare."""
+        self.jobs.put(None)
+        self.helper.join()
+        if self.mm is not None:
+            self.mm.flush()
+            self.mm.close()
+            self.mm = None
+            self.file.close()
+        while not self.spares.empty():
+            index, file, mm = self.spares.get()
+            mm.close()
+            file.close()
+            os.remove(self._path(index))
+
+
+# ----------------------------------- export -----------------------------------------
+
+def load(base_path):
+    """
+    Load every record of a stream into one NumPy structured array.
+
+    Returns:
+        numpy.ndarray: Fields "type", "sequence", "time_ns" and "values" (N_VALUES floats).
+    """
+    import numpy as np
+    dtype = np.dtype([('type', 'u1'), ('pad', 'V3'), ('sequence', '<u4'), ('time_ns', '<i8'),
+                      ('values', '<f8', (N_VALUES,))])
+    blocks = []
+    for path in Recorder.files(base_path):
+        with open(path, 'rb') as f:
+            magic, record_size, _, count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or record_size != RECORD_SIZE:
+            print(f"[ERROR] {path} is not a recorder file, skipped")
+            continue
+        blocks.append(np.fromfile(path, dtype=dtype, count=count, offset=HEADER_SIZE))
+    if not blocks:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(blocks)
+
+
+def export(base_path, output):
+    """Export a stream to .npy (structured array) or .csv, chosen by the output extension."""
+    import numpy as np
+    records = load(base_path)
+    if output.endswith(".npy"):
+        np.save(output, records)
+    else:
+        table = np.column_stack([records['type'], records['sequence'], records['time_ns'], records['values']])
+        header = "type,sequence,time_ns," + ",".join(f"v{i}" for i in range(N_VALUES))
+        np.savetxt(output, table, delimiter=",", header=header, comments="",
+                   fmt=["%d", "%d", "%d"] + ["%.6g"] * N_VALUES)
+    print(f"Exported {len(records)} records to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export records written by the SoftRobot recorder")
+    parser.add_argument("stream", help='stream path prefix, e.g. "records/samples"')
+    parser.add_argument("output", help="output file, .csv or .npy")
+    args = parser.parse_args()
+    export(args.stream, args.output)
+
+
+if __name__ == "__main__":
+    main()
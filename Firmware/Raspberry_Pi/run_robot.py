@@ -1,30 +1,88 @@
+from startup import StartupTimer
+STARTUP = StartupTimer()  # Times the startup phases from the process launch on, including the imports below
+
+import argparse
 from SoftRobo import SoftRobot
+from realtime import parse_schedule
 import numpy as np
 
+STARTUP.since_last("interpreter and imports")
+
 def main():
+    parser = argparse.ArgumentParser(description="Soft haptic display server")
+    parser.add_argument("--runtime", choices=["multiprocess", "asyncio"], default="multiprocess",
+                        help="run the loops as separate processes or as coroutines of one event loop")
+    parser.add_argument("--backend", choices=["pi", "sim"], default="pi",
+                        help="real hardware, or simulated boards, GPIO and Arduino for testing on any Linux machine")
+    parser.add_argument("--record-dir", default=None,
+                        help="record every sample, valve command and DAC setpoint to memory-mapped files in this directory")
+    parser.add_argument("--control-feedback", choices=["adc", "arduino"], default="adc",
+                        help="closed-loop pressure feedback: the VEAB ADC on each board, or the VEAB value sent by the Arduino")
+    parser.add_argument("--bus-workers", action="store_true",
+                        help="write the DACs of every I2C bus from its own process, on a common tick (multiprocess runtime)")
+    parser.add_argument("--veab-rate", type=int, choices=[128, 250, 490, 920, 1600, 2400, 3300], default=490,
+                        help="ADS1015 data rate of the VEAB feedback stream, in samples per second")
+    parser.add_argument("--arduino-protocol", choices=["ascii", "binary"], default="ascii",
+                        help="Arduino samples as text lines, or as COBS framed binary with CRC and sequence numbers "
+                             "(falls back to text if the firmware does not answer)")
+    parser.add_argument("--schedule", default=None,
+                        help="CPU affinity and SCHED_FIFO/nice per loop: 'pi4' for the 4-core Raspberry Pi preset, or "
+                             "e.g. 'controlActuators:cpu=3,fifo=80;send:cpu=0-1,nice=5' (asyncio runtime: 'main:...')")
+    parser.add_argument("--mlockall", action="store_true",
+                        help="lock the memory of every process in RAM (needs CAP_IPC_LOCK or a large enough memlock limit)")
+    parser.add_argument("--exit-on-disconnect", action="store_true",
+                        help="stop the server when the control client disconnects instead of waiting for the next one")
+    args = parser.parse_args()
+    if args.bus_workers and args.runtime == "asyncio":
+        parser.error("--bus-workers needs the multiprocess runtime")
+    try:
+        schedule = parse_schedule(args.schedule) if args.schedule else None
+    except ValueError as e:
+        parser.error(str(e))
+
     # You can directly specify the I2C channels and port here
     i2c = [1]  # Example: use I2C channel 1 (you can modify this as needed)
     port = 12345  # Example: use port 12345 (you can modify this as needed)
 
     print('Using I2C channels: ', i2c)
     print('Using port:', port)
+    print('Using runtime:', args.runtime)
+    print('Using hardware backend:', args.backend)
 
     # Initialize the SoftRobot object
-    robot = SoftRobot(i2c=i2c, port=port)
+    robot = SoftRobot(i2c=i2c, port=port, backend=args.backend, recordDir=args.record_dir,
+                      controlFeedback=args.control_feedback, busWorkers=args.bus_workers, veabRate=args.veab_rate,
+                      arduinoProtocol=args.arduino_protocol, schedule=schedule, lockMemory=args.mlockall,
+                      startup=STARTUP, exitOnDisconnect=args.exit_on_disconnect)
     print(robot.nSensors, " sensor(s) initialized")
+    robot.installSignalHandlers()
 
-    # Wait for client connection
-    robot.waitForClient()
+    # The loops start right away and keep running across client sessions: receive accepts
+    # every client on the control port, and the outputs go to a safe state between two of them
+    print(f"TCP server is running on port {port}. Clients can connect at any time.")
+    if args.runtime == "asyncio":
+        # Run all loops in this process as coroutines
+        from async_runtime import AsyncRuntime
+        print(STARTUP.report("ready for a client"))
+        AsyncRuntime(robot).run()
+    else:
+        # Open the Arduino port first, so the firmware boots while the other loops start
+        robot.startSerialOwner()
+        STARTUP.since_last("serial owner started")
+        # Create and run all necessary processes
+        robot.createProcesses()
+        robot.run()
+        print(STARTUP.report("ready for a client"))
 
-    # Create and run all necessary processes
-    robot.createProcesses()
-    robot.run()
-
-    # Wait for processes to finish
-    robot.waitForProcesses()
+        # Wait for processes to finish, reporting loop timing every 10 s
+        robot.waitForProcesses(reportInterval=10)
+    print(robot.loopReport())
 
     # Close TCP socket
     robot.socket_TCP.close()
 
+    # Free the shared sample store
+    robot.releaseSharedMemory()
+
 if __name__ == "__main__":
     main()
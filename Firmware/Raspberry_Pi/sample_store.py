@@ -0,0 +1,200 @@
+import struct
+import time
+from multiprocessing import shared_memory
+
+# Layout: sequence counter followed by timestamp, VEAB, MPR1-8 and the error of the timestamp
+_SEQUENCE = struct.Struct('<Q')
+_SAMPLE = struct.Struct('<11d')
+_SAMPLE_OFFSET = _SEQUENCE.size
+STORE_SIZE = _SEQUENCE.size + _SAMPLE.size
+
+
+class SampleStore:
+    def __init__(self, name=None, create=True):
+        """
+        Latest sensor sample in shared memory, guarded by a seqlock.
+
+        There must be a single writer. The writer makes the sequence counter odd while it
+        updates the sample and even again when it is done; readers retry until they see the
+        same even counter before and after copying, so they never take a lock and never
+        observe a half-written sample.
+
+        Args:
+            name (str): Name of an existing block to attach to (create=False).
+            create (bool): Create a new shared memory block.
+        """
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=STORE_SIZE)
+        self.buf = self.shm.buf
+        if create:
+            self.buf[:STORE_SIZE] = bytes(STORE_SIZE)
+        self._sequence = _SEQUENCE.unpack_from(self.buf, 0)[0]
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, timestamp, veab_sensor, mpr_sensors, time_error=0.0):
+        """Publish a new sample (single writer only)."""
+        self._sequence += 1  # odd: write in progress
+        _SEQUENCE.pack_into(self.buf, 0, self._sequence)
+        _SAMPLE.pack_into(self.buf, _SAMPLE_OFFSET, timestamp, veab_sensor, *mpr_sensors[:8], time_error)
+        self._sequence += 1  # even: sample is consistent
+        _SEQUENCE.pack_into(self.buf, 0, self._sequence)
+
+    def read(self):
+        """
+        Read a consistent snapshot without locking.
+
+        Returns:
+            tuple: (sequence, timestamp, veab_sensor, [mpr1..mpr8], time_error). The sequence
+            number increases by 2 for every published sample and can be used to detect new data.
+        """
+        while True:
+            before = _SEQUENCE.unpack_from(self.buf, 0)[0]
+            if before & 1:
+                time.sleep(0)  # writer is mid-update, let it finish
+                continue
+            values = _SAMPLE.unpack_from(self.buf, _SAMPLE_OFFSET)
+            if _SEQUENCE.unpack_from(self.buf, 0)[0] == before:
+                return before, values[0], values[1], list(values[2:10]), values[10]
+
+    def close(self):
+        """Detach from the shared memory block."""
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """Destroy the shared memory block (owner only, after every process is done)."""
+        self.shm.unlink()
+
+
+class ValueStore:
+    def __init__(self, n_values, name=None, create=True):
+        """
+        Latest vector of `n_values` doubles in shared memory, with the same single-writer
+        seqlock as SampleStore.
+
+        Args:
+            n_values (int): Number of doubles.
+            name (str): Name of an existing block to attach to (create=False).
+            create (bool): Create a new shared memory block.
+        """
+        self.values = struct.Struct(f'<{n_values}d')
+        self.size = _SEQUENCE.size + self.values.size
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=self.size)
+        self.buf = self.shm.buf
+        if create:
+            self.buf[:self.size] = bytes(self.size)
+        self._sequence = _SEQUENCE.unpack_from(self.buf, 0)[0]
+
+    def write(self, *values):
+        """Publish new values (single writer only)."""
+        self._sequence += 1  # odd: write in progress
+        _SEQUENCE.pack_into(self.buf, 0, self._sequence)
+        self.values.pack_into(self.buf, _SEQUENCE.size, *values)
+        self._sequence += 1  # even: values are consistent
+        _SEQUENCE.pack_into(self.buf, 0, self._sequence)
+
+    def read(self):
+        """
+        Read a consistent snapshot without locking.
+
+        Returns:
+            tuple: (sequence, values). The sequence is 0 until the first write.
+        """
+        while True:
+            before = _SEQUENCE.unpack_from(self.buf, 0)[0]
+            if before & 1:
+                time.sleep(0)  # writer is mid-update, let it finish
+                continue
+            values = self.values.unpack_from(self.buf, _SEQUENCE.size)
+            if _SEQUENCE.unpack_from(self.buf, 0)[0] == before:
+                return before, values
+
+    def close(self):
+        """Detach from the shared memory block."""
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """Destroy the shared memory block (owner only, after every process is done)."""
+        self.shm.unlink()
+
+
+class SampleRing:
+    def __init__(self, capacity, n_values, name=None, create=True):
+        """
+        Ring buffer of timestamped samples in shared memory, for one writer and any number
+        of readers.
+
+        The writer fills slot `count % capacity` and then increments the shared write
+        count, so a slot below the count is always complete. Every reader keeps its own
+        cursor (the count it has read up to) and detects the samples the writer overwrote
+        before it got to them.
+
+        Args:
+            capacity (int): Number of samples kept.
+            n_values (int): Doubles per sample, after the monotonic timestamp (ns).
+            name (str): Name of an existing block to attach to (create=False).
+            create (bool): Create a new shared memory block.
+        """
+        self.capacity = capacity
+        self.row = struct.Struct(f'<q{n_values}d')
+        self.size = _SEQUENCE.size + capacity * self.row.size
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=self.size)
+        self.buf = self.shm.buf
+        if create:
+            self.buf[:self.size] = bytes(self.size)
+        self._count = _SEQUENCE.unpack_from(self.buf, 0)[0]
+
+    def write(self, time_ns, *values):
+        """Append a sample (single writer only)."""
+        self.row.pack_into(self.buf, _SEQUENCE.size + (self._count % self.capacity) * self.row.size, time_ns, *values)
+        self._count += 1
+        _SEQUENCE.pack_into(self.buf, 0, self._count)
+
+    def count(self):
+        """Number of samples written so far."""
+        return _SEQUENCE.unpack_from(self.buf, 0)[0]
+
+    def read_since(self, cursor):
+        """
+        Copy the samples written since `cursor`.
+
+        Args:
+            cursor (int): Count returned by the previous call (0 for the first one).
+
+        Returns:
+            tuple: (new cursor, samples, lost). samples is a list of (index, time_ns,
+            values) and lost the number of samples overwritten before they could be read.
+        """
+        count = self.count()
+        start = max(cursor, count - self.capacity)
+        samples = []
+        for index in range(start, count):
+            time_ns, *values = self.row.unpack_from(self.buf, _SEQUENCE.size + (index % self.capacity) * self.row.size)
+            samples.append((index, time_ns, values))
+        # Samples the writer reached again while they were being copied are not consistent,
+        # nor the one it may be writing now (the count is only advanced after the write)
+        overwritten = self.count() - self.capacity + 1
+        if samples and samples[0][0] < overwritten:
+            samples = [sample for sample in samples if sample[0] >= overwritten]
+        lost = (samples[0][0] if samples else count) - cursor
+        return count, samples, lost
+
+    def latest(self):
+        """Most recent (time_ns, values), or None before the first write."""
+        count = self.count()
+        if not count:
+            return None
+        time_ns, *values = self.row.unpack_from(self.buf, _SEQUENCE.size + ((count - 1) % self.capacity) * self.row.size)
+        return time_ns, values
+
+    def close(self):
+        """Detach from the shared memory block."""
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        """Destroy the shared memory block (owner only, after every process is done)."""
+        self.shm.unlink()
@@ -0,0 +1,140 @@
+import asyncio
+import multiprocessing
+import time
+
+# Catch-up policies when a loop misses one or more deadlines
+SKIP = "skip"    # drop the missed ticks and resume on the next future deadline
+BURST = "burst"  # run the missed ticks back to back until the loop is on schedule again
+
+# Upper bucket edges (microseconds) of the jitter and overrun histograms, the last bucket is open-ended
+HISTOGRAM_EDGES_US = (10, 50, 100, 250, 500, 1000, 2000, 5000, 10000)
+
+
+class LoopStats:
+    def __init__(self, name, edges_us=HISTOGRAM_EDGES_US):
+        """
+        Jitter and overrun statistics of one periodic loop.
+
+        The counters live in shared memory so that the loop can update them from its own
+        process while any other process (e.g. run_robot.py) queries them at runtime.
+
+        Args:
+            name (str): Name used in reports.
+            edges_us (tuple): Upper bucket edges in microseconds.
+        """
+        self.name = name
+        self.edges_ns = [edge * 1000 for edge in edges_us]
+        self.jitter_histogram = multiprocessing.Array('Q', len(edges_us) + 1, lock=False)
+        self.overrun_histogram = multiprocessing.Array('Q', len(edges_us) + 1, lock=False)
+        # ticks, overruns, skipped ticks, max jitter (ns), total jitter (ns)
+        self.counters = multiprocessing.Array('Q', 5, lock=False)
+
+    def _bucket(self, value_ns):
+        for i, edge in enumerate(self.edges_ns):
+            if value_ns < edge:
+                return i
+        return len(self.edges_ns)
+
+    def record(self, jitter_ns, overrun_ns=0, skipped=0):
+        """Record one tick (single writer: the loop itself)."""
+        jitter_ns = max(0, jitter_ns)
+        self.jitter_histogram[self._bucket(jitter_ns)] += 1
+        self.counters[0] += 1
+        self.counters[3] = max(self.counters[3], jitter_ns)
+        self.counters[4] += jitter_ns
+        if overrun_ns > 0:
+            self.overrun_histogram[self._bucket(overrun_ns)] += 1
+            self.counters[1] += 1
+            self.counters[2] += skipped
+
+    def snapshot(self):
+        """Return the current statistics as a dictionary."""
+        ticks, overruns, skipped, max_jitter, total_jitter = self.counters[:]
+        labels = [f"<{edge // 1000}us" for edge in self.edges_ns] + [f">={self.edges_ns[-1] // 1000}us"]
+        return {
+            "name": self.name,
+            "ticks": ticks,
+            "overruns": overruns,
+            "skipped": skipped,
+            "mean_jitter_us": total_jitter / ticks / 1000 if ticks else 0.0,
+            "max_jitter_us": max_jitter / 1000,
+            "jitter_histogram": dict(zip(labels, self.jitter_histogram[:])),
+            "overrun_histogram": dict(zip(labels, self.overrun_histogram[:])),
+        }
+
+    def summary(self):
+        """One-line human readable report."""
+        stats = self.snapshot()
+        histogram = ", ".join(f"{label}: {count}" for label, count in stats["jitter_histogram"].items() if count)
+        return (f"{self.name}: {stats['ticks']} ticks, {stats['overruns']} overruns ({stats['skipped']} skipped), "
+                f"jitter mean {stats['mean_jitter_us']:.0f} us / max {stats['max_jitter_us']:.0f} us [{histogram}]")
+
+
+class PeriodicScheduler:
+    def __init__(self, frequency, policy=SKIP, stats=None, max_burst=10):
+        """
+        Drift-free periodic timing based on absolute deadlines.
+
+        Each deadline is start + n * period on the monotonic clock, so the time spent in
+        the loop body and sleep inaccuracies never accumulate into a rate error.
+
+        Args:
+            frequency (float): Loop frequency in Hz.
+            policy (str): SKIP or BURST, what to do after missing deadlines.
+            stats (LoopStats): Where to record jitter and overruns (optional).
+            max_burst (int): With BURST, the most missed ticks that are caught up before
+                falling back to SKIP.
+        """
+        if policy not in (SKIP, BURST):
+            raise ValueError(f"Unknown catch-up policy: {policy}")
+        self.period_ns = round(1e9 / frequency)
+        self.policy = policy
+        self.stats = stats
+        self.max_burst = max_burst
+        self.next_deadline = None
+        self._overrun_ns = 0
+
+    def start(self, start_ns=None):
+        """Anchor the schedule; the first wait() returns one period after start_ns."""
+        self.next_deadline = time.monotonic_ns() if start_ns is None else start_ns
+
+    def wait(self):
+        """
+        Sleep until the next deadline and record how late the wake-up was.
+
+        Returns:
+            int: Lateness of this tick in nanoseconds.
+        """
+        delay = self._advance()
+        if delay > 0:
+            time.sleep(delay)
+        return self._woke()
+
+    async def wait_async(self):
+        """Same as wait(), for loops running as asyncio coroutines."""
+        delay = self._advance()
+        await asyncio.sleep(delay if delay > 0 else 0)
+        return self._woke()
+
+    def _advance(self):
+        """Move to the next deadline and return the time left until it, in seconds."""
+        if self.next_deadline is None:
+            self.start()
+        self.next_deadline += self.period_ns
+        remaining = self.next_deadline - time.monotonic_ns()
+        self._overrun_ns = 0 if remaining > 0 else -remaining  # the loop body ran past its deadline
+        return remaining / 1e9
+
+    def _woke(self):
+        """Record the wake-up of the current deadline and apply the catch-up policy."""
+        lateness = time.monotonic_ns() - self.next_deadline
+
+        skipped = 0
+        missed = lateness // self.period_ns
+        if missed and (self.policy == SKIP or missed > self.max_burst):
+            skipped = missed
+            self.next_deadline += missed * self.period_ns
+
+        if self.stats is not None:
+            self.stats.record(lateness, self._overrun_ns, skipped)
+        return lateness
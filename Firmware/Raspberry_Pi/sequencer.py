@@ -0,0 +1,64 @@
+import time
+
+
+class SequencePlayer:
+    def __init__(self):
+        """
+        Playback state of one uploaded valve sequence.
+
+        Frame i is due at start + offset_i on the monotonic clock, so the time spent applying
+        a frame and sleep inaccuracies never accumulate over the sequence. Loading a new
+        sequence replaces the one being played.
+        """
+        self.sequence_id = None
+        self.frames = []
+        self.start_ns = None
+        self.index = 0
+        self.generation = 0  # Stop generation the sequence was uploaded in (see SoftRobot.overrideValves)
+
+    def load(self, sequence_id, frames, start_ns=None, generation=0):
+        """
+        Start playing a sequence.
+
+        Args:
+            sequence_id (int): Id chosen by the client, echoed in the frame reports.
+            frames (list of tuple): (offset_ms, mask) sorted by offset.
+            start_ns (int): Monotonic time of offset 0, now by default.
+            generation (int): Stop generation the sequence was uploaded in.
+        """
+        self.sequence_id = sequence_id
+        self.generation = generation
+        self.frames = frames
+        self.start_ns = time.monotonic_ns() if start_ns is None else start_ns
+        self.index = 0
+
+    def stop(self):
+        """Drop the frames that were not played yet. Returns how many were dropped."""
+        remaining = len(self.frames) - self.index
+        self.frames = []
+        self.index = 0
+        return remaining
+
+    @property
+    def playing(self):
+        return self.index < len(self.frames)
+
+    def next_deadline(self):
+        """Monotonic time (ns) of the next frame, or None when nothing is left to play."""
+        if not self.playing:
+            return None
+        return self.start_ns + self.frames[self.index][0] * 1000000
+
+    def take_due(self, now_ns):
+        """
+        Return the frames whose deadline has passed, in order.
+
+        Returns:
+            list of tuple: (frame index, offset_ms, mask).
+        """
+        due = []
+        while self.playing and self.start_ns + self.frames[self.index][0] * 1000000 <= now_ns:
+            offset_ms, mask = self.frames[self.index]
+            due.append((self.index, offset_ms, mask))
+            self.index += 1
+        return due
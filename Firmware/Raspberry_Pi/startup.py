@@ -0,0 +1,54 @@
+import os
+import time
+from contextlib import contextmanager
+
+
+def process_start_time():
+    """time.monotonic() value at which this process was launched (read from /proc, now if unavailable)."""
+    try:
+        with open("/proc/self/stat") as stat:
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as uptime:
+            uptime_s = float(uptime.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return time.monotonic()
+    # Both /proc values count from boot; the monotonic clock too, as long as the system never suspended
+    return time.monotonic() - (uptime_s - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+class StartupTimer:
+    def __init__(self, start=None):
+        """
+        Durations of the startup phases of the server.
+
+        Args:
+            start (float): time.monotonic() value of the launch, the process start time if None.
+        """
+        self.start = process_start_time() if start is None else start
+        self.phases = []
+        self.mark = self.start
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase `name`."""
+        begin = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.monotonic() - begin))
+            self.mark = time.monotonic()
+
+    def since_last(self, name):
+        """Record the time since the end of the previous phase (or the launch) as phase `name`."""
+        now = time.monotonic()
+        self.phases.append((name, now - self.mark))
+        self.mark = now
+
+    def elapsed(self):
+        """Seconds since the launch."""
+        return time.monotonic() - self.start
+
+    def report(self, milestone):
+        """One-line report of every phase so far and of the time at which `milestone` was reached."""
+        phases = ", ".join(f"{name} {duration * 1000:.0f} ms" for name, duration in self.phases)
+        return f"[INFO] Startup: {phases}; {milestone} {self.elapsed() * 1000:.0f} ms after launch"
@@ -0,0 +1,229 @@
+import struct
+
+# Telemetry modes a client can select right after connecting (b'M' + mode byte)
+TELEMETRY_TEXT = b'T'
+TELEMETRY_BINARY = b'B'
+TELEMETRY_MODES = (TELEMETRY_TEXT, TELEMETRY_BINARY)
+
+# Every telemetry time is on the Pi's monotonic clock, in seconds since the telemetry epoch
+# announced by the clock frames; sample times are capture times, not transmission times.
+
+# Binary frame: magic, sequence number, timestamp (s), VEAB, MPR1-8, estimated error of the timestamp (s)
+FRAME_MAGIC = b'\xa5\x5a'
+FRAME_STRUCT = struct.Struct('<2sId9ff')
+FRAME_SIZE = FRAME_STRUCT.size
+
+
+def format_text_sample(timestamp, veab_sensor, mpr_sensors, time_error=0.0):
+    """Format one sample in the original human readable text format, followed by the error of its time."""
+    return (
+        f"Time: {timestamp:.4f}s, VEAB: {veab_sensor:.2f}, "
+        f"MPR1: {mpr_sensors[0]:.2f}, MPR2: {mpr_sensors[1]:.2f}, "
+        f"MPR3: {mpr_sensors[2]:.2f}, MPR4: {mpr_sensors[3]:.2f}, "
+        f"MPR5: {mpr_sensors[4]:.2f}, MPR6: {mpr_sensors[5]:.2f}, "
+        f"MPR7: {mpr_sensors[6]:.2f}, MPR8: {mpr_sensors[7]:.2f}, "
+        f"TimeError: {time_error * 1000:.3f}ms\n"
+    ).encode('utf-8')
+
+
+def pack_binary_sample(sequence, timestamp, veab_sensor, mpr_sensors, time_error=0.0):
+    """Pack one sample into a fixed-size binary frame."""
+    return FRAME_STRUCT.pack(FRAME_MAGIC, sequence & 0xFFFFFFFF, timestamp, veab_sensor, *mpr_sensors[:8], time_error)
+
+
+# Aggregate frame: magic, sequence number, window end time (s), sample count,
+# then min[9], max[9], mean[9], last[9] over the VEAB/MPR1-8 channels
+AGGREGATE_MAGIC = b'\xa5\x5b'
+AGGREGATE_STRUCT = struct.Struct('<2sIdH36f')
+AGGREGATE_SIZE = AGGREGATE_STRUCT.size
+N_CHANNELS = 9
+# Rate request: b'R' + little-endian float32 output rate in Hz (0 = every sample)
+RATE_STRUCT = struct.Struct('<f')
+
+
+class WindowAggregator:
+    def __init__(self, rate):
+        """
+        Min/max/mean/last of every channel over fixed time windows.
+
+        Sending one aggregate per window instead of every raw sample reduces the data
+        rate without hiding short peaks, which plain decimation would drop.
+
+        Args:
+            rate (float): Output rate in windows per second.
+        """
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.sequence = 0
+        self.window_end = None
+        self._reset()
+
+    def _reset(self):
+        self.count = 0
+        self.minimum = [float('inf')] * N_CHANNELS
+        self.maximum = [float('-inf')] * N_CHANNELS
+        self.total = [0.0] * N_CHANNELS
+        self.last = [0.0] * N_CHANNELS
+
+    def add(self, timestamp, veab_sensor, mpr_sensors):
+        """Add one raw sample to the current window."""
+        if self.window_end is None:
+            self.window_end = (timestamp // self.period + 1) * self.period
+        values = (veab_sensor, *mpr_sensors[:8])
+        minimum, maximum, total = self.minimum, self.maximum, self.total
+        for i, value in enumerate(values):
+            if value < minimum[i]:
+                minimum[i] = value
+            if value > maximum[i]:
+                maximum[i] = value
+            total[i] += value
+        self.last = values
+        self.count += 1
+
+    def due(self, timestamp):
+        """True when the current window has ended."""
+        return self.window_end is not None and timestamp >= self.window_end
+
+    def take(self, timestamp):
+        """
+        Close the current window and start the one containing `timestamp`.
+
+        Returns:
+            tuple: (sequence, window end, count, minimum, maximum, mean, last), or None
+            when the window received no samples.
+        """
+        window_end = self.window_end
+        self.window_end = (timestamp // self.period + 1) * self.period
+        if not self.count:
+            return None
+        mean = [value / self.count for value in self.total]
+        aggregate = (self.sequence, window_end, self.count, self.minimum, self.maximum, mean, list(self.last))
+        self.sequence += 1
+        self._reset()
+        return aggregate
+
+
+def pack_binary_aggregate(sequence, window_end, count, minimum, maximum, mean, last):
+    """Pack one window aggregate into a fixed-size binary frame."""
+    return AGGREGATE_STRUCT.pack(AGGREGATE_MAGIC, sequence & 0xFFFFFFFF, window_end, min(count, 0xFFFF),
+                                 *minimum, *maximum, *mean, *last)
+
+
+def format_text_aggregate(sequence, window_end, count, minimum, maximum, mean, last):
+    """Format one window aggregate as a text line: each channel as min/max/mean/last."""
+    names = ["VEAB"] + [f"MPR{i}" for i in range(1, 9)]
+    channels = ", ".join(f"{name}: {minimum[i]:.2f}/{maximum[i]:.2f}/{mean[i]:.2f}/{last[i]:.2f}"
+                         for i, name in enumerate(names))
+    return f"Agg: {window_end:.3f}s, N: {count}, {channels}\n".encode('utf-8')
+
+
+# Sequence frame report: magic, sequence id, frame index, valve mask, scheduled and actual
+# offset from the sequence start (s), telemetry time of the execution (s)
+REPORT_MAGIC = b'\xa5\x5c'
+REPORT_STRUCT = struct.Struct('<2sIHHddd')
+REPORT_SIZE = REPORT_STRUCT.size
+
+
+def pack_binary_report(sequence_id, index, mask, scheduled, actual, timestamp):
+    """Pack the execution report of one sequence frame into a fixed-size binary frame."""
+    return REPORT_STRUCT.pack(REPORT_MAGIC, sequence_id & 0xFFFFFFFF, index, mask, scheduled, actual, timestamp)
+
+
+def format_text_report(sequence_id, index, mask, scheduled, actual, timestamp):
+    """Format the execution report of one sequence frame as a text line."""
+    return (f"Seq: {sequence_id}, Frame: {index}, Valves: {mask:016b}, Scheduled: {scheduled * 1000:.3f}ms, "
+            f"Actual: {actual * 1000:.3f}ms, Time: {timestamp:.3f}s\n").encode('utf-8')
+
+
+# Closed-loop controller frame: magic, sequence number, telemetry time (s), actuator, then
+# setpoint, measurement, error, effort and integral term (normalized pressure units)
+CONTROL_MAGIC = b'\xa5\x5d'
+CONTROL_STRUCT = struct.Struct('<2sIdB3x5f')
+CONTROL_SIZE = CONTROL_STRUCT.size
+
+
+def pack_binary_control(sequence, timestamp, actuator, setpoint, measurement, error, effort, integral):
+    """Pack the controller state of one actuator into a fixed-size binary frame."""
+    return CONTROL_STRUCT.pack(CONTROL_MAGIC, sequence & 0xFFFFFFFF, timestamp, actuator,
+                               setpoint, measurement, error, effort, integral)
+
+
+def format_text_control(sequence, timestamp, actuator, setpoint, measurement, error, effort, integral):
+    """Format the controller state of one actuator as a text line."""
+    return (f"Ctrl: {timestamp:.3f}s, Actuator: {actuator}, Setpoint: {setpoint:.4f}, Measured: {measurement:.4f}, "
+            f"Error: {error:.4f}, Effort: {effort:.4f}, Integral: {integral:.4f}\n").encode('utf-8')
+
+
+# Latency probe echo: magic, probe id, flags, then the Pi's monotonic time (ns) at which the probe
+# was received, written to the serial port, answered by the Arduino and echoed (0 = stage not passed)
+ECHO_MAGIC = b'\xa5\x5e'
+ECHO_STRUCT = struct.Struct('<2sIB3x4q')
+ECHO_SIZE = ECHO_STRUCT.size
+ECHO_ACKED = 0x02  # Flag: the Arduino answered the probe
+
+
+def pack_binary_echo(probe_id, flags, received_ns, written_ns, acked_ns, echoed_ns):
+    """Pack the echo of one latency probe into a fixed-size binary frame."""
+    return ECHO_STRUCT.pack(ECHO_MAGIC, probe_id & 0xFFFFFFFF, flags, received_ns, written_ns, acked_ns, echoed_ns)
+
+
+def format_text_echo(probe_id, flags, received_ns, written_ns, acked_ns, echoed_ns):
+    """Format the echo of one latency probe as a text line."""
+    return (f"Echo: {probe_id}, Flags: {flags}, Received: {received_ns}, Written: {written_ns}, "
+            f"Acked: {acked_ns}, Sent: {echoed_ns}\n").encode('utf-8')
+
+
+# High-rate VEAB stream (sent only to subscribers that enable it with b'V' + 1): magic, index of the
+# first sample, telemetry time of the first sample (s), channel count, sample count, then per sample
+# its time offset from the first one (s, float32) and one voltage per VEAB sensor (float32)
+VEAB_MAGIC = b'\xa5\x5f'
+VEAB_HEADER = struct.Struct('<2sIdBH')
+VEAB_BLOCK_SAMPLES = 64  # Most samples per frame
+# Stream request: b'V' + 1 to receive the VEAB stream, b'V' + 0 to stop it
+
+
+def pack_binary_veab(first_index, first_time, samples):
+    """
+    Pack a block of VEAB samples into one binary frame.
+
+    Args:
+        first_index (int): Ring index of the first sample, consecutive blocks continue it.
+        first_time (float): Telemetry time of the first sample.
+        samples (list of tuple): (telemetry time, [voltage per sensor]).
+    """
+    channels = len(samples[0][1])
+    row = struct.Struct(f'<f{channels}f')
+    frame = bytearray(VEAB_HEADER.pack(VEAB_MAGIC, first_index & 0xFFFFFFFF, first_time, channels, len(samples)))
+    for timestamp, values in samples:
+        frame += row.pack(timestamp - first_time, *values)
+    return bytes(frame)
+
+
+def format_text_veab(first_index, first_time, samples):
+    """Format a block of VEAB samples as one text line per sample."""
+    lines = []
+    for i, (timestamp, values) in enumerate(samples):
+        channels = ", ".join(f"VEAB{n + 1}: {value:.4f}" for n, value in enumerate(values))
+        lines.append(f"Veab: {timestamp:.4f}s, Index: {first_index + i}, {channels}\n")
+    return "".join(lines).encode('utf-8')
+
+
+# Telemetry clock, sent once a second: magic, Pi monotonic time (ns) of telemetry time 0, then how
+# much faster than the Pi's clock the Arduino's runs (ppm), the error of the Arduino sample times (s)
+# and the number of points of that estimate. A client maps its own clock to the Pi's with the
+# latency probe echoes (PING_CLOCK, see protocol.py), whose times are on the same monotonic clock.
+CLOCK_MAGIC = b'\xa5\x60'
+CLOCK_STRUCT = struct.Struct('<2sqffH')
+CLOCK_SIZE = CLOCK_STRUCT.size
+CLOCK_INTERVAL = 1.0  # Seconds between clock frames
+
+
+def pack_binary_clock(epoch_ns, arduino_ppm, arduino_error, arduino_points):
+    """Pack the telemetry clock into a fixed-size binary frame."""
+    return CLOCK_STRUCT.pack(CLOCK_MAGIC, epoch_ns, arduino_ppm, arduino_error, arduino_points)
+
+
+def format_text_clock(epoch_ns, arduino_ppm, arduino_error, arduino_points):
+    """Format the telemetry clock as a text line."""
+    return (f"Clock: {epoch_ns}, Arduino: {arduino_ppm:+.1f}ppm, ArduinoError: {arduino_error * 1000:.3f}ms, "
+            f"Points: {arduino_points}\n").encode('utf-8')
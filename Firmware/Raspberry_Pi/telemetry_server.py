@@ -0,0 +1,369 @@
+import collections
+import selectors
+import socket
+
+from telemetry import (TELEMETRY_TEXT, TELEMETRY_BINARY, TELEMETRY_MODES, RATE_STRUCT, WindowAggregator,
+                       format_text_sample, pack_binary_sample, format_text_aggregate, pack_binary_aggregate,
+                       format_text_report, pack_binary_report, format_text_control, pack_binary_control,
+                       format_text_echo, pack_binary_echo, format_text_veab, pack_binary_veab,
+                       format_text_clock, pack_binary_clock)
+
+
+class Subscriber:
+    def __init__(self, sock, address, max_buffered, mode=TELEMETRY_TEXT, mode_source=None, rate_source=None,
+                 veab_source=None, readable=True):
+        """
+        One telemetry subscriber with its own bounded send buffer.
+
+        Args:
+            sock (socket.socket): Connected, non-blocking socket.
+            address: Peer address, for log messages.
+            max_buffered (int): Frames kept for this subscriber; the oldest is dropped when full.
+            mode (bytes): TELEMETRY_TEXT or TELEMETRY_BINARY.
+            mode_source: Shared value holding the mode instead (control client, whose
+                requests are read by the receive process).
+            rate_source: Shared value holding the output rate instead (same reason).
+            veab_source: Shared value holding whether the VEAB stream is enabled instead.
+            readable (bool): Whether the hub reads mode requests from this socket.
+        """
+        self.sock = sock
+        self.address = address
+        self.buffer = collections.deque(maxlen=max_buffered)
+        self._mode = mode
+        self.mode_source = mode_source
+        self._rate = 0.0  # 0: every sample, otherwise aggregates at this many windows per second
+        self.rate_source = rate_source
+        self._veab = False  # High-rate VEAB stream, off until requested with b'V' + 1
+        self.veab_source = veab_source
+        self.aggregator = None
+        self.next_control_time = 0.0  # Controller frames follow the output rate too
+        self.readable = readable
+        self.in_flight = None  # Partially sent frame, finished before anything else
+        self.request = bytearray()
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def mode(self):
+        return self.mode_source.value if self.mode_source is not None else self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        self._mode = mode
+
+    @property
+    def rate(self):
+        return self.rate_source.value if self.rate_source is not None else self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        self._rate = rate
+
+    @property
+    def veab(self):
+        return bool(self.veab_source.value) if self.veab_source is not None else self._veab
+
+    @veab.setter
+    def veab(self, enabled):
+        self._veab = enabled
+
+    def window_aggregator(self):
+        """Aggregator matching the requested rate, or None for raw samples."""
+        rate = self.rate
+        if rate <= 0:
+            self.aggregator = None
+        elif self.aggregator is None or self.aggregator.rate != rate:
+            self.aggregator = WindowAggregator(rate)
+        return self.aggregator
+
+    def queue(self, payload):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1  # deque drops the oldest frame
+        self.buffer.append(payload)
+
+    def flush(self):
+        """Send as much as the socket accepts without blocking. Returns True when all was sent."""
+        while self.in_flight is not None or self.buffer:
+            if self.in_flight is None:
+                self.in_flight = memoryview(self.buffer.popleft())
+            try:
+                sent = self.sock.send(self.in_flight)
+            except BlockingIOError:
+                return False
+            self.in_flight = self.in_flight[sent:] if sent < len(self.in_flight) else None
+            if self.in_flight is None:
+                self.sent += 1
+        return True
+
+
+class TelemetryHub:
+    def __init__(self, port, max_buffered=256, on_disconnect=None):
+        """
+        Publish/subscribe telemetry server built on a non-blocking selector.
+
+        Any number of clients can connect to `port` and receive every published sample.
+        They may send b'M' + b'T'/b'B' at any time to select the text or binary format, and
+        b'R' + float32 rate to receive min/max/mean/last aggregates at that rate instead of
+        every sample (0 goes back to raw samples). b'V' + 1 adds the high-rate VEAB stream.
+        Each subscriber has a bounded buffer with a drop-oldest policy and sockets are
+        never written in blocking mode, so a slow subscriber cannot stall the others or
+        the loop that publishes.
+
+        Args:
+            port (int): TCP port for telemetry subscribers (None to only serve added sockets).
+            max_buffered (int): Frames buffered per subscriber.
+            on_disconnect (callable): Called with a subscriber that was added with
+                `add_subscriber(..., essential=True)` when it goes away.
+        """
+        self.max_buffered = max_buffered
+        self.on_disconnect = on_disconnect
+        self.selector = selectors.DefaultSelector()
+        self.subscribers = []
+        self.essential = set()
+        self.listener = None
+        self.last_sample_id = None
+        if port is not None:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind(('', port))
+            self.listener.listen()
+            self.listener.setblocking(False)
+            self.selector.register(self.listener, selectors.EVENT_READ)
+            print(f"Telemetry server listening on port {port}")
+
+    def add_subscriber(self, sock, address=None, mode_source=None, rate_source=None, veab_source=None, readable=False,
+                       essential=False):
+        """Publish to an already connected socket (e.g. the control client)."""
+        sock.setblocking(False)
+        subscriber = Subscriber(sock, address, self.max_buffered, mode_source=mode_source, rate_source=rate_source,
+                                veab_source=veab_source, readable=readable)
+        self.subscribers.append(subscriber)
+        if essential:
+            self.essential.add(subscriber)
+        self._update_interest(subscriber)
+        return subscriber
+
+    def remove_subscriber(self, subscriber, reason=""):
+        if subscriber not in self.subscribers:
+            return
+        self.subscribers.remove(subscriber)
+        try:
+            self.selector.unregister(subscriber.sock)
+        except (KeyError, ValueError):
+            pass
+        print(f"[INFO] Telemetry subscriber {subscriber.address} removed {reason}"
+              f"(sent {subscriber.sent}, dropped {subscriber.dropped})")
+        if subscriber in self.essential:
+            self.essential.discard(subscriber)
+            if self.on_disconnect is not None:
+                self.on_disconnect(subscriber)
+        else:
+            subscriber.sock.close()
+
+    def _update_interest(self, subscriber):
+        events = selectors.EVENT_READ if subscriber.readable else 0
+        if subscriber.in_flight is not None or subscriber.buffer:
+            events |= selectors.EVENT_WRITE
+        try:
+            key = self.selector.get_key(subscriber.sock)
+        except KeyError:
+            key = None
+        if key is None:
+            if events:
+                self.selector.register(subscriber.sock, events, subscriber)
+        elif not events:
+            self.selector.unregister(subscriber.sock)
+        elif key.events != events:
+            self.selector.modify(subscriber.sock, events, subscriber)
+
+    def publish(self, sequence, timestamp, veab_sensor, mpr_sensors, sample_id=None, time_error=0.0):
+        """
+        Queue one sample for the raw subscribers and try to send it.
+
+        Raw subscribers get every new sample (as shown by `sample_id`) once, encoded once
+        per format. Aggregating subscribers are fed every sample by aggregate() instead.
+
+        Returns:
+            bool: True if the sample was new.
+        """
+        new_sample = sample_id is None or sample_id != self.last_sample_id
+        self.last_sample_id = sample_id
+        encoded = {}
+        for subscriber in list(self.subscribers):
+            mode = subscriber.mode
+            if subscriber.window_aggregator() is not None:
+                continue
+            if new_sample:
+                if mode not in encoded:
+                    if mode == TELEMETRY_BINARY:
+                        encoded[mode] = pack_binary_sample(sequence, timestamp, veab_sensor, mpr_sensors, time_error)
+                    else:
+                        encoded[mode] = format_text_sample(timestamp, veab_sensor, mpr_sensors, time_error)
+                subscriber.queue(encoded[mode])
+            self._flush(subscriber)
+        return new_sample
+
+    def aggregate(self, samples):
+        """
+        Add samples to the window of every aggregating subscriber and queue an aggregate for
+        each window that ends.
+
+        Args:
+            samples (list of tuple): (timestamp, veab_sensor, mpr_sensors) of every sample since
+                the previous call, in order.
+        """
+        for subscriber in list(self.subscribers):
+            aggregator = subscriber.window_aggregator()
+            if aggregator is None:
+                continue
+            for timestamp, veab_sensor, mpr_sensors in samples:
+                if aggregator.due(timestamp):
+                    aggregate = aggregator.take(timestamp)
+                    if aggregate is not None:
+                        if subscriber.mode == TELEMETRY_BINARY:
+                            subscriber.queue(pack_binary_aggregate(*aggregate))
+                        else:
+                            subscriber.queue(format_text_aggregate(*aggregate))
+                aggregator.add(timestamp, veab_sensor, mpr_sensors)
+            self._flush(subscriber)
+
+    def publish_report(self, *report):
+        """Queue the execution report of one sequence frame for every subscriber, whatever its rate."""
+        encoded = {}
+        for subscriber in list(self.subscribers):
+            mode = subscriber.mode
+            if mode not in encoded:
+                encoded[mode] = pack_binary_report(*report) if mode == TELEMETRY_BINARY else format_text_report(*report)
+            subscriber.queue(encoded[mode])
+            self._flush(subscriber)
+
+    def publish_clock(self, *clock):
+        """Queue the telemetry clock (see CLOCK_STRUCT) for every subscriber."""
+        encoded = {}
+        for subscriber in list(self.subscribers):
+            mode = subscriber.mode
+            if mode not in encoded:
+                encoded[mode] = pack_binary_clock(*clock) if mode == TELEMETRY_BINARY else format_text_clock(*clock)
+            subscriber.queue(encoded[mode])
+            self._flush(subscriber)
+
+    def publish_control(self, sequence, timestamp, rows):
+        """
+        Queue the closed-loop controller state for every subscriber.
+
+        Raw subscribers get every controller tick; aggregating subscribers get the latest
+        state at their output rate.
+
+        Args:
+            sequence (int): Controller tick number.
+            timestamp (float): Telemetry time of the tick.
+            rows (list of tuple): (actuator, setpoint, measurement, error, effort, integral).
+        """
+        encoded = {}
+        for subscriber in list(self.subscribers):
+            rate = subscriber.rate
+            if rate > 0:
+                if timestamp < subscriber.next_control_time:
+                    continue
+                subscriber.next_control_time = timestamp + 1.0 / rate
+            mode = subscriber.mode
+            if mode not in encoded:
+                pack = pack_binary_control if mode == TELEMETRY_BINARY else format_text_control
+                encoded[mode] = b''.join(pack(sequence, timestamp, *row) for row in rows)
+            subscriber.queue(encoded[mode])
+            self._flush(subscriber)
+
+    def publish_echo(self, *echo):
+        """Queue the echo of a latency probe for the control client(s) that sent it."""
+        for subscriber in list(self.essential):
+            if subscriber.mode == TELEMETRY_BINARY:
+                subscriber.queue(pack_binary_echo(*echo))
+            else:
+                subscriber.queue(format_text_echo(*echo))
+            self._flush(subscriber)
+
+    def publish_veab(self, first_index, first_time, samples):
+        """
+        Queue a block of high-rate VEAB samples for the subscribers that enabled the stream.
+
+        Args:
+            first_index (int): Ring index of the first sample.
+            first_time (float): Telemetry time of the first sample.
+            samples (list of tuple): (telemetry time, [voltage per sensor]).
+        """
+        encoded = {}
+        for subscriber in list(self.subscribers):
+            if not subscriber.veab:
+                continue
+            mode = subscriber.mode
+            if mode not in encoded:
+                pack = pack_binary_veab if mode == TELEMETRY_BINARY else format_text_veab
+                encoded[mode] = pack(first_index, first_time, samples)
+            subscriber.queue(encoded[mode])
+            self._flush(subscriber)
+
+    def _flush(self, subscriber):
+        try:
+            subscriber.flush()
+        except OSError as e:
+            self.remove_subscriber(subscriber, f"({e}) ")
+            return
+        self._update_interest(subscriber)
+
+    def poll(self, timeout=0):
+        """Accept new subscribers, read their requests and send buffered frames."""
+        for key, events in self.selector.select(timeout):
+            if key.fileobj is self.listener:
+                self._accept()
+                continue
+            subscriber = key.data
+            if events & selectors.EVENT_READ:
+                self._read_request(subscriber)
+            if events & selectors.EVENT_WRITE and subscriber in self.subscribers:
+                self._flush(subscriber)
+
+    def _accept(self):
+        try:
+            sock, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.add_subscriber(sock, address, readable=True)
+        print(f"Telemetry subscriber {address} connected ({len(self.subscribers)} total)")
+
+    def _read_request(self, subscriber):
+        try:
+            data = subscriber.sock.recv(256)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.remove_subscriber(subscriber, f"({e}) ")
+            return
+        if not data:
+            self.remove_subscriber(subscriber, "(closed) ")
+            return
+        subscriber.request += data
+        request = subscriber.request
+        while len(request) >= 2:
+            if request[:1] == b'M' and bytes(request[1:2]) in TELEMETRY_MODES:
+                subscriber.mode = bytes(request[1:2])
+                del request[:2]
+            elif request[:1] == b'R':
+                if len(request) < 1 + RATE_STRUCT.size:
+                    break  # Wait for the rest of the rate
+                subscriber.rate = max(0.0, RATE_STRUCT.unpack_from(request, 1)[0])
+                del request[:1 + RATE_STRUCT.size]
+            elif request[:1] == b'V':
+                subscriber.veab = request[1] != 0
+                del request[:2]
+            else:
+                del request[:1]  # Unknown byte, resynchronise on the next one
+
+    def close(self):
+        for subscriber in list(self.subscribers):
+            if subscriber not in self.essential:
+                subscriber.sock.close()
+        self.subscribers.clear()
+        if self.listener is not None:
+            self.listener.close()
+        self.selector.close()
@@ -0,0 +1,198 @@
+import math
+import struct
+from collections import namedtuple
+
+# Waveform shapes
+WAVE_OFF = 0       # stop the generator, the actuator goes back to its last 'W' setpoint
+WAVE_SINE = 1
+WAVE_SQUARE = 2
+WAVE_TRIANGLE = 3
+WAVE_CONSTANT = 4
+WAVE_TABLE = 5     # play the table uploaded with b'L' at its own sample rate
+WAVE_SHAPES = (WAVE_OFF, WAVE_SINE, WAVE_SQUARE, WAVE_TRIANGLE, WAVE_CONSTANT, WAVE_TABLE)
+
+WAVE_IMMEDIATE = 0x01  # Flag: apply new parameters now instead of at the end of the current cycle
+ALL_ACTUATORS = -1
+
+# b'G' + shape, actuator (-1 = all), flags, amplitude, frequency (Hz), offset, duration (s, 0 = until stopped).
+# The setpoint is offset + amplitude * shape(t), in normalized DAC units like the 'W' values.
+WAVEFORM_STRUCT = struct.Struct('<BbBxffff')
+# b'L' + actuator (-1 = all), sample count, sample rate (Hz), then count float32 samples
+TABLE_HEADER = struct.Struct('<bxHf')
+TABLE_SAMPLE = struct.Struct('<f')
+
+WaveformParameters = namedtuple("WaveformParameters", "shape amplitude frequency offset duration")
+
+
+def unpack_waveform(payload):
+    """
+    Decode a b'G' payload.
+
+    Returns:
+        tuple: (actuator, WaveformParameters, immediate).
+    """
+    shape, actuator, flags, amplitude, frequency, offset, duration = WAVEFORM_STRUCT.unpack(payload)
+    if shape not in WAVE_SHAPES:
+        raise ValueError(f"Unknown waveform shape: {shape}")
+    return actuator, WaveformParameters(shape, amplitude, frequency, offset, duration), bool(flags & WAVE_IMMEDIATE)
+
+
+def table_payload_size(data):
+    """Payload size of a b'L' message from its header, or None while the header is incomplete."""
+    if len(data) < TABLE_HEADER.size:
+        return None
+    _, count, _ = TABLE_HEADER.unpack_from(data)
+    return TABLE_HEADER.size + count * TABLE_SAMPLE.size
+
+
+def unpack_table(payload):
+    """
+    Decode a b'L' payload.
+
+    Returns:
+        tuple: (actuator, sample rate, list of samples).
+    """
+    actuator, count, rate = TABLE_HEADER.unpack_from(payload)
+    if rate <= 0:
+        raise ValueError(f"Invalid table sample rate: {rate}")
+    samples = list(struct.unpack_from(f'<{count}f', payload, TABLE_HEADER.size))
+    return actuator, rate, samples
+
+
+def _shape_value(shape, phase):
+    """Value of a periodic shape at `phase` (in cycles, 0..1), between -1 and 1."""
+    if shape == WAVE_SINE:
+        return math.sin(2 * math.pi * phase)
+    if shape == WAVE_SQUARE:
+        return 1.0 if phase < 0.5 else -1.0
+    if shape == WAVE_TRIANGLE:
+        return 4.0 * abs(phase - 0.5) - 1.0
+    return 1.0  # WAVE_CONSTANT
+
+
+class WaveformGenerator:
+    def __init__(self, parameters, table=None, table_rate=0.0):
+        """
+        Setpoint generator evaluated once per actuator tick.
+
+        The phase is accumulated from the actual tick times, so a frequency change never
+        makes the output jump. Parameter changes are applied at the end of the current
+        cycle (where every shape is back at its starting value) unless they are immediate.
+
+        Args:
+            parameters (WaveformParameters): Initial parameters.
+            table (list): Samples played by WAVE_TABLE.
+            table_rate (float): Sample rate of the table in Hz.
+        """
+        self.parameters = parameters
+        self.pending = None
+        self.table = table or []
+        self.table_rate = table_rate
+        self.phase = 0.0  # in cycles
+        self.elapsed = 0.0  # seconds since the start
+        self.last_ns = None
+
+    def update(self, parameters, immediate=False):
+        """Change the parameters, at the next cycle boundary unless `immediate`."""
+        periodic = self.parameters.shape not in (WAVE_CONSTANT, WAVE_TABLE) and self.parameters.frequency > 0
+        if immediate or not periodic or parameters.shape != self.parameters.shape:
+            self.parameters = parameters
+            self.pending = None
+        else:
+            self.pending = parameters
+
+    def value(self, now_ns):
+        """
+        Setpoint at `now_ns` (monotonic), advancing the generator from the previous call.
+
+        Returns:
+            float: The setpoint, or None once the duration or the table has run out.
+        """
+        dt = 0.0 if self.last_ns is None else (now_ns - self.last_ns) / 1e9
+        self.last_ns = now_ns
+        self.elapsed += dt
+        parameters = self.parameters
+        if parameters.duration and self.elapsed >= parameters.duration:
+            return None
+
+        if parameters.shape == WAVE_TABLE:
+            position = self.elapsed * self.table_rate
+            index = int(position)
+            if index >= len(self.table) - 1:
+                return None
+            fraction = position - index
+            sample = self.table[index] + (self.table[index + 1] - self.table[index]) * fraction
+            return parameters.offset + parameters.amplitude * sample
+
+        self.phase += parameters.frequency * dt
+        if self.phase >= 1.0:
+            self.phase -= math.floor(self.phase)
+            if self.pending is not None:  # Phase-aligned parameter change
+                parameters = self.parameters = self.pending
+                self.pending = None
+        return parameters.offset + parameters.amplitude * _shape_value(parameters.shape, self.phase)
+
+
+class WaveformBank:
+    def __init__(self, n_actuators):
+        """
+        Waveform generators of every actuator, owned by the actuator control loop.
+
+        Args:
+            n_actuators (int): Number of actuators.
+        """
+        self.n_actuators = n_actuators
+        self.generators = {}  # actuator index -> WaveformGenerator
+        self.tables = {}      # actuator index (or ALL_ACTUATORS) -> (rate, samples)
+
+    def _targets(self, actuator):
+        if actuator == ALL_ACTUATORS:
+            return range(self.n_actuators)
+        if 0 <= actuator < self.n_actuators:
+            return [actuator]
+        raise ValueError(f"Unknown actuator: {actuator}")
+
+    def handle(self, command):
+        """Apply a ("waveform", actuator, parameters, immediate) or ("table", actuator, rate, samples) command."""
+        kind, actuator = command[0], command[1]
+        targets = self._targets(actuator)
+        if kind == "table":
+            _, _, rate, samples = command
+            for i in targets:
+                self.tables[i] = (rate, samples)
+            return
+
+        _, _, parameters, immediate = command
+        for i in targets:
+            if parameters.shape == WAVE_OFF:
+                self.generators.pop(i, None)
+                continue
+            generator = self.generators.get(i)
+            if generator is not None and parameters.shape != WAVE_TABLE:
+                generator.update(parameters, immediate)
+            else:
+                rate, samples = self.tables.get(i, (0.0, []))
+                self.generators[i] = WaveformGenerator(parameters, samples, rate)
+
+    @property
+    def active(self):
+        return bool(self.generators)
+
+    def apply(self, values, now_ns):
+        """
+        Replace the setpoints of the actuators with a running generator.
+
+        Args:
+            values (list): Manual setpoints ('W' values), modified in place.
+            now_ns (int): Monotonic time of this tick.
+
+        Returns:
+            list: `values`, clamped to the 0..1 DAC range where generated.
+        """
+        for i, generator in list(self.generators.items()):
+            value = generator.value(now_ns)
+            if value is None:
+                del self.generators[i]  # Finished, back to the manual setpoint
+                continue
+            values[i] = min(1.0, max(0.0, value))
+        return values
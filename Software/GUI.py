@@ -12,16 +12,28 @@ import csv
 from scipy.interpolate import interp1d
 from scipy.ndimage import gaussian_filter1d
 import threading
+import bisect
 import os
 from PIL import Image, ImageTk  # For loading and displaying images
-from tactile_array import TactileArrayController
+from tactile_array import TactileArrayController, ValveSequence
+from telemetry import Aggregate, VeabBlock, WAVE_OFF, WAVE_SINE, WAVE_SQUARE, WAVE_CONSTANT, WAVE_TABLE
 
 customtkinter.set_appearance_mode("System")  # Modes: "System" (standard), "Dark", "Light"
 customtkinter.set_default_color_theme("dark-blue")  # Themes: "blue" (standard), "green", "dark-blue")
 
+# Send waveform parameters and let the Raspberry Pi synthesize the regulator setpoints at its
+# actuator rate, instead of streaming one 'W' value per GUI tick
+GENERATE_WAVE_ON_PI = True
+
+# Milliseconds between latency probes sent through the actuator queue (0 disables them);
+# type 'latency' in the entry box for the per-stage report
+LATENCY_PROBE_INTERVAL_MS = 1000
+# Seconds of the VEAB stream shown in the Regulator tab
+VEAB_PLOT_SECONDS = 2.0
+
 
 class GUI(customtkinter.CTk):
-    def __init__(self, conn, in_conn=None, regulator_conn=None, actuator_conn=None, sensor_conn=None):
+    def __init__(self, conn, in_conn=None, regulator_conn=None, actuator_conn=None, sensor_conn=None, sample_ring=None):
         super().__init__()
 
         # use the protocol method to catch the window's close event
@@ -32,6 +44,9 @@ class GUI(customtkinter.CTk):
         self.in_queue = in_conn
         self.actuator_queue = actuator_conn
         self.sensor_queue = sensor_conn
+        # Shared-memory ring of raw sample rows (SampleRing) and the count read up to
+        self.sample_ring = sample_ring
+        self.sample_cursor = sample_ring.count() if sample_ring is not None else 0
         self.regulator_queue = regulator_conn
         self.tactile_controller = TactileArrayController(self.actuator_queue)
 
@@ -78,6 +93,8 @@ class GUI(customtkinter.CTk):
 
         # Start checking for messages after 100ms
         self.after(100, self.check_for_messages)
+        if LATENCY_PROBE_INTERVAL_MS:
+            self.after(LATENCY_PROBE_INTERVAL_MS, self.send_latency_probe)
 
     ################# Original Plot Frame ####################
     def plot_frame(self):
@@ -108,6 +125,7 @@ class GUI(customtkinter.CTk):
         self.sensors_tabview.grid(row=0, column=4, rowspan=4, padx=(20, 20), pady=(20, 20), sticky="nsew")
         self.sensors_tabview.add("Sensors 1-4")
         self.sensors_tabview.add("Sensors 5-8")
+        self.sensors_tabview.add("Regulator")
 
         # Tab for Sensors 1-4
         self.sensors_fig_1_4, self.axs_1_4 = plt.subplots(4, 1, figsize=(4, 6))
@@ -151,6 +169,19 @@ class GUI(customtkinter.CTk):
         self.sensors_canvas_5_8 = FigureCanvasTkAgg(self.sensors_fig_5_8, master=self.sensors_tabview.tab("Sensors 5-8"))
         self.sensors_canvas_5_8.get_tk_widget().pack(fill="both", expand=True)
 
+        # Tab for the regulator feedback (VEAB stream at the full ADC rate)
+        self.veab_fig, self.veab_ax = plt.subplots(1, 1, figsize=(4, 6))
+        self.veab_ax.set_title("Regulator Feedback (V)")
+        self.veab_ax.set_xlabel("Time (s)")
+        self.veab_ax.set_ylabel("Voltage (V)")
+        self.veab_ax.set_xlim(0, VEAB_PLOT_SECONDS)
+        self.veab_ax.set_ylim(0, 5)
+        self.veab_lines = []
+        self.veab_canvas = FigureCanvasTkAgg(self.veab_fig, master=self.sensors_tabview.tab("Regulator"))
+        self.veab_canvas.get_tk_widget().pack(fill="both", expand=True)
+        self.veab_time_data = []
+        self.veab_data = []  # One list per VEAB sensor
+
         # Initialize sensor data for all 8 sensors
         self.sensors_time_data = []
         self.mprls_1_data = []
@@ -167,18 +198,33 @@ class GUI(customtkinter.CTk):
 
 
     def update_sensors_plot(self):
-        """Update the sensor plots for sensors 1-4 and sensors 5-8 with the most recent data from the sensor queue."""
+        """Update the sensor plots for sensors 1-4 and sensors 5-8 with the new rows of the sample ring and the aggregates from the sensor queue."""
         try:
-            sensor_data = None  # Initialize sensor_data to None
+            points = []
+
+            veab_blocks = []
 
-            # Drain the queue and get only the most recent data
+            # Every raw sample row written since the last frame (the plot keeps the last 200)
+            if self.sample_ring is not None:
+                self.sample_cursor, rows, _ = self.sample_ring.read_since(self.sample_cursor)
+                points.extend(rows[-200:])
+
+            # Drain the queue: every window aggregate and VEAB block
             while not self.sensor_queue.empty():
                 sensor_data = self.sensor_queue.get()  # Keep reading until the queue is empty
-
-            # If we have new data (after emptying the queue)
-            if sensor_data:
-                # Unpack the data (time, VEAB, MPRLS 1-8)
-                current_time, veab_value, mpr_1, mpr_2, mpr_3, mpr_4, mpr_5, mpr_6, mpr_7, mpr_8 = sensor_data
+                if isinstance(sensor_data, VeabBlock):
+                    veab_blocks.append(sensor_data)
+                elif isinstance(sensor_data, Aggregate):
+                    # Plot the min/max envelope of the window so short peaks stay visible
+                    points.append((sensor_data.time,) + sensor_data.minimum)
+                    points.append((sensor_data.time,) + sensor_data.maximum)
+            if veab_blocks:
+                self.update_veab_plot(veab_blocks)
+
+            # Append every new point (after emptying the queue)
+            for sensor_data in points:
+                # Unpack the data (time, VEAB, MPRLS 1-8; raw samples also carry the error of their time)
+                current_time, veab_value, mpr_1, mpr_2, mpr_3, mpr_4, mpr_5, mpr_6, mpr_7, mpr_8 = sensor_data[:10]
 
                 # Append new data to the respective lists
                 self.sensors_time_data.append(current_time)
@@ -191,6 +237,7 @@ class GUI(customtkinter.CTk):
                 self.mprls_7_data.append(mpr_7)
                 self.mprls_8_data.append(mpr_8)
 
+            if points:
                 # Limit the data lists to the last 200 points (optional)
                 if len(self.sensors_time_data) > 200:
                     self.sensors_time_data = self.sensors_time_data[-200:]
@@ -239,6 +286,31 @@ class GUI(customtkinter.CTk):
         # Call this method again after 20ms
         self.after(20, self.update_sensors_plot)
 
+    def update_veab_plot(self, blocks):
+        """Append VEAB blocks to the regulator plot, which shows the last VEAB_PLOT_SECONDS at the full ADC rate."""
+        for block in blocks:
+            if not self.veab_data:
+                self.veab_data = [[] for _ in block.values[0]]
+                self.veab_lines = [self.veab_ax.plot([], [], label=f"VEAB {i + 1}")[0] for i in range(len(self.veab_data))]
+                if len(self.veab_lines) > 1:
+                    self.veab_ax.legend(loc="upper right")
+            self.veab_time_data.extend(block.times)
+            for values in block.values:
+                for channel, value in zip(self.veab_data, values):
+                    channel.append(value)
+
+        current_time = self.veab_time_data[-1]
+        first = bisect.bisect_left(self.veab_time_data, current_time - VEAB_PLOT_SECONDS)
+        if first:
+            self.veab_time_data = self.veab_time_data[first:]
+            self.veab_data = [channel[first:] for channel in self.veab_data]
+
+        for line, channel in zip(self.veab_lines, self.veab_data):
+            line.set_data(self.veab_time_data, channel)
+        self.veab_ax.set_xlim(max(0, current_time - VEAB_PLOT_SECONDS), max(current_time, VEAB_PLOT_SECONDS))
+        if self.sensors_tabview.get() == "Regulator":
+            self.veab_canvas.draw()
+
 
 
 
@@ -597,6 +669,7 @@ class GUI(customtkinter.CTk):
             b_list = list(self.b_string)
 
             spiral_sequence = [1, 5, 9, 13, 14, 15, 16, 12, 8, 4, 3, 2, 6, 10, 11, 7]
+            sequence = ValveSequence()  # Uploaded in one message and timed by the Pi
 
             if self.auto_channels_switch_1.get() == 1:
                 print("Starting Demo 1")
@@ -604,9 +677,7 @@ class GUI(customtkinter.CTk):
                 for i in spiral_sequence:
                     b_list[i-1] = "1"  # Update the valve state
                     binary_string = ''.join(b_list)  # Convert list back to string
-                    self.actuator_queue.put(("Valve", binary_string))
-                    print(f"Demo 1: Sent binary string {binary_string}")
-                    time.sleep(0.15)
+                    sequence.add(binary_string, 0.15)
             else:
                 print("Stopping Demo 1")
                 b_list = list("1"*16)
@@ -614,12 +685,12 @@ class GUI(customtkinter.CTk):
                 for i in reversed(spiral_sequence):
                     b_list[i-1] = "0"  # Update the valve state
                     binary_string = ''.join(b_list)  # Convert list back to string
-                    self.actuator_queue.put(("Valve", binary_string))
-                    print(f"Demo 1: Sent binary string {binary_string}")
-                    time.sleep(0.15)
+                    sequence.add(binary_string, 0.15)
+                self.actuator_queue.put(("Sequence", sequence.frames))
                 return
 
-            print("Demo 1: Pattern completed.")
+            self.actuator_queue.put(("Sequence", sequence.frames))
+            print("Demo 1: Pattern uploaded.")
 
         threading.Thread(target=demo_pattern, daemon=True).start()
 
@@ -641,6 +712,12 @@ class GUI(customtkinter.CTk):
     
     def run_demo3(self):
         """Run the Demo 3 pattern using binary strings."""
+        if self.auto_channels_switch_3.get() == 0:
+            # Switch turned OFF: stop now, the Pi drops the rest of the cycle being played
+            self.actuator_queue.put(("Valve", '0' * 16))
+            print("Demo 3: All valves turned OFF")
+            return
+
         def demo_pattern():
             print("Starting Demo 3")
 
@@ -654,6 +731,7 @@ class GUI(customtkinter.CTk):
             
             # Turn on all valves while the switch is ON
             while self.auto_channels_switch_3.get() == 1:  # Check if the switch is ON
+                sequence = ValveSequence()  # One cycle, uploaded in one message and timed by the Pi
                 # Pattern 1: Turn on side rows, then middle rows
                 for _ in range(3):
                     # Turn on side rows
@@ -662,9 +740,7 @@ class GUI(customtkinter.CTk):
                     for idx in side_row:
                         b_list[idx - 1] = "1"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    print(f"Demo 3: Sent binary string (side rows ON): {binary_string}")
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn off side rows and turn on middle rows
                     for idx in side_row:
@@ -672,17 +748,10 @@ class GUI(customtkinter.CTk):
                     for idx in middle_row:
                         b_list[idx - 1] = "1"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    print(f"Demo 3: Sent binary string (middle rows ON): {binary_string}")
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn off all valves when the switch is OFF
-                    self.actuator_queue.put(("Valve", '0' * 16))
-                    time.sleep(0.4)
-
-                    # Check if the switch was turned OFF
-                    if self.auto_channels_switch_3.get() == 0:
-                        break
+                    sequence.add('0' * 16, 0.4)
 
                 # Pattern 2: Turn on middle rows, then side rows
                 for _ in range(3):
@@ -692,9 +761,7 @@ class GUI(customtkinter.CTk):
                     for idx in middle_row:
                         b_list[idx - 1] = "1"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    print(f"Demo 3: Sent binary string (middle rows ON): {binary_string}")
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn off middle rows and turn on side rows
                     for idx in middle_row:
@@ -702,26 +769,28 @@ class GUI(customtkinter.CTk):
                     for idx in side_row:
                         b_list[idx - 1] = "1"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    print(f"Demo 3: Sent binary string (side rows ON): {binary_string}")
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn off all valves when the switch is OFF
-                    self.actuator_queue.put(("Valve", '0' * 16))
-                    time.sleep(0.4)
+                    sequence.add('0' * 16, 0.4)
 
-                    # Check if the switch was turned OFF
-                    if self.auto_channels_switch_3.get() == 0:
-                        break
+                self.actuator_queue.put(("Sequence", sequence.frames))
+                self.wait_for_sequence(sequence, self.auto_channels_switch_3)
 
-            # Turn off all valves when the switch is OFF
+            # Stopped by run_demo3 when the switch was turned OFF; stop again in case a cycle
+            # was uploaded after that
             self.actuator_queue.put(("Valve", '0' * 16))
-            print("Demo 3: All valves turned OFF")
 
         threading.Thread(target=demo_pattern, daemon=True).start()
 
     def run_demo4(self):
         """Run the Demo 4 pattern using binary strings."""
+        if self.auto_channels_switch_4.get() == 0:
+            # Switch turned OFF: stop now, the Pi drops the rest of the cycle being played
+            self.actuator_queue.put(("Valve", '0' * 16))
+            print("Demo 4: All valves turned OFF")
+            return
+
         def demo_pattern():
             print("Starting Demo 4")
 
@@ -737,6 +806,7 @@ class GUI(customtkinter.CTk):
             
             # Turn on all valves while the switch is ON
             while self.auto_channels_switch_4.get() == 1:  # Check if the switch is ON
+                sequence = ValveSequence()  # One cycle, uploaded in one message and timed by the Pi
                 # Pattern 1: Turn on side rows, then middle rows
                 for _ in range(3):
 
@@ -750,8 +820,7 @@ class GUI(customtkinter.CTk):
                     for idx in fourth_row:
                         b_list[idx - 1] = "0"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn on 2nd row
                     for idx in first_row:
@@ -763,8 +832,7 @@ class GUI(customtkinter.CTk):
                     for idx in fourth_row:
                         b_list[idx - 1] = "0"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn on 3rd row
                     for idx in first_row:
@@ -776,8 +844,7 @@ class GUI(customtkinter.CTk):
                     for idx in fourth_row:
                         b_list[idx - 1] = "0"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn on 4th row
                     for idx in first_row:
@@ -789,16 +856,10 @@ class GUI(customtkinter.CTk):
                     for idx in fourth_row:
                         b_list[idx - 1] = "1"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn off all valves when the switch is OFF
-                    self.actuator_queue.put(("Valve", '0' * 16))
-                    time.sleep(0.3)
-
-                    # Check if the switch was turned OFF
-                    if self.auto_channels_switch_4.get() == 0:
-                        break
+                    sequence.add('0' * 16, 0.3)
 
                 # Pattern 2: Turn on middle rows, then side rows
                 for _ in range(3):
@@ -813,8 +874,7 @@ class GUI(customtkinter.CTk):
                     for idx in fourth_row:
                         b_list[idx - 1] = "1"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn on 2nd row
                     for idx in first_row:
@@ -826,8 +886,7 @@ class GUI(customtkinter.CTk):
                     for idx in fourth_row:
                         b_list[idx - 1] = "0"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn on 3rd row
                     for idx in first_row:
@@ -839,8 +898,7 @@ class GUI(customtkinter.CTk):
                     for idx in fourth_row:
                         b_list[idx - 1] = "0"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn on 4th row
                     for idx in first_row:
@@ -852,24 +910,27 @@ class GUI(customtkinter.CTk):
                     for idx in fourth_row:
                         b_list[idx - 1] = "0"
                     binary_string = ''.join(b_list)
-                    self.actuator_queue.put(("Valve", binary_string))
-                    time.sleep(delay)
+                    sequence.add(binary_string, delay)
 
                     # Turn off all valves when the switch is OFF
-                    self.actuator_queue.put(("Valve", '0' * 16))
-                    time.sleep(0.3)
+                    sequence.add('0' * 16, 0.3)
 
-                    # Check if the switch was turned OFF
-                    if self.auto_channels_switch_4.get() == 0:
-                        break
+                self.actuator_queue.put(("Sequence", sequence.frames))
+                self.wait_for_sequence(sequence, self.auto_channels_switch_4)
 
-            # Turn off all valves when the switch is OFF
+            # Stopped by run_demo4 when the switch was turned OFF; stop again in case a cycle
+            # was uploaded after that
             self.actuator_queue.put(("Valve", '0' * 16))
-            print("Demo 4: All valves turned OFF")
 
         threading.Thread(target=demo_pattern, daemon=True).start()
 
 
+    def wait_for_sequence(self, sequence, switch):
+        """Wait until an uploaded sequence has played, or until its demo switch is turned OFF."""
+        end_time = time.monotonic() + sequence.duration_ms / 1000
+        while switch.get() == 1 and time.monotonic() < end_time:
+            time.sleep(0.05)
+
     def toggle_relay(self, channel):
         """Toggle the valve state and send the updated binary string."""
         def send_command():
@@ -937,10 +998,15 @@ class GUI(customtkinter.CTk):
                 "   - In the Display Panel, toggle valves ON/OFF or use an Auto pattern.\n"
                 "4) Monitoring Sensors:\n"
                 "   - Check real-time plots in the Sensor Panel.\n"
+                "5) Measuring Latency:\n"
+                "   - Type 'latency' for the GUI-to-valve latency of every stage.\n"
                 "\n"
                 "For more details, see the project documentation!\n\n"
             )
             self.textbox.insert("end", help_text)
+        elif user_input == "latency":
+            # The main process answers with the per-stage latency report
+            self.in_queue.put(("Latency", None))
         else:
             # Handle other commands here if needed
             self.textbox.insert("end", f"You typed: {user_input}\n")
@@ -1068,15 +1134,24 @@ class GUI(customtkinter.CTk):
         if selected_pattern == 0:  # Sine Wave
             pattern_name = "Sine Wave"
             self.wave_function = np.sin
+            self.wave_shape = WAVE_SINE
         elif selected_pattern == 1:  # Triangle Wave
             pattern_name = "Constant Wave"
             self.wave_function = self.generate_constant_wave
+            self.wave_shape = WAVE_CONSTANT
         elif selected_pattern == 2:  # Square Wave
             pattern_name = "Square Wave"
             self.wave_function = self.generate_square_wave
+            self.wave_shape = WAVE_SQUARE
         else:
             pattern_name = "Import Wave"
+            self.wave_shape = WAVE_TABLE
+            if GENERATE_WAVE_ON_PI:
+                # Same mapping as add_data, played by the Pi at the 100 Hz of the interpolated data
+                samples = np.minimum(0.53 + 0.09 * self.interpolated_force, 0.61)
+                self.regulator_queue.put(("WaveTable", samples.tolist(), 100.0))
 
+        self.sent_wave_parameters = None
         self.text_print(f"Playing Pattern: {pattern_name}")
         self.run_wave()  # Start generating the selected wave
         self.in_queue.put(("Play Pattern", pattern_name))
@@ -1142,7 +1217,10 @@ class GUI(customtkinter.CTk):
             if self.stop_flag:
                 wave_value = 0
             # Send wave value and pressure error to Raspberry Pi
-            self.regulator_queue.put(wave_value)
+            if GENERATE_WAVE_ON_PI:
+                self.update_pi_waveform()
+            else:
+                self.regulator_queue.put(wave_value)
             # print(wave_value)
 
             # Append the new data to the plot lists
@@ -1164,8 +1242,24 @@ class GUI(customtkinter.CTk):
         except ValueError:
             tkinter.messagebox.showerror("Invalid input", "An error occurred in the wave generation.")
 
+    def update_pi_waveform(self):
+        """Send the waveform parameters to the Pi when they change, it applies them at the end of the current cycle."""
+        if self.stop_flag:
+            parameters = (WAVE_OFF, 0.0, 0.0, 0.0)
+        elif self.wave_shape == WAVE_TABLE:
+            parameters = (WAVE_TABLE, 1.0, 0.0, 0.0)
+        else:
+            parameters = (self.wave_shape, float(self.vol_slider.get()), float(self.freq_slider.get()), 0.0)
+        if parameters != self.sent_wave_parameters:
+            self.regulator_queue.put(("Waveform",) + parameters)
+            self.sent_wave_parameters = parameters
+
     def pause_pattern(self):
         """Stop updating the plot when the user clicks 'Stop Pattern'."""
+        if GENERATE_WAVE_ON_PI:
+            self.regulator_queue.put(("Waveform", WAVE_OFF, 0.0, 0.0, 0.0))
+            self.sent_wave_parameters = None
+
         # Cancel the scheduled run_wave update
         if hasattr(self, 'wave_job'):
             self.after_cancel(self.wave_job)
@@ -1564,6 +1658,11 @@ class GUI(customtkinter.CTk):
             self.textbox.insert("end", "[GUI Loop] " + text + "\n")  # Insert text at the end with a newline
         self.textbox.yview("end")  # Scroll to the end to make the new text visible
     
+    def send_latency_probe(self):
+        """Queue a timestamped latency probe on the same path as the valve commands."""
+        self.actuator_queue.put(("Ping", time.monotonic_ns()))
+        self.after(LATENCY_PROBE_INTERVAL_MS, self.send_latency_probe)
+
     def check_for_messages(self):
         """Periodically checks for messages from the main process and displays them."""
         try:
@@ -1585,7 +1684,7 @@ class GUI(customtkinter.CTk):
 
 
 
-def launchGUI(conn, in_conn, regulator_conn, actuator_conn, sensor_conn):
-    gui = GUI(conn, in_conn, regulator_conn, actuator_conn, sensor_conn)
+def launchGUI(conn, in_conn, regulator_conn, actuator_conn, sensor_conn, sample_ring=None):
+    gui = GUI(conn, in_conn, regulator_conn, actuator_conn, sensor_conn, sample_ring)
     gui.mainloop()
     exit()
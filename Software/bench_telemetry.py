@@ -0,0 +1,116 @@
+"""
+Compare the telemetry ingest of main.py with the parsers it replaced, without a Raspberry Pi.
+
+The script builds a stream of raw sample lines (text) and sample frames (binary) in the
+Pi's formats, cuts it into chunks as recv would return them and prints, for each format,
+the samples per second decoded by:
+
+- the previous ingest: a str buffer split one line at a time and parse_text_line on
+  each (text), or one struct unpack per frame (binary),
+- the current decoders (TextTelemetryDecoder, BinaryTelemetryDecoder) reading the
+  chunks in place from a preallocated buffer, as receive_sensor_data_from_pi does.
+
+Small chunks are what a slow stream gives (one line per recv at 100 Hz); large ones what
+the socket holds after the receiving thread was held up, e.g. by the GUI.
+
+    python bench_telemetry.py --samples 20000 --chunks 150,1024,65536
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from telemetry import (FRAME_SIZE, FRAME_STRUCT, FRAME_MAGIC, BinaryTelemetryDecoder, TextTelemetryDecoder,
+                       parse_text_line)
+
+
+def make_text(count):
+    """Sample lines as the Pi formats them (format_text_sample)."""
+    lines = []
+    for i in range(count):
+        mpr = ", ".join(f"MPR{n + 1}: {random.uniform(-2000.0, 2000.0):.2f}" for n in range(8))
+        lines.append(f"Time: {i * 0.01:.4f}s, VEAB: {random.uniform(0.0, 10.0):.2f}, {mpr}, "
+                     f"TimeError: {random.uniform(0.0, 2.0):.3f}ms\n")
+    return "".join(lines).encode('utf-8')
+
+
+def make_binary(count):
+    """Sample frames as the Pi packs them (pack_binary_sample)."""
+    return b''.join(FRAME_STRUCT.pack(FRAME_MAGIC, i, i * 0.01, random.uniform(0.0, 10.0),
+                                      *(random.uniform(-2000.0, 2000.0) for _ in range(8)), random.uniform(0.0, 0.002))
+                    for i in range(count))
+
+
+def legacy_text(chunks):
+    """The replaced text ingest: decode, append to a str, split and parse one line at a time."""
+    buffer = ""
+    samples = 0
+    for chunk in chunks:
+        buffer += chunk.decode('utf-8')
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            parse_text_line(line.strip())
+            samples += 1
+    return samples
+
+
+def legacy_binary(chunks):
+    """The replaced binary ingest: one struct unpack and tuple per frame."""
+    buffer = bytearray()
+    samples = 0
+    for chunk in chunks:
+        buffer += chunk
+        offset = 0
+        while len(buffer) - offset >= FRAME_SIZE:
+            _, sequence, *values = FRAME_STRUCT.unpack_from(buffer, offset)
+            offset += FRAME_SIZE
+            samples += 1
+        del buffer[:offset]
+    return samples
+
+
+def current(decoder, chunks):
+    """The current ingest: each chunk copied into a preallocated buffer (as recv_into does) and fed as a view."""
+    buffer = bytearray(max(len(chunk) for chunk in chunks))
+    view = memoryview(buffer)
+    samples = 0
+    for chunk in chunks:
+        view[:len(chunk)] = chunk
+        for block in decoder.feed(view[:len(chunk)]):
+            samples += len(block) if isinstance(block, np.ndarray) else 0
+    return samples
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    samples = function(*args)
+    return samples, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=20000, help="number of samples in the stream")
+    parser.add_argument("--chunks", default="150,1024,65536", help="comma separated recv sizes in bytes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    streams = {"text": make_text(args.samples), "binary": make_binary(args.samples)}
+    print(f"{'format':<8}{'chunk':>7}{'previous samples/s':>20}{'current samples/s':>19}{'speedup':>9}")
+    for name, stream in streams.items():
+        for size in (int(size) for size in args.chunks.split(",")):
+            chunks = [stream[i:i + size] for i in range(0, len(stream), size)]
+            if name == "text":
+                old = timed(legacy_text, chunks)
+                new = timed(current, TextTelemetryDecoder(), chunks)
+            else:
+                old = timed(legacy_binary, chunks)
+                new = timed(current, BinaryTelemetryDecoder(), chunks)
+            assert old[0] == new[0] == args.samples
+            print(f"{name:<8}{size:>7}{args.samples / old[1]:>20.0f}{args.samples / new[1]:>19.0f}"
+                  f"{old[1] / new[1]:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import deque
+
+from latency import PENDING_TIMEOUT_NS
+
+# Probes kept for the estimate (one per CLOCK_SYNC_INTERVAL of main.py, about a minute)
+WINDOW_PROBES = 64
+# Probes needed, and seconds they must span, before the drift is fitted instead of assumed zero
+MIN_DRIFT_PROBES = 8
+MIN_DRIFT_SPAN_NS = 5000000000
+
+
+class ClockSync:
+    def __init__(self, window=WINDOW_PROBES):
+        """
+        Mapping of this PC's monotonic clock to the Pi's, estimated NTP-style from clock probes.
+
+        Each probe gives four times: sent (PC), received and echoed (Pi), echo received (PC).
+        The Pi clock minus the PC clock is then ((received - sent) + (echoed - echo received)) / 2,
+        off by at most half the network delay (round trip minus the time on the Pi), so the
+        probes with the lowest delay are trusted: the offset and the drift between the two
+        crystals are the line through the offsets of the lower-delay half of the window.
+        The main thread and the telemetry thread both use it, so it is locked.
+
+        Args:
+            window (int): Number of probes kept for the estimate.
+        """
+        self.lock = threading.Lock()
+        self.probes = deque(maxlen=window)  # (PC time of the probe, Pi - PC offset, network delay), ns
+        self.pending = {}  # probe id -> sent_ns
+        self.next_id = 0
+        self.lost = 0
+        self.epoch_ns = None  # Pi monotonic time of telemetry time 0, from the clock frames
+        self.clock = None  # Last ClockInfo
+        self.reference_ns = 0  # The fitted offset is offset_ns + drift * (PC time - reference_ns)
+        self.offset_ns = None
+        self.drift = 0.0
+        self.error_ns = None
+
+    @property
+    def synchronized(self):
+        return self.offset_ns is not None
+
+    def start(self, sent_ns=None):
+        """
+        Register a new probe.
+
+        Args:
+            sent_ns (int): PC monotonic time taken right before the probe is written, now by default.
+
+        Returns:
+            int: Id of the probe, to send with pack_clock_probe().
+        """
+        sent_ns = time.monotonic_ns() if sent_ns is None else sent_ns
+        with self.lock:
+            for probe_id, pending_ns in list(self.pending.items()):
+                if sent_ns - pending_ns > PENDING_TIMEOUT_NS:
+                    del self.pending[probe_id]
+                    self.lost += 1
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+            self.pending[self.next_id] = sent_ns
+            return self.next_id
+
+    def echoed(self, echo, received_ns=None):
+        """
+        Complete a probe with its PingEcho.
+
+        Args:
+            echo (PingEcho): Echo decoded from the telemetry.
+            received_ns (int): When the bytes of the echo were read from the socket, now by default.
+        """
+        received_ns = time.monotonic_ns() if received_ns is None else received_ns
+        with self.lock:
+            sent_ns = self.pending.pop(echo.probe_id, None)
+            if sent_ns is None:
+                return  # Unknown or expired probe
+            delay_ns = (received_ns - sent_ns) - (echo.echoed_ns - echo.received_ns)
+            offset_ns = ((echo.received_ns - sent_ns) + (echo.echoed_ns - received_ns)) / 2
+            self.probes.append(((sent_ns + received_ns) / 2, offset_ns, max(0, delay_ns)))
+            self._fit()
+
+    def _fit(self):
+        best = sorted(self.probes, key=lambda probe: probe[2])[:max(1, len(self.probes) // 2)]
+        n = len(best)
+        mean_time = sum(p[0] for p in best) / n
+        mean_offset = sum(p[1] for p in best) / n
+        spread = sum((p[0] - mean_time) ** 2 for p in best)
+        if n >= MIN_DRIFT_PROBES // 2 and len(self.probes) >= MIN_DRIFT_PROBES and \
+                max(p[0] for p in best) - min(p[0] for p in best) >= MIN_DRIFT_SPAN_NS:
+            self.drift = sum((p[0] - mean_time) * (p[1] - mean_offset) for p in best) / spread
+            self.reference_ns = mean_time
+            self.offset_ns = mean_offset
+        else:
+            self.drift = 0.0
+            self.reference_ns, self.offset_ns, _ = best[0]  # The probe with the lowest delay
+        residual = (sum((p[1] - self._offset(p[0])) ** 2 for p in best) / n) ** 0.5
+        self.error_ns = best[0][2] / 2 + residual
+
+    def _offset(self, pc_ns):
+        return self.offset_ns + self.drift * (pc_ns - self.reference_ns)
+
+    def set_clock(self, clock):
+        """Record the telemetry clock (ClockInfo) announced by the Pi."""
+        with self.lock:
+            self.clock = clock
+            self.epoch_ns = clock.epoch_ns
+
+    def to_pi_ns(self, pc_ns):
+        """Pi monotonic time (ns) of a PC monotonic time, None before the first probe."""
+        with self.lock:
+            return None if self.offset_ns is None else pc_ns + self._offset(pc_ns)
+
+    def to_pc_ns(self, pi_ns):
+        """PC monotonic time (ns) of a Pi monotonic time, None before the first probe."""
+        with self.lock:
+            return None if self.offset_ns is None else pi_ns - self._offset(pi_ns - self.offset_ns)
+
+    def telemetry_time(self, pc_ns=None):
+        """
+        Telemetry time of a PC event, comparable with the times of the samples.
+
+        Args:
+            pc_ns (int): PC monotonic time of the event, now by default.
+
+        Returns:
+            tuple: (telemetry time in s, error in s), (None, None) until both a probe and a
+                clock frame have been received.
+        """
+        pc_ns = time.monotonic_ns() if pc_ns is None else pc_ns
+        with self.lock:
+            if self.offset_ns is None or self.epoch_ns is None:
+                return None, None
+            return (pc_ns + self._offset(pc_ns) - self.epoch_ns) / 1e9, self.error_ns / 1e9
+
+    def report(self):
+        """One-line summary of the PC-Pi mapping and of the Arduino one reported by the Pi."""
+        with self.lock:
+            if self.offset_ns is None:
+                text = "[INFO] Clock: no probe echoed yet"
+            else:
+                text = (f"[INFO] Clock: Pi - PC {self._offset(time.monotonic_ns()) / 1e9:+.6f} s, "
+                        f"drift {self.drift * 1e6:+.1f} ppm, error {self.error_ns / 1e6:.3f} ms, "
+                        f"min delay {min(p[2] for p in self.probes) / 1e6:.3f} ms, "
+                        f"{len(self.probes)} probes, {self.lost} lost")
+            if self.clock is not None:
+                text += (f"; Arduino {self.clock.arduino_ppm:+.0f} ppm, error "
+                         f"{self.clock.arduino_error * 1000:.2f} ms ({self.clock.arduino_points} points)")
+            return text
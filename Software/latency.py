@@ -0,0 +1,167 @@
+import math
+import threading
+import time
+
+from telemetry import ECHO_ACKED
+
+# Stages of a latency probe, in the order it passes them. The PC stages use this machine's
+# monotonic clock, the Pi stages the Pi's; the network stage is half of the round trip
+# without the time the probe spent on the Pi, so no clock synchronisation is needed.
+STAGES = (
+    ("gui_queue", "GUI queue -> main thread"),
+    ("main_thread", "main thread -> socket"),
+    ("network", "network (one way)"),
+    ("pi_serial", "Pi receive -> serial write"),
+    ("arduino_ack", "serial write -> Arduino ack"),
+    ("pi_echo", "Pi echo (send loop)"),
+    ("click_to_ack", "GUI click -> Arduino ack"),
+    ("round_trip", "round trip"),
+)
+PENDING_TIMEOUT_NS = 10000000000  # Probes without an echo after 10 s are counted as lost
+
+
+class LatencyHistogram:
+    def __init__(self, buckets_per_decade=20, min_us=1.0, max_us=1e7):
+        """
+        Log-spaced latency histogram with percentile estimates.
+
+        Memory stays constant however long it runs; percentiles are interpolated inside a
+        bucket, so they are accurate to about 1/buckets_per_decade of a decade.
+
+        Args:
+            buckets_per_decade (int): Resolution of the buckets.
+            min_us, max_us (float): Range covered by the buckets; values outside it land in
+                the first or last bucket.
+        """
+        self.buckets_per_decade = buckets_per_decade
+        self.min_us = min_us
+        self.n_buckets = int(math.ceil(math.log10(max_us / min_us) * buckets_per_decade))
+        self.counts = [0] * (self.n_buckets + 1)
+        self.count = 0
+        self.total_us = 0.0
+        self.max_us = 0.0
+
+    def _edge(self, index):
+        return self.min_us * 10 ** (index / self.buckets_per_decade)
+
+    def add(self, latency_us):
+        latency_us = max(0.0, latency_us)
+        if latency_us <= self.min_us:
+            index = 0
+        else:
+            index = min(self.n_buckets, int(math.log10(latency_us / self.min_us) * self.buckets_per_decade) + 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total_us += latency_us
+        self.max_us = max(self.max_us, latency_us)
+
+    def percentile(self, fraction):
+        """Estimated latency (us) below which `fraction` of the values fall, None when empty."""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= target:
+                if index == 0:
+                    return self.min_us
+                low, high = self._edge(index - 1), min(self._edge(index), self.max_us)
+                return low + (high - low) * (target - seen) / count
+            seen += count
+        return self.max_us
+
+    def summary(self):
+        if not self.count:
+            return "no data"
+        p50, p95, p99 = (self.percentile(fraction) for fraction in (0.50, 0.95, 0.99))
+        return (f"n={self.count}, p50 {p50 / 1000:.2f} ms, p95 {p95 / 1000:.2f} ms, p99 {p99 / 1000:.2f} ms, "
+                f"mean {self.total_us / self.count / 1000:.2f} ms, max {self.max_us / 1000:.2f} ms")
+
+
+class LatencyProbe:
+    def __init__(self):
+        """
+        End-to-end latency of the command path, measured with ping/echo probes.
+
+        A probe is queued by the GUI with its timestamp, taken by the main thread, sent
+        over the control socket and echoed by the Pi with the (Pi) time of every stage it
+        passed. Each completed probe adds one value to the histogram of every stage.
+        The main thread and the telemetry thread both use it, so it is locked.
+        """
+        self.lock = threading.Lock()
+        self.histograms = {stage: LatencyHistogram() for stage, _ in STAGES}
+        self.pending = {}  # probe id -> (queued_ns, dequeued_ns, sent_ns)
+        self.next_id = 0
+        self.lost = 0
+        self.not_acked = 0
+
+    def start(self, queued_ns, dequeued_ns):
+        """
+        Register a probe taken from the GUI queue by the main thread.
+
+        Args:
+            queued_ns (int): When the GUI queued it (time.monotonic_ns()).
+            dequeued_ns (int): When the main thread took it from the queue.
+
+        Returns:
+            int: Id of the probe, to send in the b'P' message.
+        """
+        with self.lock:
+            for probe_id, times in list(self.pending.items()):
+                if dequeued_ns - times[1] > PENDING_TIMEOUT_NS:
+                    del self.pending[probe_id]
+                    self.lost += 1
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+            self.pending[self.next_id] = (queued_ns, dequeued_ns, None)
+            return self.next_id
+
+    def sent(self, probe_id, sent_ns):
+        """Record when the socket write of a probe returned."""
+        with self.lock:
+            times = self.pending.get(probe_id)
+            if times is not None:
+                self.pending[probe_id] = (times[0], times[1], sent_ns)
+
+    def echoed(self, echo, received_ns=None):
+        """
+        Complete a probe with its PingEcho.
+
+        Args:
+            echo (PingEcho): Echo decoded from the telemetry.
+            received_ns (int): When the echo arrived, now by default.
+        """
+        received_ns = time.monotonic_ns() if received_ns is None else received_ns
+        with self.lock:
+            times = self.pending.pop(echo.probe_id, None)
+            if times is None:
+                return  # Unknown or expired probe
+            queued_ns, dequeued_ns, sent_ns = times
+            if sent_ns is None:
+                sent_ns = dequeued_ns  # Echoed before the sending thread recorded its write time
+            on_pi_ns = echo.echoed_ns - echo.received_ns
+            network_ns = max(0, (received_ns - sent_ns - on_pi_ns) // 2)
+            stages = {
+                "gui_queue": dequeued_ns - queued_ns,
+                "main_thread": sent_ns - dequeued_ns,
+                "network": network_ns,
+                "round_trip": received_ns - queued_ns,
+            }
+            if echo.flags & ECHO_ACKED:
+                stages["pi_serial"] = echo.written_ns - echo.received_ns
+                stages["arduino_ack"] = echo.acked_ns - echo.written_ns
+                stages["pi_echo"] = echo.echoed_ns - echo.acked_ns
+                stages["click_to_ack"] = sent_ns - queued_ns + network_ns + echo.acked_ns - echo.received_ns
+            else:
+                if echo.written_ns:
+                    self.not_acked += 1
+                stages["pi_echo"] = echo.echoed_ns - echo.received_ns
+            for stage, latency_ns in stages.items():
+                self.histograms[stage].add(latency_ns / 1000)
+
+    def report(self):
+        """Multi-line report with the p50/p95/p99 of every stage."""
+        with self.lock:
+            lines = [f"Latency probes: {len(self.pending)} pending, {self.lost} lost, "
+                     f"{self.not_acked} not answered by the Arduino"]
+            lines += [f"  {label}: {self.histograms[stage].summary()}" for stage, label in STAGES]
+        return "\n".join(lines)
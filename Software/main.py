@@ -6,9 +6,49 @@ from dataclasses import dataclass
 from threading import Thread
 import socket
 from threading import Event
-import struct
 import cv2
+import numpy as np
 import queue
+from clock_sync import ClockSync
+from latency import LatencyProbe
+from sample_ring import SampleRing
+from setpoint_channel import SetpointChannel
+from telemetry import (TELEMETRY_TEXT, TELEMETRY_BINARY, RATE_STRUCT, PING_CLOCK, BinaryTelemetryDecoder, ClockInfo,
+                       ControlState, PingEcho, SAMPLE_COLUMNS, SequenceReport, TextTelemetryDecoder, pack_clock_probe,
+                       pack_control_gains, pack_ping, pack_setpoint, pack_valve_sequence, pack_veab_request,
+                       pack_waveform, pack_waveform_table)
+
+# Telemetry format requested from the Raspberry Pi at connect time (TELEMETRY_TEXT or TELEMETRY_BINARY)
+TELEMETRY_MODE = TELEMETRY_BINARY
+# Telemetry output rate requested at connect time: 0 for every sample, otherwise min/max/mean/last
+# aggregates per window at this rate. The GUI plots each window as a min/max pair, so 25 Hz
+# fills its 200-point history with the last 4 s, like the raw stream at its 50 Hz refresh
+TELEMETRY_RATE = 25.0
+# Bytes read from the telemetry socket per recv_into (a raw binary sample frame is 54 bytes, a text line ~150)
+RECEIVE_BUFFER_SIZE = 65536
+# Raw sample rows kept in the shared-memory ring read by the GUI (80 s at 100 Hz)
+SAMPLE_RING_CAPACITY = 8192
+
+# Regulator setpoint = REGULATOR_OFFSET + REGULATOR_GAIN * GUI wave value (normalized DAC units)
+REGULATOR_OFFSET = 0.5
+REGULATOR_GAIN = 0.15
+
+# Closed-loop pressure control on the Pi, enabled at connect time: (kp, ki, kd, kf), or None for open loop
+PRESSURE_CONTROL_GAINS = None
+
+# Stream the regulator feedback (VEAB) at the full ADC rate for the GUI's Regulator tab
+VEAB_STREAM = True
+
+# Latency probes (queued by the GUI) go through the Arduino so the report covers click-to-valve latency
+LATENCY_PROBE_ARDUINO = True
+# Seconds between latency reports printed to the console (0 for on-demand reports only)
+LATENCY_REPORT_INTERVAL = 60.0
+
+# Clock probes mapping this PC's clock to the Pi's (telemetry time): a burst of CLOCK_SYNC_BURST
+# probes CLOCK_SYNC_BURST_INTERVAL apart right after connecting, then one every CLOCK_SYNC_INTERVAL s
+CLOCK_SYNC_BURST = 8
+CLOCK_SYNC_BURST_INTERVAL = 0.2
+CLOCK_SYNC_INTERVAL = 1.0
 
 
 def play_video(running):
@@ -50,44 +90,70 @@ class MainExperiment:
     dp1: str = "DEFAULT"
 
 
-def receive_sensor_data_from_pi(client_socket, gui_sensor_queue, running):
-    """Receive sensor data from the Raspberry Pi via a socket and send complete lines to the GUI."""
-    buffer = ""
+last_control_report = [0.0]  # Telemetry time of the last logged controller state
+
+
+def telemetry_stamp(clock_sync):
+    """' at <telemetry time>' of the current moment for console messages, empty until the clocks are synchronized."""
+    timestamp, error = clock_sync.telemetry_time()
+    return "" if timestamp is None else f" at {timestamp:.4f}s (+/- {error * 1000:.2f} ms)"
+
+
+def handle_telemetry(item, gui_sensor_queue, sample_ring, latency_probe, clock_sync, received_ns=None):
+    """Append a decoded sample block to the GUI's ring, send an aggregate or VEAB block to the GUI, complete latency and clock probes, log sequence frame reports and (once a second) the controller state."""
+    if isinstance(item, np.ndarray):
+        sample_ring.write(item)
+        return
+    if isinstance(item, PingEcho):
+        if item.flags & PING_CLOCK:
+            clock_sync.echoed(item, received_ns)
+        else:
+            latency_probe.echoed(item, received_ns)
+    elif isinstance(item, ClockInfo):
+        clock_sync.set_clock(item)
+    elif isinstance(item, ControlState):
+        if item.time - last_control_report[0] >= 1.0:
+            last_control_report[0] = item.time
+            print(f"[Pi Loop] Control actuator {item.actuator}: setpoint {item.setpoint:.3f}, measured "
+                  f"{item.measurement:.3f}, error {item.error:+.4f}, effort {item.effort:.3f}")
+    elif isinstance(item, SequenceReport):
+        print(f"[Pi Loop] Sequence {item.sequence_id} frame {item.index} ({item.valves}) applied at "
+              f"{item.actual * 1000:.1f} ms, {(item.actual - item.scheduled) * 1000:.2f} ms late")
+    else:
+        gui_sensor_queue.put(item)
+
+
+def receive_sensor_data_from_pi(client_socket, gui_sensor_queue, sample_ring, running, latency_probe, clock_sync, mode=TELEMETRY_TEXT):
+    """Receive sensor data from the Raspberry Pi via a socket and send decoded sample blocks to the GUI."""
+    # Preallocated receive buffer: every recv_into fills it in place and the decoder reads it through the view
+    buffer = bytearray(RECEIVE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    decoder = BinaryTelemetryDecoder() if mode == TELEMETRY_BINARY else TextTelemetryDecoder()
+    reported_errors = 0
     try:
         while running.is_set():
             try:
-                received_data = client_socket.recv(1024).decode('utf-8')
-                if not received_data:
+                received = client_socket.recv_into(view)
+                received_ns = time.monotonic_ns()  # Arrival time of the echoes in these bytes
+                if not received:
                     continue
 
-                buffer += received_data
-
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    line = line.strip()
-                    try:
-                        parsed_data = line.split(", ")
-                        time_value = float(parsed_data[0].split(":")[1].strip()[:-1])
-                        veab = float(parsed_data[1].split(":")[1].strip())
-                        mpr1 = float(parsed_data[2].split(":")[1].strip())
-                        mpr2 = float(parsed_data[3].split(":")[1].strip())
-                        mpr3 = float(parsed_data[4].split(":")[1].strip())
-                        mpr4 = float(parsed_data[5].split(":")[1].strip())
-                        mpr5 = float(parsed_data[6].split(":")[1].strip())
-                        mpr6 = float(parsed_data[7].split(":")[1].strip())
-                        mpr7 = float(parsed_data[8].split(":")[1].strip())
-                        mpr8 = float(parsed_data[9].split(":")[1].strip())
-
-                        # Add all 8 sensors to the GUI queue
-                        gui_sensor_queue.put((time_value, veab, mpr1, mpr2, mpr3, mpr4, mpr5, mpr6, mpr7, mpr8))
-                    except Exception as parse_error:
-                        print(f"[Pi Loop] Error parsing data: {parse_error}")
+                # One block per run of samples (all 8 sensors), window aggregates and the other frames
+                for item in decoder.feed(view[:received]):
+                    handle_telemetry(item, gui_sensor_queue, sample_ring, latency_probe, clock_sync, received_ns)
+                if mode == TELEMETRY_TEXT and decoder.parse_errors > reported_errors:
+                    reported_errors = decoder.parse_errors
+                    print(f"[Pi Loop] Error parsing data: {decoder.last_error}")
             except socket.timeout:
                 continue
             except Exception as e:
                 print(f"[Pi Loop] Error in receiving data: {e}")
                 running.clear()
     finally:
+        if mode == TELEMETRY_BINARY and (decoder.dropped_frames or decoder.resync_bytes):
+            print(f"[Pi Loop] Binary telemetry: {decoder.dropped_frames} dropped frame(s), {decoder.resync_bytes} byte(s) skipped to resync.")
+        if mode == TELEMETRY_TEXT and decoder.parse_errors:
+            print(f"[Pi Loop] Text telemetry: {decoder.parse_errors} of {decoder.lines} line(s) could not be parsed.")
         client_socket.close()
         print("[Pi Loop] Socket closed.")
 
@@ -99,9 +165,11 @@ def main():
     gui_regulator_queue = Queue()
     gui_actuator_queue = Queue()
     gui_sensor_queue = Queue()
+    # Raw sample rows for the GUI, written by the telemetry thread and read without pickling
+    sample_ring = SampleRing(SAMPLE_RING_CAPACITY, len(SAMPLE_COLUMNS))
 
     # Start the GUI in a separate process
-    gui_p = Process(target=gui_run, args=(gui_queue, gui_out_queue, gui_regulator_queue, gui_actuator_queue, gui_sensor_queue))
+    gui_p = Process(target=gui_run, args=(gui_queue, gui_out_queue, gui_regulator_queue, gui_actuator_queue, gui_sensor_queue, sample_ring))
     gui_p.start()
 
     experiment = MainExperiment()
@@ -110,17 +178,32 @@ def main():
 
     client_socket = None
     sensor_thread = None
+    sequence_id = 0  # Id of the last uploaded valve sequence, echoed in the Pi's frame reports
+    latency_probe = LatencyProbe()  # Per-stage latency histograms of the command path
+    last_latency_report = time.monotonic()
+    clock_sync = ClockSync()  # PC -> Pi clock mapping, replaced on every connection
+    clock_probes = 0  # Clock probes sent on the current connection
+    next_clock_probe = 0.0
+
+    def pack_regulator_message(regulator_value):
+        """Encode a setpoint or a waveform command of the GUI's Regulator tab."""
+        if isinstance(regulator_value, tuple) and regulator_value[0] == "Waveform":
+            # Waveform synthesized by the Pi at its actuator rate
+            _, shape, amplitude, frequency, duration = regulator_value
+            return pack_waveform(shape, REGULATOR_GAIN * amplitude, frequency, REGULATOR_OFFSET, duration)
+        if isinstance(regulator_value, tuple) and regulator_value[0] == "WaveTable":
+            _, samples, rate = regulator_value
+            return pack_waveform_table(samples, rate)
+        return pack_setpoint(REGULATOR_OFFSET + regulator_value * REGULATOR_GAIN)
+
+    # Only the newest setpoint queued by the GUI is sent, so no backlog can delay the regulator
+    regulator_channel = SetpointChannel(gui_regulator_queue, pack_regulator_message)
 
     def send_regulator_data():
         """Continuously send regulator data from the regulator queue."""
         while running.is_set():
             try:
-                wave_value = 0.5 + gui_regulator_queue.get(timeout=0.01) * 0.15
-                if client_socket:
-                    packed_wave_value = struct.pack('d', wave_value)
-                    client_socket.sendall(b'W' + packed_wave_value + b'\n')
-            except queue.Empty:
-                pass
+                regulator_channel.pump(client_socket, timeout=0.01)
             except Exception as e:
                 print(f"Error sending regulator data: {e}")
 
@@ -133,16 +216,45 @@ def main():
             # Handle actuator commands
             try:
                 gui_actuator_value = gui_actuator_queue.get(timeout=0.05)
+                dequeued_ns = time.monotonic_ns()
                 if client_socket:
-                    if isinstance(gui_actuator_value, tuple) and gui_actuator_value[0] == "Valve":
+                    if isinstance(gui_actuator_value, tuple) and gui_actuator_value[0] == "Ping":
+                        # Latency probe, timestamped by the GUI when it was queued
+                        probe_id = latency_probe.start(gui_actuator_value[1], dequeued_ns)
+                        client_socket.sendall(pack_ping(probe_id, LATENCY_PROBE_ARDUINO))
+                        latency_probe.sent(probe_id, time.monotonic_ns())
+                    elif isinstance(gui_actuator_value, tuple) and gui_actuator_value[0] == "Valve":
                         binary_string = gui_actuator_value[1]
                         if binary_string:
                             gui_queue.put(("Status", f"Sending binary state: {binary_string}"))
-                            print(f"Sending binary state: {binary_string}")
+                            print(f"Sending binary state: {binary_string}{telemetry_stamp(clock_sync)}")
                             client_socket.sendall(b'C' + binary_string.encode('utf-8') + b'\n')
+                    elif isinstance(gui_actuator_value, tuple) and gui_actuator_value[0] == "Sequence":
+                        # Timed (offset_ms, binary string) frames, played back by the Pi on its own clock
+                        frames = gui_actuator_value[1]
+                        sequence_id += 1
+                        gui_queue.put(("Status", f"Uploading valve sequence {sequence_id} ({len(frames)} frames)"))
+                        print(f"Uploading valve sequence {sequence_id} ({len(frames)} frames){telemetry_stamp(clock_sync)}")
+                        client_socket.sendall(pack_valve_sequence(sequence_id, frames))
             except queue.Empty:
                 pass
 
+            if client_socket and time.monotonic() >= next_clock_probe:
+                try:
+                    client_socket.sendall(pack_clock_probe(clock_sync.start(time.monotonic_ns())))
+                except OSError as e:
+                    print(f"Error sending clock probe: {e}")
+                clock_probes += 1
+                interval = CLOCK_SYNC_BURST_INTERVAL if clock_probes < CLOCK_SYNC_BURST else CLOCK_SYNC_INTERVAL
+                next_clock_probe = time.monotonic() + interval
+
+            if LATENCY_REPORT_INTERVAL and time.monotonic() - last_latency_report >= LATENCY_REPORT_INTERVAL:
+                last_latency_report = time.monotonic()
+                if client_socket:
+                    print(latency_probe.report())
+                    print(clock_sync.report())
+                    print(regulator_channel.report())
+
             # Handle messages from the GUI
             try:
                 header, gui_data = gui_out_queue.get(timeout=0.1)
@@ -152,12 +264,28 @@ def main():
                         client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                         client_socket.settimeout(2.0)
                         client_socket.connect((raspberry_pi_ip, 12345))
-                        client_socket.sendall(b'CKEEP_ALIVE')
+                        # Small commands and setpoints go out at once instead of waiting for an ACK (Nagle)
+                        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        client_socket.sendall(b'M' + TELEMETRY_MODE)  # Select the telemetry format
+                        client_socket.sendall(b'R' + RATE_STRUCT.pack(TELEMETRY_RATE))  # and its output rate
+                        if PRESSURE_CONTROL_GAINS is not None:
+                            client_socket.sendall(pack_control_gains(*PRESSURE_CONTROL_GAINS))
+                        if VEAB_STREAM:
+                            client_socket.sendall(pack_veab_request())
                         gui_queue.put(("Status", f"Connected to Raspberry Pi at {raspberry_pi_ip}:12345"))
-                        sensor_thread = Thread(target=receive_sensor_data_from_pi, args=(client_socket, gui_sensor_queue, running), daemon=True)
+                        clock_sync = ClockSync()
+                        clock_probes = 0
+                        next_clock_probe = 0.0
+                        sensor_thread = Thread(target=receive_sensor_data_from_pi, args=(client_socket, gui_sensor_queue, sample_ring, running, latency_probe, clock_sync, TELEMETRY_MODE), daemon=True)
                         sensor_thread.start()
                     except Exception as e:
                         gui_queue.put(("Status", f"Failed to connect: {e}"))
+                elif header == "Latency":
+                    report = latency_probe.report()
+                    print(report)
+                    print(clock_sync.report())
+                    print(regulator_channel.report())
+                    gui_queue.put(("Status", report))
                 elif header == "Close":
                     running.clear()
                     break
@@ -173,6 +301,12 @@ def main():
         if sensor_thread and sensor_thread.is_alive():
             sensor_thread.join()
         gui_p.terminate()
+        gui_p.join()
+        sample_ring.close()
+        sample_ring.unlink()
+        print(latency_probe.report())
+        print(clock_sync.report())
+        print(regulator_channel.report())
 
 
 if __name__ == "__main__":
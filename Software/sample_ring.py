@@ -0,0 +1,110 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# The write count and the end of the block being written (uint64 each) come first, padded to a
+# cache line, then the rows
+_HEADER_SIZE = 64
+_COUNT = 0
+_RESERVED = 1
+
+
+class SampleRing:
+    def __init__(self, capacity, n_columns, name=None, create=True):
+        """
+        Ring buffer of float64 sample rows in shared memory, for one writer and any number
+        of readers (the same scheme as the Raspberry Pi's SampleRing).
+
+        The writer announces the end of the block it is about to write, copies the rows into
+        the slots from `count % capacity` on and then advances the shared write count, so
+        every row below the count is complete. Every reader keeps its own cursor (the count
+        it has read up to), copies the new rows out as one array straight from the shared
+        block, without pickling, and drops the rows that the writer overwrote (or was
+        overwriting) while it copied them.
+
+        Args:
+            capacity (int): Number of rows kept.
+            n_columns (int): Doubles per row, the first one being its time stamp.
+            name (str): Name of an existing block to attach to (create=False).
+            create (bool): Create a new shared memory block.
+        """
+        self.capacity = capacity
+        self.n_columns = n_columns
+        size = _HEADER_SIZE + capacity * n_columns * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self._header = np.ndarray((2,), np.uint64, self.shm.buf, 0)
+        self.rows = np.ndarray((capacity, n_columns), np.float64, self.shm.buf, _HEADER_SIZE)
+        if create:
+            self._header[:] = 0
+        self._count = int(self._header[_COUNT])
+
+    def __reduce__(self):
+        # Pickled (e.g. as a Process argument on Windows) as a reference to the same block
+        return SampleRing, (self.capacity, self.n_columns, self.shm.name, False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, rows):
+        """
+        Append a block of rows (single writer only).
+
+        Args:
+            rows (numpy.ndarray): Array of shape (n, n_columns).
+        """
+        if len(rows) > self.capacity:
+            self._count += len(rows) - self.capacity  # Overwritten by this very block
+            rows = rows[-self.capacity:]
+        self._header[_RESERVED] = self._count + len(rows)
+        start = self._count % self.capacity
+        first = min(len(rows), self.capacity - start)
+        self.rows[start:start + first] = rows[:first]
+        self.rows[:len(rows) - first] = rows[first:]
+        self._count += len(rows)
+        self._header[_COUNT] = self._count
+
+    def count(self):
+        """Number of rows written so far."""
+        return int(self._header[_COUNT])
+
+    def read_since(self, cursor):
+        """
+        Copy the rows written since `cursor`.
+
+        Args:
+            cursor (int): Count returned by the previous call (0 for the first one).
+
+        Returns:
+            tuple: (new cursor, rows, lost). rows is an (n, n_columns) array and lost the
+            number of rows overwritten before they could be read.
+        """
+        count = self.count()
+        start = max(cursor, count - self.capacity)
+        rows = self.rows.take(np.arange(start, count), axis=0, mode='wrap')
+        # Rows the writer reached again while they were being copied are not consistent
+        overwritten = min(count, int(self._header[_RESERVED]) - self.capacity)
+        if start < overwritten:
+            rows = rows[overwritten - start:]
+            start = overwritten
+        return count, rows, start - cursor
+
+    def latest(self):
+        """Copy of the most recent row, or None before the first write."""
+        while True:
+            count = self.count()
+            if not count:
+                return None
+            row = self.rows[(count - 1) % self.capacity].copy()
+            if int(self._header[_RESERVED]) - self.capacity < count:
+                return row  # Not reached again by the writer while it was copied
+
+    def close(self):
+        """Detach from the shared memory block."""
+        self.rows = None
+        self._header = None
+        self.shm.close()
+
+    def unlink(self):
+        """Destroy the shared memory block (owner only, after every process is done)."""
+        self.shm.unlink()
@@ -0,0 +1,75 @@
+import queue
+
+
+class SetpointChannel:
+    def __init__(self, source, pack):
+        """
+        Latest-value-wins channel from the GUI's regulator queue to the Pi.
+
+        The GUI puts a setpoint (float) on the queue at every animation tick and the odd
+        command (a tuple, e.g. a waveform to synthesize on the Pi). Each time the channel is
+        pumped it takes everything queued since the last pump and sends only the newest of
+        consecutive setpoints, so however long a write blocks, the queue is emptied on the
+        next pump and the regulator is never more than one write behind the slider.
+        Commands are never coalesced and keep their order with the setpoints around them.
+
+        Args:
+            source (multiprocessing.Queue): Queue the GUI puts setpoints and commands on.
+            pack (callable): Encodes a setpoint or a command into the message to send.
+        """
+        self.source = source
+        self.pack = pack
+        self.sent = 0
+        self.coalesced = 0  # Replaced by a newer setpoint before they were sent
+        self.dropped = 0  # Not sent: no connection or the write failed
+
+    def collect(self, timeout):
+        """
+        Wait up to `timeout` s for the GUI, then take everything it queued.
+
+        Returns:
+            list: Commands and setpoints in queue order, each run of setpoints reduced to its last one.
+        """
+        try:
+            items = [self.source.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                items.append(self.source.get_nowait())
+            except queue.Empty:
+                break
+        collected = []
+        for item in items:
+            if not isinstance(item, tuple) and collected and not isinstance(collected[-1], tuple):
+                collected[-1] = item
+                self.coalesced += 1
+            else:
+                collected.append(item)
+        return collected
+
+    def pump(self, client_socket, timeout=0.01):
+        """
+        Send what the GUI queued to the Pi, the newest setpoint of every run only.
+
+        Args:
+            client_socket (socket.socket): Control connection, or None when not connected.
+            timeout (float): Seconds to wait for the GUI when nothing is queued.
+        """
+        for item in self.collect(timeout):
+            setpoint = not isinstance(item, tuple)
+            if client_socket is None:
+                self.dropped += setpoint
+                continue
+            try:
+                client_socket.sendall(self.pack(item))
+            except OSError as e:
+                self.dropped += setpoint
+                print(f"Error sending regulator data: {e}")
+                continue
+            self.sent += setpoint
+
+    def report(self):
+        """One-line summary of the setpoints sent, coalesced and dropped."""
+        return (f"[INFO] Regulator setpoints: {self.sent} sent, {self.coalesced} coalesced, "
+                f"{self.dropped} dropped")
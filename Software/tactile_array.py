@@ -1,4 +1,30 @@
-import time
+
+class ValveSequence:
+    def __init__(self):
+        """
+        Timed valve frames, uploaded to the Raspberry Pi in one message.
+
+        The Pi plays the frames back on its own clock, so network jitter does not change
+        the stimulus timing.
+        """
+        self.frames = []  # (offset_ms, 16-bit binary string)
+        self.duration_ms = 0
+
+    def add(self, binary_string, hold):
+        """
+        Append a valve state.
+
+        Args:
+            binary_string (str): 16-bit binary string.
+            hold (float): Seconds until the next frame.
+        """
+        self.frames.append((self.duration_ms, binary_string))
+        self.duration_ms += round(hold * 1000)
+
+    def pause(self, delay):
+        """Keep the current valve state for `delay` more seconds."""
+        self.duration_ms += round(delay * 1000)
+
 
 class TactileArrayController:
     def __init__(self, queue):
@@ -24,6 +50,35 @@ class TactileArrayController:
         binary_string = ''.join(str(cell) for row in matrix for cell in row)
         return binary_string
 
+    def play_sequence(self, sequence):
+        """
+        Upload a timed valve sequence for playback on the Raspberry Pi.
+
+        Args:
+            sequence (ValveSequence): Frames to play.
+        """
+        if sequence.frames:
+            self.b_string = sequence.frames[-1][1]
+        self.queue.put(("Sequence", sequence.frames))
+        print(f"Sequence uploaded: {len(sequence.frames)} frames over {sequence.duration_ms} ms")
+
+    def play_animation(self, animation_sequence, step_delay=0.1, repeats=3, repeat_delay=0.5):
+        """
+        Upload an animation as one timed sequence.
+
+        Args:
+            animation_sequence (list): 4x4 matrices shown one after the other.
+            step_delay (float): Seconds between steps.
+            repeats (int): Number of repetitions.
+            repeat_delay (float): Extra pause between repetitions, in seconds.
+        """
+        sequence = ValveSequence()
+        for _ in range(repeats):
+            for step in animation_sequence:
+                sequence.add(self.matrix_to_binary_string(step), step_delay)
+            sequence.pause(repeat_delay)
+        self.play_sequence(sequence)
+
     def apply_pattern(self, matrix):
         """
         Apply a tactile pattern based on a 4x4 matrix.
@@ -222,15 +277,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_1")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.1)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 1 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.1)
+        print("Animation 1 uploaded.")
     
 
     def animation_2(self):
@@ -278,15 +327,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_2")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.1)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 2 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.1)
+        print("Animation 2 uploaded.")
 
     
     def animation_3(self):
@@ -334,15 +377,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_3")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.1)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 3 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.1)
+        print("Animation 3 uploaded.")
     
 
     def animation_4(self):
@@ -390,15 +427,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_4")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.1)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 4 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.1)
+        print("Animation 4 uploaded.")
 
 
     def animation_5(self):
@@ -458,15 +489,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_5")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.1)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 5 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.1)
+        print("Animation 5 uploaded.")
 
 
     def animation_6(self):
@@ -526,15 +551,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_6")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.1)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 6 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.1)
+        print("Animation 6 uploaded.")
     
     def animation_7(self):
         """
@@ -617,15 +636,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_7")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.05)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 7 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.05)
+        print("Animation 7 uploaded.")
     
 
     def animation_8(self):
@@ -709,15 +722,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_8")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.05)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 8 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.05)
+        print("Animation 8 uploaded.")
 
     
     def animation_9(self):
@@ -747,15 +754,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_9")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.15)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 9 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.15)
+        print("Animation 9 uploaded.")
 
     def animation_10(self):
         """
@@ -784,15 +785,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_10")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.15)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 10 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.15)
+        print("Animation 10 uploaded.")
 
     def animation_11(self):
         """
@@ -827,15 +822,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_11")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.1)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 11 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.1)
+        print("Animation 11 uploaded.")
     
     def animation_12(self):
         """
@@ -870,15 +859,9 @@ class TactileArrayController:
             ],
         ]
 
-        # Repeat the animation sequence 3 times
-        for repeat in range(3):
-            print(f"Starting repetition {repeat + 1} of animation_12")
-            for step in animation_sequence:
-                self.apply_pattern(step)
-                time.sleep(0.1)  # Wait for 0.1 seconds between steps
-            time.sleep(0.5)  # Wait for 0.5 seconds between repetitions
-
-        print("Animation 12 complete.")
+        # Upload the sequence repeated 3 times, the Pi plays it back on its own clock
+        self.play_animation(animation_sequence, step_delay=0.1)
+        print("Animation 12 uploaded.")
 
 
     def update_binary_string(self, indices, state):
@@ -904,38 +887,42 @@ class TactileArrayController:
         """Run Demo 1: Spiral sequence."""
         spiral_sequence = [1, 5, 9, 13, 14, 15, 16, 12, 8, 4, 3, 2, 6, 10, 11, 7]
         print("Starting Demo 1: Spiral sequence")
+        sequence = ValveSequence()
         for index in spiral_sequence:
             self.update_binary_string([index], "1")
-            self.send_binary_string()
-            time.sleep(0.15)
+            sequence.add(self.b_string, 0.15)
             self.update_binary_string([index], "0")  # Turn off the valve
+        self.play_sequence(sequence)
 
     def demo_2(self):
         """Run Demo 2: Row-by-row activation."""
         print("Starting Demo 2: Row-by-row")
+        sequence = ValveSequence()
         for row in range(4):  # 4 rows
             indices = [row * 4 + i + 1 for i in range(4)]
             self.update_binary_string(indices, "1")
-            self.send_binary_string()
-            time.sleep(0.5)
+            sequence.add(self.b_string, 0.5)
             self.update_binary_string(indices, "0")  # Turn off the row
+        self.play_sequence(sequence)
 
     def demo_3(self):
         """Run Demo 3: Left-to-right and reverse."""
         print("Starting Demo 3: Left-to-right and reverse")
-        sequence = list(range(1, 17)) + list(range(16, 0, -1))
-        for index in sequence:
+        sequence_indices = list(range(1, 17)) + list(range(16, 0, -1))
+        sequence = ValveSequence()
+        for index in sequence_indices:
             self.update_binary_string([index], "1")
-            self.send_binary_string()
-            time.sleep(0.1)
+            sequence.add(self.b_string, 0.1)
             self.update_binary_string([index], "0")  # Turn off the valve
+        self.play_sequence(sequence)
 
     def demo_4(self):
         """Run Demo 4: Right-to-left."""
         print("Starting Demo 4: Right-to-left")
+        sequence = ValveSequence()
         for col in range(4):  # 4 columns
             indices = [col + 1 + i * 4 for i in range(4)]
             self.update_binary_string(indices, "1")
-            self.send_binary_string()
-            time.sleep(0.5)
+            sequence.add(self.b_string, 0.5)
             self.update_binary_string(indices, "0")  # Turn off the column
+        self.play_sequence(sequence)
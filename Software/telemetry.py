@@ -0,0 +1,493 @@
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+# Telemetry modes understood by the Raspberry Pi (sent as b'M' + mode right after connecting)
+TELEMETRY_TEXT = b'T'
+TELEMETRY_BINARY = b'B'
+
+# Every telemetry time is on the Pi's monotonic clock, in seconds since the telemetry epoch
+# announced by the clock frames; sample times are capture times (see ClockSync for the PC side).
+
+# Binary frame: magic, sequence number, timestamp (s), VEAB, MPR1-8, estimated error of the timestamp (s)
+# (must match the Pi side)
+FRAME_MAGIC = b'\xa5\x5a'
+FRAME_STRUCT = struct.Struct('<2sId9ff')
+FRAME_SIZE = FRAME_STRUCT.size
+# The same frame as a NumPy record, to decode a run of consecutive frames in one step (from
+# BLOCK_FRAMES on: shorter runs, e.g. one frame per recv of a slow stream, are faster frame by frame)
+BLOCK_FRAMES = 8
+FRAME_DTYPE = np.dtype([("magic", "S2"), ("sequence", "<u4"), ("time", "<f8"), ("values", "<f4", 9),
+                        ("time_error", "<f4")])
+
+# Decoded samples are handed on in blocks: float64 arrays with one row per sample and these columns
+SAMPLE_COLUMNS = ("time", "VEAB", "MPR1", "MPR2", "MPR3", "MPR4", "MPR5", "MPR6", "MPR7", "MPR8", "time_error")
+
+# Aggregate frame: magic, sequence number, window end time (s), sample count,
+# then min[9], max[9], mean[9], last[9] over the VEAB/MPR1-8 channels (must match the Pi side)
+AGGREGATE_MAGIC = b'\xa5\x5b'
+AGGREGATE_STRUCT = struct.Struct('<2sIdH36f')
+AGGREGATE_SIZE = AGGREGATE_STRUCT.size
+# Rate request: b'R' + float32 aggregates per second (0 = every sample)
+RATE_STRUCT = struct.Struct('<f')
+
+# One window of aggregated samples; minimum/maximum/mean/last are (VEAB, MPR1-8) tuples
+Aggregate = namedtuple("Aggregate", "time count minimum maximum mean last")
+
+# Valve sequence upload: b'S' + header + frames, played back by the Pi on its own clock
+SEQUENCE_HEADER = struct.Struct('<IH')  # sequence id, frame count
+SEQUENCE_FRAME = struct.Struct('<IH')   # offset from the sequence start (ms), 16-bit valve mask (valve 1 = MSB)
+
+# Report of one played sequence frame: magic, sequence id, frame index, valve mask, scheduled and
+# actual offset from the sequence start (s), telemetry time of the execution (s)
+REPORT_MAGIC = b'\xa5\x5c'
+REPORT_STRUCT = struct.Struct('<2sIHHddd')
+REPORT_SIZE = REPORT_STRUCT.size
+
+SequenceReport = namedtuple("SequenceReport", "sequence_id index valves scheduled actual time")
+
+# Closed-loop controller state of one actuator: magic, sequence number, telemetry time (s), actuator,
+# then setpoint, measurement, error, effort and integral term (normalized pressure units)
+CONTROL_MAGIC = b'\xa5\x5d'
+CONTROL_STRUCT = struct.Struct('<2sIdB3x5f')
+CONTROL_SIZE = CONTROL_STRUCT.size
+
+ControlState = namedtuple("ControlState", "time actuator setpoint measurement error effort integral")
+
+# Controller gains: b'K' + actuator (-1 = all), enable, kp, ki (1/s), kd (s), kf (feedforward)
+CONTROL_GAINS_STRUCT = struct.Struct('<bB2xffff')
+
+# Latency probe: b'P' + probe id, flags
+PING_STRUCT = struct.Struct('<IB')
+PING_ARDUINO = 0x01  # Pass the probe through the Arduino and wait for its answer
+PING_CLOCK = 0x04    # Clock synchronization probe (answered by the Pi only, routed to ClockSync)
+# Probe echo: magic, probe id, flags, then the Pi's monotonic time (ns) at which the probe was received,
+# written to the serial port, answered by the Arduino and echoed (0 = stage not passed)
+ECHO_MAGIC = b'\xa5\x5e'
+ECHO_STRUCT = struct.Struct('<2sIB3x4q')
+ECHO_SIZE = ECHO_STRUCT.size
+ECHO_ACKED = 0x02  # The Arduino answered the probe
+
+PingEcho = namedtuple("PingEcho", "probe_id flags received_ns written_ns acked_ns echoed_ns")
+
+# High-rate VEAB stream, enabled with b'V' + 1: magic, index of the first sample, telemetry time of
+# the first sample (s), channel count, sample count, then per sample its offset from the first one (s)
+# and one voltage per VEAB sensor, all float32
+VEAB_MAGIC = b'\xa5\x5f'
+VEAB_HEADER = struct.Struct('<2sIdBH')
+
+# Consecutive VEAB samples: index of the first one, then per sample its time and (voltage per sensor)
+VeabBlock = namedtuple("VeabBlock", "index times values")
+
+# Telemetry clock, once a second: magic, Pi monotonic time (ns) of telemetry time 0, how much faster
+# than the Pi's clock the Arduino's runs (ppm), error of the Arduino sample times (s), points of that fit
+CLOCK_MAGIC = b'\xa5\x60'
+CLOCK_STRUCT = struct.Struct('<2sqffH')
+CLOCK_SIZE = CLOCK_STRUCT.size
+
+ClockInfo = namedtuple("ClockInfo", "epoch_ns arduino_ppm arduino_error arduino_points")
+
+
+def pack_valve_sequence(sequence_id, frames):
+    """
+    Encode a valve sequence upload.
+
+    Args:
+        sequence_id (int): Id echoed in the Pi's frame reports.
+        frames (list of tuple): (offset_ms, 16-bit valve string) pairs.
+
+    Returns:
+        bytes: The complete b'S' message.
+    """
+    message = bytearray(b'S' + SEQUENCE_HEADER.pack(sequence_id & 0xFFFFFFFF, len(frames)))
+    for offset_ms, binary_string in frames:
+        message += SEQUENCE_FRAME.pack(int(round(offset_ms)), int(binary_string, 2))
+    return bytes(message)
+
+
+# Waveform generated on the Pi: b'G' + shape, actuator (-1 = all), flags, amplitude, frequency (Hz),
+# offset, duration (s, 0 = until stopped), in normalized DAC units like the 'W' values
+WAVE_OFF = 0
+WAVE_SINE = 1
+WAVE_SQUARE = 2
+WAVE_TRIANGLE = 3
+WAVE_CONSTANT = 4
+WAVE_TABLE = 5
+WAVE_IMMEDIATE = 0x01  # Apply now instead of at the end of the current cycle
+WAVEFORM_STRUCT = struct.Struct('<BbBxffff')
+# Waveform sample table: b'L' + actuator, sample count, sample rate (Hz), then count float32 samples
+TABLE_HEADER = struct.Struct('<bxHf')
+# Regulator setpoint: b'W' + one float64 (normalized DAC units), nothing after it
+SETPOINT_STRUCT = struct.Struct('<d')
+
+
+def pack_ping(probe_id, through_arduino=True):
+    """Encode a b'P' latency probe."""
+    return b'P' + PING_STRUCT.pack(probe_id & 0xFFFFFFFF, PING_ARDUINO if through_arduino else 0)
+
+
+def pack_clock_probe(probe_id):
+    """Encode a b'P' clock synchronization probe, echoed by the Pi without going through the Arduino."""
+    return b'P' + PING_STRUCT.pack(probe_id & 0xFFFFFFFF, PING_CLOCK)
+
+
+def pack_veab_request(enabled=True):
+    """Encode a b'V' message turning the high-rate VEAB stream on or off."""
+    return b'V' + (b'\x01' if enabled else b'\x00')
+
+
+def pack_control_gains(kp, ki, kd, kf=1.0, enabled=True, actuator=-1):
+    """Encode a b'K' message: closed-loop pressure control with these gains, or open loop when not enabled."""
+    return b'K' + CONTROL_GAINS_STRUCT.pack(actuator, 1 if enabled else 0, kp, ki, kd, kf)
+
+
+def pack_setpoint(value):
+    """Encode a b'W' regulator setpoint."""
+    return b'W' + SETPOINT_STRUCT.pack(value)
+
+
+def pack_waveform(shape, amplitude=0.0, frequency=0.0, offset=0.0, duration=0.0, actuator=-1, immediate=False):
+    """Encode a b'G' waveform message."""
+    flags = WAVE_IMMEDIATE if immediate else 0
+    return b'G' + WAVEFORM_STRUCT.pack(shape, actuator, flags, amplitude, frequency, offset, duration)
+
+
+def pack_waveform_table(samples, rate, actuator=-1):
+    """Encode a b'L' message uploading the samples played by WAVE_TABLE."""
+    samples = list(samples)[:0xFFFF]
+    return b'L' + TABLE_HEADER.pack(actuator, len(samples), rate) + struct.pack(f'<{len(samples)}f', *samples)
+
+
+def parse_text_sample(line):
+    """Parse one 'Time: ..s, VEAB: .., MPR1: .., ..., TimeError: ..ms' line into a (time, VEAB, MPR1-8, time error) tuple."""
+    parsed_data = line.split(", ")
+    time_value = float(parsed_data[0].split(":")[1].strip()[:-1])
+    # Servers that predate the field send no time error
+    time_error = float(parsed_data[10].split(":")[1].strip()[:-2]) / 1000 if len(parsed_data) > 10 else 0.0
+    return (time_value,) + tuple(float(field.split(":")[1].strip()) for field in parsed_data[1:10]) + (time_error,)
+
+
+def parse_text_aggregate(line):
+    """Parse one 'Agg: ..s, N: .., VEAB: min/max/mean/last, ...' line into an Aggregate."""
+    parsed_data = line.split(", ")
+    time_value = float(parsed_data[0].split(":")[1].strip()[:-1])
+    count = int(parsed_data[1].split(":")[1])
+    channels = [tuple(float(v) for v in field.split(":")[1].strip().split("/")) for field in parsed_data[2:11]]
+    minimum, maximum, mean, last = zip(*channels)
+    return Aggregate(time_value, count, minimum, maximum, mean, last)
+
+
+def parse_text_report(line):
+    """Parse one 'Seq: .., Frame: .., Valves: .., Scheduled: ..ms, Actual: ..ms, Time: ..s' line."""
+    fields = [field.split(":")[1].strip() for field in line.split(", ")]
+    return SequenceReport(int(fields[0]), int(fields[1]), fields[2], float(fields[3][:-2]) / 1000,
+                          float(fields[4][:-2]) / 1000, float(fields[5][:-1]))
+
+
+def parse_text_control(line):
+    """Parse one 'Ctrl: ..s, Actuator: .., Setpoint: .., ...' line into a ControlState."""
+    fields = [field.split(":")[1].strip() for field in line.split(", ")]
+    return ControlState(float(fields[0][:-1]), int(fields[1]), *(float(field) for field in fields[2:7]))
+
+
+def parse_text_echo(line):
+    """Parse one 'Echo: .., Flags: .., Received: .., Written: .., Acked: .., Sent: ..' line into a PingEcho."""
+    return PingEcho(*(int(field.split(":")[1]) for field in line.split(", ")))
+
+
+def parse_text_veab(line):
+    """Parse one 'Veab: ..s, Index: .., VEAB1: .., ...' line into a single-sample VeabBlock."""
+    fields = [field.split(":")[1].strip() for field in line.split(", ")]
+    return VeabBlock(int(fields[1]), [float(fields[0][:-1])], [tuple(float(field) for field in fields[2:])])
+
+
+def parse_text_clock(line):
+    """Parse one 'Clock: .., Arduino: ..ppm, ArduinoError: ..ms, Points: ..' line into a ClockInfo."""
+    fields = [field.split(":")[1].strip() for field in line.split(", ")]
+    return ClockInfo(int(fields[0]), float(fields[1][:-3]), float(fields[2][:-2]) / 1000, int(fields[3]))
+
+
+def parse_text_line(line):
+    """Parse a text telemetry line: a sample tuple, an Aggregate, a SequenceReport, a ControlState, a PingEcho, a VeabBlock or a ClockInfo."""
+    if line.startswith("Agg:"):
+        return parse_text_aggregate(line)
+    if line.startswith("Ctrl:"):
+        return parse_text_control(line)
+    if line.startswith("Seq:"):
+        return parse_text_report(line)
+    if line.startswith("Echo:"):
+        return parse_text_echo(line)
+    if line.startswith("Veab:"):
+        return parse_text_veab(line)
+    if line.startswith("Clock:"):
+        return parse_text_clock(line)
+    return parse_text_sample(line)
+
+
+class BinaryTelemetryDecoder:
+    def __init__(self):
+        """
+        Incremental decoder for the fixed-size binary telemetry frames.
+
+        Bytes are fed as they arrive from the socket; complete frames are returned in
+        arrival order, every run of consecutive sample frames as one block (a float64 array
+        with SAMPLE_COLUMNS, decoded in one step), as Aggregate tuples when the Pi sends window
+        aggregates, as SequenceReport tuples for played valve sequence frames and as
+        ControlState tuples for the closed-loop controller, as PingEcho tuples for
+        latency probes, as VeabBlock tuples for the high-rate VEAB stream and as
+        ClockInfo tuples for the telemetry clock. A lost frame shows up as a gap in the
+        sequence number (or in the VEAB sample index).
+        """
+        self.buffer = bytearray()
+        self.last_sequence = None
+        self.last_aggregate_sequence = None
+        self.next_veab_index = None
+        self.dropped_veab_samples = 0
+        self.dropped_frames = 0
+        self.resync_bytes = 0
+
+    def feed(self, data):
+        """
+        Add received bytes and decode every complete frame.
+
+        Args:
+            data (bytes-like): Raw bytes received from the socket (e.g. a memoryview of the
+                receive buffer, copied once here).
+
+        Returns:
+            list: Decoded sample blocks, aggregates and other frames in arrival order.
+        """
+        self.buffer += data
+        samples = []
+        offset = 0
+        while len(self.buffer) - offset >= 2:
+            magic = self.buffer[offset:offset + 2]
+            if magic == FRAME_MAGIC:
+                if len(self.buffer) - offset < FRAME_SIZE:
+                    break
+                block = self._decode_samples(offset)
+                offset += len(block) * FRAME_SIZE
+                samples.append(block)
+
+            elif magic == AGGREGATE_MAGIC:
+                if len(self.buffer) - offset < AGGREGATE_SIZE:
+                    break
+                _, sequence, window_end, count, *values = AGGREGATE_STRUCT.unpack_from(self.buffer, offset)
+                offset += AGGREGATE_SIZE
+                if self.last_aggregate_sequence is not None:
+                    self.dropped_frames += (sequence - self.last_aggregate_sequence - 1) & 0xFFFFFFFF
+                self.last_aggregate_sequence = sequence
+                samples.append(Aggregate(window_end, count, tuple(values[0:9]), tuple(values[9:18]),
+                                         tuple(values[18:27]), tuple(values[27:36])))
+
+            elif magic == REPORT_MAGIC:
+                if len(self.buffer) - offset < REPORT_SIZE:
+                    break
+                _, sequence_id, index, mask, scheduled, actual, timestamp = REPORT_STRUCT.unpack_from(self.buffer, offset)
+                offset += REPORT_SIZE
+                samples.append(SequenceReport(sequence_id, index, format(mask, '016b'), scheduled, actual, timestamp))
+
+            elif magic == CONTROL_MAGIC:
+                if len(self.buffer) - offset < CONTROL_SIZE:
+                    break
+                _, _, timestamp, actuator, *values = CONTROL_STRUCT.unpack_from(self.buffer, offset)
+                offset += CONTROL_SIZE
+                samples.append(ControlState(timestamp, actuator, *values))
+
+            elif magic == ECHO_MAGIC:
+                if len(self.buffer) - offset < ECHO_SIZE:
+                    break
+                _, *echo = ECHO_STRUCT.unpack_from(self.buffer, offset)
+                offset += ECHO_SIZE
+                samples.append(PingEcho(*echo))
+
+            elif magic == VEAB_MAGIC:
+                if len(self.buffer) - offset < VEAB_HEADER.size:
+                    break
+                _, index, first_time, channels, count = VEAB_HEADER.unpack_from(self.buffer, offset)
+                row = struct.Struct(f'<f{channels}f')
+                size = VEAB_HEADER.size + count * row.size
+                if len(self.buffer) - offset < size:
+                    break
+                rows = [row.unpack_from(self.buffer, offset + VEAB_HEADER.size + i * row.size) for i in range(count)]
+                offset += size
+                if self.next_veab_index is not None:
+                    self.dropped_veab_samples += (index - self.next_veab_index) & 0xFFFFFFFF
+                self.next_veab_index = (index + count) & 0xFFFFFFFF
+                samples.append(VeabBlock(index, [first_time + r[0] for r in rows], [tuple(r[1:]) for r in rows]))
+
+            elif magic == CLOCK_MAGIC:
+                if len(self.buffer) - offset < CLOCK_SIZE:
+                    break
+                _, *clock = CLOCK_STRUCT.unpack_from(self.buffer, offset)
+                offset += CLOCK_SIZE
+                samples.append(ClockInfo(*clock))
+
+            else:
+                # Lost alignment, skip ahead to the next magic marker
+                next_frame = [i for i in (self.buffer.find(FRAME_MAGIC, offset + 1),
+                                          self.buffer.find(AGGREGATE_MAGIC, offset + 1),
+                                          self.buffer.find(REPORT_MAGIC, offset + 1),
+                                          self.buffer.find(CONTROL_MAGIC, offset + 1),
+                                          self.buffer.find(ECHO_MAGIC, offset + 1),
+                                          self.buffer.find(VEAB_MAGIC, offset + 1),
+                                          self.buffer.find(CLOCK_MAGIC, offset + 1)) if i >= 0]
+                skipped = (min(next_frame) if next_frame else len(self.buffer) - 1) - offset
+                self.resync_bytes += skipped
+                offset += skipped
+
+        del self.buffer[:offset]
+        return samples
+
+    def _decode_samples(self, offset):
+        """Decode the run of complete sample frames starting at `offset` into one block."""
+        available = (len(self.buffer) - offset) // FRAME_SIZE
+        if available < BLOCK_FRAMES:
+            rows = []
+            while available and self.buffer[offset:offset + 2] == FRAME_MAGIC:
+                _, sequence, *values = FRAME_STRUCT.unpack_from(self.buffer, offset)
+                if self.last_sequence is not None:
+                    self.dropped_frames += (sequence - self.last_sequence - 1) & 0xFFFFFFFF
+                self.last_sequence = sequence
+                rows.append(values)
+                offset += FRAME_SIZE
+                available -= 1
+            return np.array(rows, dtype=float)
+        frames = np.frombuffer(self.buffer, FRAME_DTYPE, available, offset)
+        mismatch = np.flatnonzero(frames["magic"] != FRAME_MAGIC)
+        if len(mismatch):
+            frames = frames[:mismatch[0]]  # The run ends at the first frame of another type
+        sequence = frames["sequence"].astype(np.int64)
+        if self.last_sequence is not None:
+            self.dropped_frames += (int(sequence[0]) - self.last_sequence - 1) & 0xFFFFFFFF
+        self.dropped_frames += int(((np.diff(sequence) - 1) & 0xFFFFFFFF).sum())
+        self.last_sequence = int(sequence[-1])
+        block = np.empty((len(frames), len(SAMPLE_COLUMNS)))
+        block[:, 0] = frames["time"]
+        block[:, 1:10] = frames["values"]
+        block[:, 10] = frames["time_error"]
+        return block  # A copy: the frames view must not outlive this call, the buffer is resized after it
+
+
+
+# Text sample lines reduced to their numbers: every character that cannot be part of one becomes a space,
+# leaving Time, VEAB, then the label digit and the value of MPR1-8, then TimeError (19 numbers)
+_NUMBERS_ONLY = bytes(c if c in b"0123456789.-" else ord(" ") for c in range(256))
+_LINE_NUMBERS = 19
+_LABEL_COLUMNS = list(range(2, 17, 2))
+_MPR_LABELS = np.arange(1, 9)
+# Columns of SAMPLE_COLUMNS in those numbers, without TimeError for servers that predate it
+_VALUE_COLUMNS = [0, 1] + list(range(3, 18, 2)) + [18]
+# Fewer sample lines are faster parsed one by one (a slow stream gives one line per recv)
+BLOCK_LINES = 4
+
+
+class TextTelemetryDecoder:
+    def __init__(self):
+        """
+        Incremental decoder for the text telemetry lines.
+
+        Bytes are fed as they arrive from the socket, without decoding them to str, and all
+        complete lines of a chunk are parsed in one pass: the sample lines are reduced to
+        their numbers with one translate, split and converted together (float() of the same
+        text as parse_text_sample, so the values are identical) and each run of consecutive
+        sample lines is returned as one block, like the binary decoder does. The other lines
+        (aggregates, reports, echoes...) and a run that does not reduce to whole sample rows
+        (e.g. a corrupted line) go through parse_text_line one by one. Only the incomplete
+        last line of a chunk is carried over to the next one.
+        """
+        self.partial = bytearray()
+        self.lines = 0
+        self.parse_errors = 0
+        self.last_error = None
+
+    def feed(self, data):
+        """
+        Add received bytes and decode every complete line.
+
+        Args:
+            data (bytes-like): Raw bytes received from the socket (e.g. a memoryview of the
+                receive buffer).
+
+        Returns:
+            list: Sample blocks (float64 arrays with SAMPLE_COLUMNS) and the other decoded
+                lines in arrival order.
+        """
+        chunk = self.partial + data
+        end = chunk.rfind(b"\n") + 1
+        self.partial = chunk[end:]
+        if not end:
+            return []
+        del chunk[end:]
+        lines = chunk.count(b"\n")
+        self.lines += lines
+        # Usually every line is a sample line: parse the whole chunk as one block
+        if lines >= BLOCK_LINES and chunk.startswith(b"Time:") and chunk.count(b"\nTime:") == lines - 1:
+            block = self._parse_samples(chunk, lines)
+            if block is not None:
+                return [block]
+
+        items = []
+        run = []
+        for line in chunk.split(b"\n")[:-1]:
+            if line.startswith(b"Time:"):
+                run.append(line)
+                continue
+            if run:
+                items += self._parse_run(run)
+                run = []
+            item = self._parse_line(line)
+            if item is not None:
+                items.append(item)
+        if run:
+            items += self._parse_run(run)
+        return items
+
+    def _parse_samples(self, text, count):
+        """`count` sample lines as one block, None if they do not reduce to that many whole rows."""
+        try:
+            numbers = text.translate(_NUMBERS_ONLY).split()
+            values = np.fromiter(map(float, numbers), np.float64, len(numbers))
+        except ValueError:
+            return None
+        for per_line in (_LINE_NUMBERS, _LINE_NUMBERS - 1):
+            if len(values) == per_line * count:
+                values = values.reshape(count, per_line)
+                if not (values[:, _LABEL_COLUMNS] == _MPR_LABELS).all():
+                    return None  # Misaligned: a line lost a field and another one gained one
+                block = np.zeros((count, len(SAMPLE_COLUMNS)))
+                block[:, :per_line - 8] = values[:, _VALUE_COLUMNS[:per_line - 8]]
+                block[:, -1] /= 1000  # TimeError is in ms
+                return block
+        return None
+
+    def _parse_run(self, run):
+        """Consecutive sample lines as one block, parsed line by line if they are few or cannot be parsed together."""
+        if len(run) >= BLOCK_LINES:
+            block = self._parse_samples(b"\n".join(run), len(run))
+            if block is not None:
+                return [block]
+        rows = []
+        for line in run:
+            row = self._parse_line(line)
+            if row is None:
+                continue
+            if len(row) < len(SAMPLE_COLUMNS) - 1:
+                self.parse_errors += 1
+                self.last_error = f"missing fields in {line!r}"
+                continue
+            rows.append(row + (0.0,) * (len(SAMPLE_COLUMNS) - len(row)))
+        return [np.array(rows)] if rows else []
+
+    def _parse_line(self, line):
+        """One line with parse_text_line, None (counted as a parse error) if it cannot be parsed."""
+        line = line.decode('utf-8', 'replace').strip()
+        if not line:
+            return None
+        try:
+            return parse_text_line(line)
+        except Exception as e:
+            self.parse_errors += 1
+            self.last_error = f"{e} in {line!r}"
+            return None